@@ -1,9 +1,30 @@
 import random
-import os
 import json
+import time
+import argparse
+import atexit
+import gzip
+import importlib
+import sys
+import metrics
+from analytics import PlayerAnalytics
+from array import array
+from rules import COUNTERS_KEY, RULES, RulesEngine
+from snapshot import read_snapshot, take_snapshot, write_snapshot
+from sharedstate import SHARED_CAPACITY, share_storages
+from storage import (
+    RECORD_VIEWS, JsonStorage, WriteBehind, batched, encode_player_name, has_room, install_flush_handlers,
+    locked, open_storages, start_flush_timer,
+)
+from collections import namedtuple
+from functools import lru_cache
+from contextlib import nullcontext
 
 # node and linkedlist for action history storage (playing as "{player_name}")
 class Node:
+    # fixed attributes keep each node small
+    __slots__ = ("data", "next")
+
     def __init__(self, data):
         # store node data
         self.data = data
@@ -11,58 +32,299 @@ class Node:
         self.next = None
 
 class LinkedList:
-    def __init__(self):
+    def __init__(self, maxlen=None):
         # the head of the linked list
         self.head = None
+        # the last node, so append doesn't have to walk the list
+        self.tail = None
+        # number of nodes currently in the list
+        self.length = 0
+        # optional bound: once full, the oldest entry is overwritten
+        self.maxlen = maxlen
 
     def append(self, data):
+        # bounded mode: recycle the oldest node as the new tail (ring buffer)
+        if self.maxlen is not None and self.length >= self.maxlen:
+            if self.maxlen <= 0:
+                return
+            new_node = self.head
+            self.head = new_node.next
+            new_node.data = data
+            new_node.next = None
+            if self.head is None:
+                self.head = new_node
+            else:
+                self.tail.next = new_node
+            self.tail = new_node
+            return
         # create a new node with the given data
         new_node = Node(data)
         # if list is empty, set head to new node
         if not self.head:
             self.head = new_node
         else:
-            # otherwise, traverse to the end of the list
-            current = self.head
-            while current.next:
-                current = current.next
-            # link the last node to the new node
-            current.next = new_node
+            # otherwise, link the current tail to the new node
+            self.tail.next = new_node
+        self.tail = new_node
+        self.length += 1
 
-    def display(self):
-        # display all actions in this linked list as a list
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        # walk the list from oldest to newest entry
         current = self.head
-        actions = []
-        # traverse through the linked list
         while current:
-            actions.append(current.data)
+            yield current.data
             current = current.next
-        return actions
+
+    def display(self):
+        # display all actions in this linked list as a list
+        return list(self)
+
+
+class HistoryWriter:
+    """
+    streams action histories to a gzip-compressed jsonl session file, one
+    line per round: {"round": n, "player": name, "time": t, "actions": [...]}.
+    the file is opened in append mode, so every session adds a new gzip
+    member and earlier sessions are kept for later audit.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.file = gzip.open(file_path, "at", encoding="utf-8")
+        self.rounds = 0
+
+    def write_round(self, player_name, action_history):
+        # append one round's history as a single json line
+        self.rounds += 1
+        entry = {
+            "round": self.rounds,
+            "player": player_name,
+            "time": time.time(),
+            "actions": action_history.display(),
+        }
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def read_history(file_path):
+    # read back the rounds stored by HistoryWriter, one dict at a time
+    with gzip.open(file_path, "rt", encoding="utf-8") as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def round_event(player_name, result, bet, balance=None):
+    """
+    one finished round as a plain dict: the round-event log line and what
+    the achievements rules see. {"v": 1, "time": t, "player": name,
+    "bet": b, "player_hand": [...], "banker_hand": [...], "player_draw":
+    card or null, "banker_draw": card or null, "action": "hit"/"stand",
+    "outcome": ..., "balance": balance after the round or null}.
+    """
+    return {
+        "v": 1,
+        "time": time.time(),
+        "player": player_name,
+        "bet": bet,
+        "player_hand": result.player_hand,
+        "banker_hand": result.banker_hand,
+        "player_draw": result.player_hand[2] if len(result.player_hand) > 2 else None,
+        "banker_draw": result.banker_hand[2] if len(result.banker_hand) > 2 else None,
+        "action": result.action,
+        "outcome": result.outcome,
+        "balance": balance,
+    }
+
+
+class RoundLogWriter:
+    """
+    appends one json line per finished round (see round_event) to the
+    round-event log read by roundlog.py. paths ending in .gz are
+    gzip-compressed (a new member per session).
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        if file_path.endswith(".gz"):
+            self.file = gzip.open(file_path, "at", encoding="utf-8")
+        else:
+            self.file = open(file_path, "a", encoding="utf-8")
+
+    def write_event(self, event):
+        self.file.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+# order-statistics index for leaderboard rankings
+class _SkipNode:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level):
+        self.key = key
+        # forward pointers, one per level
+        self.next = [None] * level
+        # number of level-0 steps each forward pointer skips
+        self.width = [1] * level
+
+
+class RankIndex:
+    """
+    indexable skip list of unique sort keys. insert, remove, rank lookup
+    and positional access are all O(log n) expected, so a leaderboard can
+    answer "top k", "what rank is player x" and "ranks 1000-1050" without
+    sorting every player.
+    """
+    MAX_LEVEL = 32
+
+    def __init__(self, seed=9):
+        self.head = _SkipNode(None, self.MAX_LEVEL)
+        self.level = 1
+        self.length = 0
+        # private rng so the index never disturbs the game's random state
+        self.rng = random.Random(seed)
+
+    def __len__(self):
+        return self.length
+
+    def _random_level(self):
+        # each level is kept with probability 1/2
+        level = 1
+        while level < self.MAX_LEVEL and self.rng.random() < 0.5:
+            level += 1
+        return level
+
+    def insert(self, key):
+        # find the predecessor and its rank on every level
+        update = [self.head] * self.MAX_LEVEL
+        ranks = [0] * self.MAX_LEVEL
+        node = self.head
+        rank = 0
+        for level in range(self.level - 1, -1, -1):
+            following = node.next[level]
+            while following is not None and following.key < key:
+                rank += node.width[level]
+                node = following
+                following = node.next[level]
+            update[level] = node
+            ranks[level] = rank
+
+        new_level = self._random_level()
+        if new_level > self.level:
+            for level in range(self.level, new_level):
+                # the head spans the whole list on the new levels
+                self.head.width[level] = self.length + 1
+            self.level = new_level
+
+        new_node = _SkipNode(key, new_level)
+        for level in range(new_level):
+            previous = update[level]
+            steps = rank - ranks[level]
+            new_node.next[level] = previous.next[level]
+            previous.next[level] = new_node
+            new_node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+        # levels above the new node now skip one more element
+        for level in range(new_level, self.level):
+            update[level].width[level] += 1
+        self.length += 1
+
+    def remove(self, key):
+        # unlink 'key'; returns False if it isn't in the index
+        update = [self.head] * self.MAX_LEVEL
+        node = self.head
+        for level in range(self.level - 1, -1, -1):
+            following = node.next[level]
+            while following is not None and following.key < key:
+                node = following
+                following = node.next[level]
+            update[level] = node
+        target = node.next[0]
+        if target is None or target.key != key:
+            return False
+        for level in range(self.level):
+            previous = update[level]
+            if previous.next[level] is target:
+                previous.next[level] = target.next[level]
+                previous.width[level] += target.width[level] - 1
+            else:
+                previous.width[level] -= 1
+        while self.level > 1 and self.head.next[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+        return True
+
+    def rank(self, key):
+        # 0-based position of 'key', or None if it isn't in the index
+        node = self.head
+        rank = 0
+        for level in range(self.level - 1, -1, -1):
+            following = node.next[level]
+            while following is not None and following.key <= key:
+                rank += node.width[level]
+                node = following
+                following = node.next[level]
+            if node.key == key:
+                return rank - 1
+        return None
+
+    def slice(self, offset, limit=None):
+        # keys at positions offset .. offset + limit - 1 in sorted order
+        if offset < 0:
+            offset = 0
+        keys = []
+        if offset >= self.length or limit == 0:
+            return keys
+        # walk down the levels to the node at position 'offset'
+        node = self.head
+        remaining = offset + 1
+        for level in range(self.level - 1, -1, -1):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        while node is not None and (limit is None or len(keys) < limit):
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+# leaderboard orderings: each maps a player's stats to the part of the
+# sort key that comes before the name (smaller sorts first)
+RANK_KEYS = {
+    "wins": lambda stats: -stats["wins"],
+    "win_rate": lambda stats: -(stats["wins"] / stats["total_games"]) if stats["total_games"] else 0.0,
+    "total_games": lambda stats: -stats["total_games"],
+}
+
 
 # leaderboard system with detailed stats (playing as "{player_name}")
 class Leaderboard:
-    def __init__(self):
+    def __init__(self, storage=None):
         # path for storing leaderboard data
         self.file_path = "leaderboard.json"
-        # load existing data from file
+        # storage backend (see storage.py); the json file by default
+        self.storage = storage if storage is not None else JsonStorage(self.file_path)
+        # load existing data from storage
         self.data = self.load_leaderboard()
+        # rank indexes per sort key, built on first use and then kept up to date
+        self.indexes = {}
 
     def load_leaderboard(self):
-        # load leaderboard data from json file if it exists
-        if not os.path.exists(self.file_path):
-            return {}
+        # load leaderboard data from storage (an empty dict if there is none)
         try:
-            with open(self.file_path, "r") as file:
-                return json.load(file)
+            return self.storage.load()
         except Exception as e:
             print(f"Error loading leaderboard: {e}")
             return {}
 
     def save_leaderboard(self):
-        # save current leaderboard data to the json file
+        # save the full leaderboard data to storage
         try:
-            with open(self.file_path, "w") as file:
-                json.dump(self.data, file, indent=4)
+            self.storage.save(self.data)
         except Exception as e:
             print(f"Error saving leaderboard: {e}")
 
@@ -70,6 +332,10 @@ class Leaderboard:
         # if the player doesn't exist, initialize their record
         if name not in self.data:
             self.data[name] = {"wins": 0, "losses": 0, "ties": 0, "total_games": 0}
+        else:
+            # take the player out of the rank indexes before the stats change
+            for sort_by, index in self.indexes.items():
+                index.remove((RANK_KEYS[sort_by](self.data[name]), name))
         # update records based on the result
         if result == "win":
             self.data[name]["wins"] += 1
@@ -79,11 +345,61 @@ class Leaderboard:
             self.data[name]["ties"] += 1
         # increment total games
         self.data[name]["total_games"] += 1
+        # re-insert the player at their new position, O(log n) per index
+        for sort_by, index in self.indexes.items():
+            index.insert((RANK_KEYS[sort_by](self.data[name]), name))
         # save the updated leaderboard
-        self.save_leaderboard()
+        self.persist(name)
 
-    def display(self):
-        # display the leaderboard in a table-like format
+    def persist(self, name):
+        # save just this player's record (the json backend rewrites the file)
+        try:
+            self.storage.record(name, self.data[name])
+        except Exception as e:
+            print(f"Error saving leaderboard: {e}")
+
+    def ranked(self, offset=0, limit=None, sort_by="wins"):
+        # players by highest wins first (or another sort key), then by name
+        if sort_by == "wins" and hasattr(self.storage, "ranked"):
+            # sql-backed ranking query
+            try:
+                return self.storage.ranked(offset, -1 if limit is None else limit)
+            except Exception as e:
+                print(f"Error ranking leaderboard: {e}")
+        return self.page(offset, limit, sort_by)
+
+    def index_for(self, sort_by="wins"):
+        # rank index for a sort key; built once, then updated incrementally
+        index = self.indexes.get(sort_by)
+        if index is None:
+            rank_key = RANK_KEYS[sort_by]
+            index = RankIndex()
+            for name, stats in self.data.items():
+                index.insert((rank_key(stats), name))
+            # other processes change shared records, so their index can't be kept
+            if not getattr(self.data, "shared", False):
+                self.indexes[sort_by] = index
+        return index
+
+    def page(self, offset, limit=None, sort_by="wins"):
+        # (name, stats) pairs for ranks offset + 1 .. offset + limit
+        keys = self.index_for(sort_by).slice(offset, limit)
+        return [(name, self.data[name]) for _, name in keys]
+
+    def top(self, k, sort_by="wins"):
+        # the best k players for the given sort key
+        return self.page(0, k, sort_by)
+
+    def rank(self, name, sort_by="wins"):
+        # 1-based rank of a player, or none if they haven't played
+        stats = self.data.get(name)
+        if stats is None:
+            return None
+        position = self.index_for(sort_by).rank((RANK_KEYS[sort_by](stats), name))
+        return None if position is None else position + 1
+
+    def display(self, offset=0, limit=None, sort_by="wins"):
+        # display the leaderboard (optionally one page of it) in a table-like format
         print("============================================")
         print("               LEADERBOARD")
         print("============================================")
@@ -93,102 +409,203 @@ class Leaderboard:
             print(f"{'Name':<15} {'Wins':<5} {'Losses':<7} {'Ties':<5} {'Total Games':<12}")
             print("---------------------------------------------------------------")
             # sort players by highest wins first, then by name
-            for name, stats in sorted(self.data.items(), key=lambda x: (-x[1]["wins"], x[0])):
+            for name, stats in self.ranked(offset, limit, sort_by):
                 print(f"{name:<15} {stats['wins']:<5} {stats['losses']:<7} {stats['ties']:<5} {stats['total_games']:<12}")
         print("============================================")
 
 
-# simple custom hashmap implementation
+# custom hashmap: open addressing with a compact, insertion-ordered layout
+# marks a removed entry in the dense arrays
+_DELETED = object()
+# index slot states (non-negative values are positions in the dense arrays)
+_EMPTY_SLOT = -1
+_DUMMY_SLOT = -2
+# smallest table; capacities are always powers of two
+_MIN_CAPACITY = 8
+
+
+def _capacity_for(count):
+    # smallest power of two that keeps the load factor at or below 2/3
+    capacity = _MIN_CAPACITY
+    while capacity * 2 < count * 3:
+        capacity *= 2
+    return capacity
+
+
 class MyHashMap:
+    """
+    hashmap using open addressing. a small index table of ints points into
+    three dense parallel lists (hashes, keys, values) kept in insertion
+    order, so an entry costs a few machine words instead of a bucket list
+    plus a [key, value] list. the table grows when it is more than 2/3 full
+    and shrinks when fewer than 1/8 of the slots are live.
+    """
     def __init__(self, size=10):
-        # create a list of buckets, each bucket is a list of [key, value] pairs
-        self.size = size
-        self.buckets = [[] for _ in range(self.size)]
-
-    def _hash(self, key):
-        # compute hash index by built-in hash function modded by size
-        return hash(key) % self.size
+        # 'size' is the expected number of entries; the table grows on demand
+        self.count = 0
+        self._build(_capacity_for(size), [], [], [])
+
+    def _build(self, capacity, hashes, keys, values):
+        # (re)create the index table for the given dense arrays
+        self.size = capacity
+        self._mask = capacity - 1
+        self._index = array("q", [_EMPTY_SLOT]) * capacity
+        self._hashes = hashes
+        self._keys = keys
+        self._values = values
+        # live entries plus dummy slots left behind by remove()
+        self._used = len(keys)
+        index = self._index
+        mask = self._mask
+        for position, key_hash in enumerate(hashes):
+            slot = key_hash & mask
+            perturb = key_hash & 0xFFFFFFFFFFFFFFFF
+            while index[slot] != _EMPTY_SLOT:
+                perturb >>= 5
+                slot = (slot * 5 + perturb + 1) & mask
+            index[slot] = position
+
+    def _resize(self, capacity):
+        # drop removed entries from the dense arrays and rebuild the index
+        if self.count == len(self._keys):
+            hashes, keys, values = self._hashes, self._keys, self._values
+        else:
+            hashes, keys, values = [], [], []
+            for position, key in enumerate(self._keys):
+                if key is not _DELETED:
+                    hashes.append(self._hashes[position])
+                    keys.append(key)
+                    values.append(self._values[position])
+        self._build(capacity, hashes, keys, values)
+
+    def _lookup(self, key, key_hash):
+        # return (slot, position) of key, or (first free slot, -1) if missing
+        index = self._index
+        mask = self._mask
+        hashes = self._hashes
+        keys = self._keys
+        slot = key_hash & mask
+        perturb = key_hash & 0xFFFFFFFFFFFFFFFF
+        free_slot = -1
+        while True:
+            position = index[slot]
+            if position == _EMPTY_SLOT:
+                return (slot if free_slot < 0 else free_slot), -1
+            if position == _DUMMY_SLOT:
+                if free_slot < 0:
+                    free_slot = slot
+            elif hashes[position] == key_hash:
+                found = keys[position]
+                if found is key or found == key:
+                    return slot, position
+            perturb >>= 5
+            slot = (slot * 5 + perturb + 1) & mask
 
     def set(self, key, value):
         # set or update the value for the given key
-        index = self._hash(key)
-        bucket = self.buckets[index]
-        # if key already exists, update it; otherwise, append a new pair
-        for pair in bucket:
-            if pair[0] == key:
-                pair[1] = value
-                return
-        bucket.append([key, value])
+        key_hash = hash(key)
+        slot, position = self._lookup(key, key_hash)
+        if position >= 0:
+            self._values[position] = value
+            return
+        if self._index[slot] == _EMPTY_SLOT:
+            self._used += 1
+        self._index[slot] = len(self._keys)
+        self._hashes.append(key_hash)
+        self._keys.append(key)
+        self._values.append(value)
+        self.count += 1
+        # grow (or clean out dummies and removed entries) once the table, or
+        # the dense arrays, reach 2/3 of the table size; a key that reuses a
+        # dummy slot still appends an entry, so the arrays are checked too
+        if max(self._used, len(self._keys)) * 3 >= self.size * 2:
+            self._resize(_capacity_for(self.count * 2))
 
     def get(self, key):
         # retrieve the value for the given key, or none if not found
-        index = self._hash(key)
-        bucket = self.buckets[index]
-        for pair in bucket:
-            if pair[0] == key:
-                return pair[1]
-        return None
+        position = self._lookup(key, hash(key))[1]
+        if position < 0:
+            return None
+        return self._values[position]
 
     def remove(self, key):
         # remove the key-value pair if it exists
-        index = self._hash(key)
-        bucket = self.buckets[index]
-        for i, pair in enumerate(bucket):
-            if pair[0] == key:
-                del bucket[i]
-                return True
-        return False
+        slot, position = self._lookup(key, hash(key))
+        if position < 0:
+            return False
+        self._index[slot] = _DUMMY_SLOT
+        self._keys[position] = _DELETED
+        self._values[position] = None
+        self.count -= 1
+        # shrink once fewer than 1/8 of the slots are live
+        if self.size > _MIN_CAPACITY and self.count * 8 < self.size:
+            self._resize(_capacity_for(self.count))
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self._lookup(key, hash(key))[1] >= 0
+
+    def __iter__(self):
+        # iterate over keys without building a list
+        for key in self._keys:
+            if key is not _DELETED:
+                yield key
+
+    def iter_items(self):
+        # iterate over (key, value) pairs without building a list
+        values = self._values
+        for position, key in enumerate(self._keys):
+            if key is not _DELETED:
+                yield key, values[position]
 
     def keys(self):
         # return a list of all keys in the hashmap
-        all_keys = []
-        for bucket in self.buckets:
-            for pair in bucket:
-                all_keys.append(pair[0])
-        return all_keys
+        return list(self)
 
     def items(self):
         # return a list of all (key, value) pairs in the hashmap
-        all_items = []
-        for bucket in self.buckets:
-            for pair in bucket:
-                all_items.append((pair[0], pair[1]))
-        return all_items
+        return list(self.iter_items())
 
 
 # achievements system (playing as "{player_name}")
 class Achievements:
-    def __init__(self):
+    def __init__(self, storage=None, rules=None):
         # file path for achievements data
         self.file_path = "achievements.json"
+        # storage backend (see storage.py); the json file by default
+        self.storage = storage if storage is not None else JsonStorage(self.file_path)
+        # rules engine deciding what each round unlocks (see rules.py)
+        self.rules = rules if rules is not None else RulesEngine(RULES)
         # store achievements data in a hashmap
         self.data_map = MyHashMap()
         self.load_achievements()
 
     def load_achievements(self):
-        # load achievements from file if it exists
-        if not os.path.exists(self.file_path):
-            return
-
+        # load achievements from storage if there are any
         try:
-            with open(self.file_path, "r") as file:
-                data = json.load(file)
+            data = self.storage.load()
         except Exception as e:
             print(f"Error loading achievements: {e}")
             data = {}
+        if isinstance(data, RECORD_VIEWS):
+            # sharded / mmap storage: players are read on first use instead
+            self.data_map = data
+            return
 
         # insert achievements into the hashmap
         for player_name, achievements_dict in data.items():
             self.data_map.set(player_name, achievements_dict)
 
     def save_achievements(self):
-        # extract achievements from hashmap and save to json
+        # extract achievements from hashmap and save them all to storage
         data = {}
-        for player_name, achievements_dict in self.data_map.items():
+        for player_name, achievements_dict in self.data_map.iter_items():
             data[player_name] = achievements_dict
         try:
-            with open(self.file_path, "w") as file:
-                json.dump(data, file, indent=4)
+            self.storage.save(data)
         except Exception as e:
             print(f"Error saving achievements: {e}")
 
@@ -201,45 +618,94 @@ class Achievements:
         if title not in achievements_dict:
             achievements_dict[title] = description
             self.data_map.set(player_name, achievements_dict)
-            self.save_achievements()
+            self.persist(player_name)
+
+    def record_round(self, player_name, event):
+        """
+        run a round event (see round_event) through the rules engine and
+        save everything it unlocks, plus the player's updated counters,
+        with a single write. returns the rules that were unlocked.
+        """
+        # batched: the record isn't changed while a background flush writes it
+        with batched(self.storage):
+            achievements_dict = self.data_map.get(player_name)
+            if achievements_dict is None:
+                achievements_dict = {}
+            counters = achievements_dict.get(COUNTERS_KEY)
+            if counters is not None and player_name not in self.rules.counters:
+                # pick up the counters where the last run left them
+                self.rules.restore(player_name, counters)
+            unlocked = self.rules.process(player_name, event, achievements_dict)
+            for rule in unlocked:
+                achievements_dict[rule.title] = rule.description
+            achievements_dict[COUNTERS_KEY] = dict(self.rules.counters[player_name])
+            self.data_map.set(player_name, achievements_dict)
+            self.persist(player_name)
+        return unlocked
+
+    def persist(self, player_name):
+        # save just this player's achievements (the json backend rewrites the file)
+        try:
+            self.storage.record(player_name, self.data_map.get(player_name))
+        except Exception as e:
+            print(f"Error saving achievements: {e}")
 
     def display_player_achievements(self, player_name):
         # display all achievements for a given player
-        achievements_dict = self.data_map.get(player_name)
-        if not achievements_dict:
+        achievements_dict = self.data_map.get(player_name) or {}
+        titles = [(title, description) for title, description in achievements_dict.items()
+                  if title != COUNTERS_KEY]
+        if not titles:
             print("No achievements unlocked yet.")
             return
-        for title, description in achievements_dict.items():
+        for title, description in titles:
             print(f"{title}: {description}")
 
 
+def balance_after_loss(current_balance, initial_balance, bet, fraction=0.5):
+    """
+    bust-replenish policy: deduct 'bet' and, if the balance hits 0 or below,
+    top it back up to 'fraction' of the initial balance.
+    """
+    current_balance -= bet
+    if current_balance <= 0:
+        current_balance = int(initial_balance * fraction)
+    return current_balance
+
+
 # new class: balance manager
 class BalanceManager:
     """
-    tracks each player's money using a json file and a myhashmap.
+    tracks each player's money using a storage backend (a json file by
+    default) and a myhashmap.
     each player's name is the key; the value is a dict with:
       {
         "initial_balance": int,
         "current_balance": int
       }
     """
-    def __init__(self):
+    def __init__(self, replenish_fraction=0.5, storage=None):
         # path to balances json file
         self.file_path = "balances.json"
+        # storage backend (see storage.py); the json file by default
+        self.storage = storage if storage is not None else JsonStorage(self.file_path)
+        # share of the initial balance given back when a player goes bust
+        self.replenish_fraction = replenish_fraction
         # myhashmap to store player balance data
         self.data_map = MyHashMap()
         self.load_balances()
 
     def load_balances(self):
         """
-        load balances from the json file. if file is missing or corrupted,
+        load balances from storage. if the data is missing or corrupted,
         gracefully handle by printing an error and continuing with empty data.
         """
-        if not os.path.exists(self.file_path):
-            return
         try:
-            with open(self.file_path, "r") as file:
-                data = json.load(file)
+            data = self.storage.load()
+            if isinstance(data, RECORD_VIEWS):
+                # sharded / mmap storage: players are read on first use instead
+                self.data_map = data
+                return
             # check if data is a valid dict
             if not isinstance(data, dict):
                 print("Balances file is corrupted or not in expected format. Starting fresh.")
@@ -257,15 +723,14 @@ class BalanceManager:
 
     def save_balances(self):
         """
-        save all balances from self.data_map to the json file.
+        save all balances from self.data_map to storage.
         """
         data = {}
         # build a dictionary to save from the myhashmap data
-        for player_name, balances in self.data_map.items():
+        for player_name, balances in self.data_map.iter_items():
             data[player_name] = balances
         try:
-            with open(self.file_path, "w") as file:
-                json.dump(data, file, indent=4)
+            self.storage.save(data)
         except Exception as e:
             print(f"Error saving balances: {e}")
 
@@ -274,12 +739,14 @@ class BalanceManager:
         if a player doesn't yet have a balance, create a default one.
         otherwise, return the existing balance.
         """
-        existing = self.data_map.get(player_name)
-        # if no record, create one with default values
-        if not existing:
-            existing = {"initial_balance": 100, "current_balance": 100}
-            self.data_map.set(player_name, existing)
-            self.save_balances()
+        # shared records: another process can't create or update the player in between
+        with locked(player_name, self.storage):
+            existing = self.data_map.get(player_name)
+            # if no record, create one with default values
+            if not existing:
+                existing = {"initial_balance": 100, "current_balance": 100}
+                self.data_map.set(player_name, existing)
+                self.persist(player_name)
         return existing
 
     def view_balance(self, player_name):
@@ -302,23 +769,37 @@ class BalanceManager:
         balance_data = self.create_or_get_balance(player_name)
         balance_data["current_balance"] += bet
         self.data_map.set(player_name, balance_data)
-        self.save_balances()
+        self.persist(player_name)
 
     def handle_loss(self, player_name, bet=10):
         """
         deduct 'bet' from the player's current balance. if balance <= 0,
-        replenish half of the initial balance.
+        replenish 'replenish_fraction' (half by default) of the initial balance.
         """
         balance_data = self.create_or_get_balance(player_name)
-        balance_data["current_balance"] -= bet
-        if balance_data["current_balance"] <= 0:
-            fraction = 0.5
-            balance_data["current_balance"] = int(balance_data["initial_balance"] * fraction)
+        balance_data["current_balance"] = balance_after_loss(
+            balance_data["current_balance"], balance_data["initial_balance"],
+            bet, self.replenish_fraction)
         self.data_map.set(player_name, balance_data)
-        self.save_balances()
+        self.persist(player_name)
+
+    def persist(self, player_name):
+        """
+        save one player's balance. the json backend rewrites the whole file;
+        the journal and sqlite backends only write this player's record.
+        """
+        try:
+            self.storage.record(player_name, self.data_map.get(player_name))
+        except Exception as e:
+            print(f"Error saving balances: {e}")
 
 
 # helper functions for game logic (playing as "{player_name}")
+# card values in a single deck; each value appears 4 times
+DECK_VALUES = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+# a full round uses at most 6 cards (2 + 2 dealt, 1 hit, 1 banker draw)
+MIN_CARDS = 6
+
 def initialize_card_count():
     # return a dictionary for card values 1-10, each with 4 occurrences
     return {value: 4 for value in range(1, 11)}
@@ -340,6 +821,506 @@ def calculate_probabilities(current_total, remaining_cards):
     probability_lucky_9 = (lucky_9_count / total_possible) * 100
     return probability_lucky_9
 
+
+class Deck:
+    """
+    a single 40-card deck. cards are drawn from the end of 'cards' and
+    'card_count' is kept in sync with every draw, so callers never have
+    to update the counts by hand.
+    """
+    def __init__(self, rng=random):
+        self.cards = []
+        self.card_count = {}
+        self.reshuffle(rng)
+
+    def reshuffle(self, rng=random):
+        # rebuild and shuffle a fresh deck using the given rng
+        self.cards = DECK_VALUES * 4
+        rng.shuffle(self.cards)
+        self.card_count = initialize_card_count()
+
+    @classmethod
+    def from_cards(cls, cards):
+        # build a deck with an exact card order (the last card is drawn first)
+        deck = cls.__new__(cls)
+        deck.cards = list(cards)
+        deck.card_count = {value: 0 for value in DECK_VALUES}
+        for card in deck.cards:
+            deck.card_count[card] += 1
+        return deck
+
+    def remaining(self):
+        # number of cards left to draw
+        return len(self.cards)
+
+    def needs_shuffle(self):
+        # too few cards left for a full round
+        return len(self.cards) < MIN_CARDS
+
+    def draw(self):
+        # take the top card and keep the counts in sync
+        card = self.cards.pop()
+        self.card_count[card] -= 1
+        return card
+
+
+class FenwickTree:
+    """
+    binary indexed tree over non-negative weights at positions 1..size.
+    add() and find() are O(log size), which makes weighted sampling of a
+    card value by its remaining count O(log n).
+    """
+    def __init__(self, size):
+        self.size = size
+        self.tree = array("l", [0]) * (size + 1)
+        # highest power of two <= size, the first step of find()
+        self.top_bit = 1
+        while self.top_bit * 2 <= size:
+            self.top_bit *= 2
+
+    def add(self, position, delta):
+        tree = self.tree
+        while position <= self.size:
+            tree[position] += delta
+            position += position & -position
+
+    def find(self, target):
+        # smallest position whose prefix sum exceeds 'target' (0 <= target < total)
+        tree = self.tree
+        position = 0
+        step = self.top_bit
+        while step:
+            following = position + step
+            if following <= self.size and tree[following] <= target:
+                position = following
+                target -= tree[following]
+            step >>= 1
+        return position + 1
+
+
+class Shoe:
+    """
+    multi-deck shoe with a cut card. card_count is a compact array indexed
+    by card value (index 0 is unused), so card_count[value] works just like
+    the single deck's dict. cards are drawn either from a pre-shuffled
+    array by position ("index") or by sampling a value weighted by its
+    remaining count through a fenwick tree ("weighted"). once 'penetration'
+    of the shoe has been dealt, the round in progress finishes and the shoe
+    is reshuffled before the next one.
+    """
+    def __init__(self, decks=6, penetration=0.75, rng=random, draw_mode="index"):
+        if draw_mode not in ("index", "weighted"):
+            raise ValueError(f"unknown draw mode: {draw_mode}")
+        self.decks = decks
+        self.penetration = penetration
+        self.draw_mode = draw_mode
+        # the weighted mode samples at draw time, so it keeps the rng
+        self.rng = rng
+        self.card_count = array("l", [0]) * (len(DECK_VALUES) + 1)
+        self.cards = array("b")
+        self.position = 0
+        self.size = len(DECK_VALUES) * 4 * decks
+        # cards dealt before the cut card comes out
+        self.cut = max(MIN_CARDS, min(self.size - MIN_CARDS, int(self.size * penetration)))
+        self.tree = None
+        self.reshuffle(rng)
+
+    def reshuffle(self, rng=None):
+        # refill every value and, in index mode, shuffle a fresh card order
+        if rng is not None:
+            self.rng = rng
+        per_value = 4 * self.decks
+        for value in DECK_VALUES:
+            self.card_count[value] = per_value
+        self.position = 0
+        if self.draw_mode == "index":
+            self.cards = array("b", DECK_VALUES) * per_value
+            self.rng.shuffle(self.cards)
+        else:
+            self.tree = FenwickTree(len(DECK_VALUES))
+            for value in DECK_VALUES:
+                self.tree.add(value, per_value)
+
+    def remaining(self):
+        # number of cards left in the shoe
+        return self.size - self.position
+
+    def needs_shuffle(self):
+        # the cut card has come out (or the shoe can't cover a full round)
+        return self.position >= self.cut or self.remaining() < MIN_CARDS
+
+    def draw(self):
+        # deal the next card and keep the counts in sync
+        if self.draw_mode == "index":
+            card = self.cards[self.position]
+        else:
+            card = self.tree.find(self.rng.randrange(self.size - self.position))
+            self.tree.add(card, -1)
+        self.position += 1
+        self.card_count[card] -= 1
+        return card
+
+    def composition(self):
+        # read-only view of the counts indexed by card value; nothing is copied
+        return memoryview(self.card_count).toreadonly()
+
+    @classmethod
+    def from_snapshot(cls, snapshot, rng):
+        # the shoe saved in a snapshot.Snapshot, mid-shoe, without reshuffling
+        shoe = cls.__new__(cls)
+        shoe.decks = snapshot.decks
+        shoe.penetration = snapshot.penetration
+        shoe.draw_mode = snapshot.draw_mode
+        shoe.rng = rng
+        shoe.card_count = array("l", snapshot.card_count)
+        shoe.cards = array("b", snapshot.cards)
+        shoe.position = snapshot.position
+        shoe.size = snapshot.size
+        shoe.cut = snapshot.cut
+        shoe.tree = None
+        if shoe.draw_mode == "weighted":
+            shoe.tree = FenwickTree(len(DECK_VALUES))
+            for value in DECK_VALUES:
+                shoe.tree.add(value, snapshot.card_count[value])
+        return shoe
+
+
+def make_deck(decks=1, penetration=None, rng=random, draw_mode="index"):
+    # the classic single 40-card deck, or a multi-deck shoe (75% penetration by default)
+    if decks == 1 and penetration is None and draw_mode == "index":
+        return Deck(rng)
+    return Shoe(decks, 0.75 if penetration is None else penetration, rng, draw_mode)
+
+
+def table_rng(seed=None, table=0):
+    # a private rng per table; the same (seed, table) always deals the same cards
+    if seed is None:
+        return random.Random()
+    return random.Random(f"lucky9:table:{seed}:{table}")
+
+
+def restore_session(snapshot):
+    """
+    (deck, rng, history) from a snapshot.Snapshot: the deck and rng ready to
+    deal the next card, and the saved action history as a LinkedList.
+    """
+    rng = random.Random()
+    rng.setstate(snapshot.rng_state)
+    history = LinkedList()
+    for entry in snapshot.history:
+        history.append(entry)
+    if snapshot.deck_kind == "shoe":
+        return Shoe.from_snapshot(snapshot, rng), rng, history
+    return Deck.from_cards(snapshot.cards), rng, history
+
+
+# compact record of one finished round. 'action' is the player's decision
+# ("hit" or "stand"); 'reshuffled' tells whether a fresh deck was needed.
+RoundResult = namedtuple(
+    "RoundResult",
+    "outcome player_hand banker_hand player_total banker_total action reshuffled",
+)
+
+
+def banker_draws(banker_total, player_total):
+    # house rule: banker draws on 0-2, or on 3-5 when the player is ahead
+    return banker_total < 3 or (banker_total < 6 and player_total > banker_total)
+
+
+def make_banker_rule(always_below=3, chase_below=6):
+    """
+    build a banker third-card rule: draw when the banker total is below
+    'always_below', or below 'chase_below' while the player is ahead.
+    make_banker_rule() behaves exactly like banker_draws.
+    """
+    if (always_below, chase_below) == (3, 6):
+        return banker_draws
+
+    def banker_rule(banker_total, player_total):
+        return banker_total < always_below or (banker_total < chase_below and player_total > banker_total)
+    return banker_rule
+
+
+def stand_policy(player_hand, banker_hand, card_count):
+    # never draw a third card
+    return "stand"
+
+
+def make_threshold_policy(limit=5):
+    # build a policy that hits while the player's total is below 'limit'
+    def threshold_policy(player_hand, banker_hand, card_count):
+        if (player_hand[0] + player_hand[1]) % 10 < limit:
+            return "hit"
+        return "stand"
+    return threshold_policy
+
+
+# exact odds of one decision: probabilities and expected value per unit bet
+Odds = namedtuple("Odds", "win tie loss ev")
+# advisor output for both decisions plus the suggested action
+Advice = namedtuple("Advice", "hit stand best lucky_9")
+
+
+def _resolve_banker(counts, total_cards, player_total, banker_total, banker_rule):
+    # (win, tie, loss) once the player is done, including the banker's third draw
+    if total_cards == 0 or not banker_rule(banker_total, player_total):
+        if player_total > banker_total:
+            return 1.0, 0.0, 0.0
+        if player_total < banker_total:
+            return 0.0, 0.0, 1.0
+        return 0.0, 1.0, 0.0
+    win = tie = 0.0
+    for index in range(10):
+        count = counts[index]
+        if count:
+            new_total = (banker_total + index + 1) % 10
+            if player_total > new_total:
+                win += count
+            elif player_total == new_total:
+                tie += count
+    win /= total_cards
+    tie /= total_cards
+    return win, tie, 1.0 - win - tie
+
+
+@lru_cache(maxsize=65536)
+def _exact_advice(counts, player_total, banker_total, banker_rule):
+    # counts[i] is the number of cards with value i + 1 left in the deck
+    total_cards = sum(counts)
+    stand = _resolve_banker(counts, total_cards, player_total, banker_total, banker_rule)
+
+    if total_cards == 0:
+        hit = stand
+        lucky_9 = 0.0
+    else:
+        win = tie = loss = 0.0
+        remaining = list(counts)
+        for index in range(10):
+            count = counts[index]
+            if not count:
+                continue
+            # draw this card for the player, then let the banker play
+            remaining[index] -= 1
+            outcome = _resolve_banker(remaining, total_cards - 1,
+                                      (player_total + index + 1) % 10, banker_total, banker_rule)
+            remaining[index] += 1
+            weight = count / total_cards
+            win += weight * outcome[0]
+            tie += weight * outcome[1]
+            loss += weight * outcome[2]
+        hit = (win, tie, loss)
+        # the card that turns the player's total into 9
+        lucky_9 = counts[(8 - player_total) % 10] / total_cards
+
+    hit_odds = Odds(hit[0], hit[1], hit[2], hit[0] - hit[2])
+    stand_odds = Odds(stand[0], stand[1], stand[2], stand[0] - stand[2])
+    best = "hit" if hit_odds.ev > stand_odds.ev else "stand"
+    return Advice(hit_odds, stand_odds, best, lucky_9)
+
+
+def advise(player_hand, banker_hand, card_count, banker_rule=banker_draws):
+    """
+    exact win/tie/loss odds and expected value of hitting vs standing,
+    computed from the 10-bucket card_count histogram. results are memoized
+    on the deck composition, so repeated queries in a shoe are O(1).
+    """
+    counts = tuple(map(card_count.__getitem__, DECK_VALUES))
+    return _exact_advice(counts, calculate_hand_total(player_hand),
+                         calculate_hand_total(banker_hand), banker_rule)
+
+
+def optimal_policy(player_hand, banker_hand, card_count):
+    # pick whichever decision has the higher exact expected value
+    return advise(player_hand, banker_hand, card_count).best
+
+
+def make_count_policy(min_improve=0.5):
+    """
+    build a count-aware policy: hit when at least 'min_improve' of the
+    cards left in the deck would raise the player's total, as counted
+    from card_count.
+    """
+    def count_policy(player_hand, banker_hand, card_count):
+        player_total = calculate_hand_total(player_hand)
+        remaining = 0
+        improving = 0
+        for value in DECK_VALUES:
+            count = card_count[value]
+            remaining += count
+            if (player_total + value) % 10 > player_total:
+                improving += count
+        if remaining and improving >= min_improve * remaining:
+            return "hit"
+        return "stand"
+    return count_policy
+
+
+# decision policies (strategies) by name. a policy is any function
+# policy(player_hand, banker_hand, card_count) -> "hit" or "stand" that gets
+# the player's two cards, the banker's two face-up cards and the counts of
+# the cards left in the deck. see load_policy for plugging in your own.
+POLICIES = {
+    "stand": stand_policy,
+    "threshold": make_threshold_policy(5),
+    "count": make_count_policy(0.5),
+    "optimal": optimal_policy,
+}
+
+
+def load_policy(spec):
+    """
+    a policy by name from POLICIES, or any importable function given as
+    "module:function" (e.g. "mystrategies:cautious").
+    """
+    if spec in POLICIES:
+        return POLICIES[spec]
+    module_name, _, attribute = spec.partition(":")
+    if not attribute:
+        raise ValueError(f"unknown policy {spec!r}; use one of {sorted(POLICIES)} or module:function")
+    module = importlib.import_module(module_name)
+    return getattr(module, attribute)
+
+
+def deal_round(deck, rng=random):
+    """
+    first half of a round: reshuffle if needed and deal two cards each,
+    alternating player and banker. returns (player_hand, banker_hand,
+    reshuffled). used directly when the decision arrives asynchronously.
+    """
+    reshuffled = False
+    # if deck is too small (or the cut card is out), reinitialize
+    if deck.needs_shuffle():
+        deck.reshuffle(rng)
+        reshuffled = True
+    draw = deck.draw
+    player_card_1 = draw()
+    banker_card_1 = draw()
+    player_card_2 = draw()
+    banker_card_2 = draw()
+    return [player_card_1, player_card_2], [banker_card_1, banker_card_2], reshuffled
+
+
+def finish_round(deck, player_hand, banker_hand, action, reshuffled=False, banker_rule=banker_draws):
+    """
+    second half of a round: apply the player's "hit"/"stand" decision, the
+    banker's third-card rule and the outcome. returns a RoundResult.
+    """
+    player_total = (player_hand[0] + player_hand[1]) % 10
+    banker_total = (banker_hand[0] + banker_hand[1]) % 10
+    if action == "hit" and deck.remaining():
+        player_card = deck.draw()
+        player_hand.append(player_card)
+        player_total = (player_total + player_card) % 10
+
+    # banker logic for drawing a third card
+    if deck.remaining() and banker_rule(banker_total, player_total):
+        banker_card = deck.draw()
+        banker_hand.append(banker_card)
+        banker_total = (banker_total + banker_card) % 10
+
+    # decide outcome: player win, banker win, or tie
+    if player_total > banker_total:
+        outcome = "win"
+    elif player_total < banker_total:
+        outcome = "loss"
+    else:
+        outcome = "tie"
+    return RoundResult(outcome, player_hand, banker_hand, player_total, banker_total, action, reshuffled)
+
+
+def play_round(deck, policy, rng=random, banker_rule=banker_draws):
+    """
+    play one round of lucky 9 without any prompts or output.
+    'policy(player_hand, banker_hand, card_count)' returns "hit" or "stand";
+    'rng' is only used when the deck has to be reshuffled.
+    returns a RoundResult.
+    """
+    player_hand, banker_hand, reshuffled = deal_round(deck, rng)
+    # player's decision
+    action = policy(player_hand, banker_hand, deck.card_count)
+    return finish_round(deck, player_hand, banker_hand, action, reshuffled, banker_rule)
+
+
+def leaderboard_counters(leaderboard):
+    """
+    seed for the achievements RulesEngine: a player's counters before
+    'event', taken from their leaderboard stats (which already include it).
+    """
+    def seed(player_name, event):
+        stats = leaderboard.data.get(player_name)
+        if stats is None:
+            return {}
+        outcome = event["outcome"] if event else None
+        return {
+            "games": stats["total_games"] - (1 if event else 0),
+            "wins": stats["wins"] - (outcome == "win"),
+            "losses": stats["losses"] - (outcome == "loss"),
+            "ties": stats["ties"] - (outcome == "tie"),
+        }
+    return seed
+
+
+def record_round_result(leaderboard, balance_manager, player_name, outcome, bet, analytics=None):
+    # update the leaderboard and balances for a finished round in one batch,
+    # holding the player's record lock when the records are shared between processes
+    with locked(player_name, leaderboard.storage, balance_manager.storage), \
+            batched(leaderboard.storage, balance_manager.storage):
+        # a full shared segment refuses a new player before any of the round is written
+        if not has_room(player_name, leaderboard.storage, balance_manager.storage):
+            raise ValueError(f"no room for new player {player_name!r} in the shared records")
+        leaderboard.add_game_result(player_name, outcome)
+        if outcome == "win":
+            balance_manager.handle_win(player_name, bet=bet)
+        elif outcome == "loss":
+            balance_manager.handle_loss(player_name, bet=bet)
+        # ties do not alter balance
+    # running stats of this session only, not saved (see analytics.py)
+    if analytics is not None:
+        analytics.record(player_name, outcome, bet)
+
+
+def display_player_stats(analytics, player_name):
+    # print the player's running stats from this session
+    stats = analytics.stats(player_name)
+    if stats is None:
+        print(f"No rounds played by {player_name} in this session.")
+        return
+    print(f"Session stats for {player_name}:")
+    print(f"  Games: {stats['games']} | Win rate: {stats['win_rate'] * 100:.1f}%")
+    print(f"  Streak: {stats['streak']:+d} | Longest win streak: {stats['longest_win_streak']} "
+          f"| Longest loss streak: {stats['longest_loss_streak']}")
+    print(f"  Average bet: {stats['average_bet']:.2f}")
+    print(f"  Net, last {analytics.window} rounds: {stats['net_last_rounds']} "
+          f"| last {analytics.horizon / 60:.0f} minutes: {stats['net_last_window']}")
+
+
+def build_action_history(result):
+    # turn a round result into the action history shown to the player
+    action_history = LinkedList()
+    player_initial = result.player_hand[:2]
+    banker_initial = result.banker_hand[:2]
+    action_history.append(f"Player's initial hand: {player_initial} (total: {calculate_hand_total(player_initial)})")
+    action_history.append(f"Banker's initial hand: {banker_initial} (total: {calculate_hand_total(banker_initial)})")
+    if result.action == "hit":
+        if len(result.player_hand) < 3:
+            action_history.append("Hit attempted, but deck empty.")
+        else:
+            action_history.append(f"Player hits and draws: {result.player_hand[2]} | New total: {result.player_total}")
+            if result.player_total == 9:
+                action_history.append("Player hits Lucky 9 and wins!")
+    else:
+        action_history.append(f"Player stands with total: {result.player_total}")
+    if len(result.banker_hand) > 2:
+        action_history.append(f"Banker draws: {result.banker_hand[2]} | New total: {result.banker_total}")
+    if result.outcome == "win":
+        action_history.append("Player wins!")
+    elif result.outcome == "loss":
+        action_history.append("Banker wins!")
+    else:
+        action_history.append("It's a tie!")
+    return action_history
+
+
 def get_valid_input(prompt, valid_choices):
     # repeatedly prompt the user until valid input is entered
     while True:
@@ -349,6 +1330,26 @@ def get_valid_input(prompt, valid_choices):
         print(f"Invalid input. Please enter one of {valid_choices}.")
 
 
+def get_valid_name(prompt, fixed_width=False, storages=()):
+    """
+    prompt for a player name. with 'fixed_width' (mmap and shared stores,
+    whose rows hold a limited name), repeat until the name fits a row, and
+    while 'storages' are full and have no record for the name.
+    """
+    while True:
+        player_name = input(prompt).strip()
+        if fixed_width:
+            try:
+                encode_player_name(player_name)
+            except ValueError as e:
+                print(f"Invalid name: {e}.")
+                continue
+        if not has_room(player_name, *storages):
+            print("The shared records are full; choose an existing player.")
+            continue
+        return player_name
+
+
 def get_valid_bet(balance_manager, player_name):
     """
     prompt the player to enter a bet between 1 and their current balance.
@@ -374,130 +1375,211 @@ def get_valid_bet(balance_manager, player_name):
         return bet
 
 
+def interactive_policy(player_hand, banker_hand, card_count):
+    # ask the player at the keyboard whether to hit or stand
+    player_total = calculate_hand_total(player_hand)
+    banker_total = calculate_hand_total(banker_hand)
+    print("============================================")
+    print(f"Player's hand: {player_hand} | Total: {player_total}")
+    print(f"Banker's hand: {banker_hand} | Total: {banker_total}")
+    print("============================================")
+
+    # exact odds for both decisions from the current card counts
+    advice = advise(player_hand, banker_hand, card_count)
+    print(f"Probability of hitting a Lucky 9: {advice.lucky_9 * 100:.2f}%")
+    for label, odds in (("Hit", advice.hit), ("Stand", advice.stand)):
+        print(f"{label:<6} win {odds.win * 100:5.1f}% | tie {odds.tie * 100:5.1f}% | "
+              f"loss {odds.loss * 100:5.1f}% | EV {odds.ev:+.3f}")
+    print(f"Suggested: {advice.best}")
+
+    # player's decision (hit, stand, or view)
+    while True:
+        action = get_valid_input("Do you want to hit, stand, or view remaining cards? (hit/stand/view): ", ["hit", "stand", "view"])
+
+        if action == 'hit':
+            return "hit"
+        elif action == 'stand':
+            print("You chose to stand.")
+            return "stand"
+        elif action == 'view':
+            print("Remaining cards in the deck:")
+            print({value: card_count[value] for value in DECK_VALUES})
+
+
 # main game logic (playing as "{player_name}")
-def play_lucky9(cards, card_count, leaderboard, player_name, achievements, balance_manager):
+def play_lucky9(deck, leaderboard, player_name, achievements, balance_manager, round_log=None,
+                policy=interactive_policy, rng=random, analytics=None):
     # first, get a valid bet from the player
     bet_amount = get_valid_bet(balance_manager, player_name)
     # if bet is 0, skip the round
     if bet_amount == 0:
         print(f"{player_name} has insufficient funds or bet was invalid. Round skipped.")
-        return LinkedList(), cards, card_count
-
-    player_hand = []
-    banker_hand = []
-    action_history = LinkedList()
+        return LinkedList()
 
-    # if deck is too small, reinitialize
-    if len(cards) < 6:
+    if deck.needs_shuffle():
         print("Not enough cards to continue the game. Re-initializing deck.")
-        cards = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10] * 4
-        random.shuffle(cards)
-        card_count = initialize_card_count()
-
-    # deal initial cards to player and banker
-    for _ in range(2):
-        player_card = cards.pop()
-        banker_card = cards.pop()
-        player_hand.append(player_card)
-        banker_hand.append(banker_card)
-        card_count[player_card] -= 1
-        card_count[banker_card] -= 1
 
-    player_total = calculate_hand_total(player_hand)
-    banker_total = calculate_hand_total(banker_hand)
-
-    action_history.append(f"Player's initial hand: {player_hand} (total: {player_total})")
-    action_history.append(f"Banker's initial hand: {banker_hand} (total: {banker_total})")
-
-    print("============================================")
-    print(f"Player's hand: {player_hand} | Total: {player_total}")
-    print(f"Banker's hand: {banker_hand} | Total: {banker_total}")
-    print("============================================")
-
-    # player's decision (hit, stand, or view)
-    if len(player_hand) < 3:
-        while True:
-            remaining_cards = [card for card, count in card_count.items() for _ in range(count)]
-            probability_lucky_9 = calculate_probabilities(player_total, remaining_cards)
-            print(f"Probability of hitting a Lucky 9: {probability_lucky_9:.2f}%")
-            action = get_valid_input("Do you want to hit, stand, or view remaining cards? (hit/stand/view): ", ["hit", "stand", "view"])
-
-            if action == 'hit':
-                if len(cards) == 0:
-                    print("No more cards left in the deck.")
-                    action_history.append("Hit attempted, but deck empty.")
-                    break
-                player_card = cards.pop()
-                player_hand.append(player_card)
-                card_count[player_card] -= 1
-                player_total = calculate_hand_total(player_hand)
-                action_history.append(f"Player hits and draws: {player_card} | New total: {player_total}")
-                print(f"You drew a card with value: {player_card}")
-                print(f"Your cards: {player_hand} | Total: {player_total}")
-                # if player hits a lucky 9, record the achievement
-                if player_total == 9:
-                    action_history.append("Player hits Lucky 9 and wins!")
-                    achievements.add_achievement(player_name, "Lucky Nine Master", "You achieved a perfect 9!")
-                break
-            elif action == 'stand':
-                action_history.append(f"Player stands with total: {player_total}")
-                print("You chose to stand.")
-                break
-            elif action == 'view':
-                print("Remaining cards in the deck:")
-                print(card_count)
+    # the round itself is played by the headless engine
+    result = play_round(deck, policy, rng)
 
-    # banker logic for drawing a third card
-    if len(banker_hand) < 3 and (banker_total < 3 or (banker_total < 6 and player_total > banker_total)):
-        banker_card = cards.pop()
-        banker_hand.append(banker_card)
-        card_count[banker_card] -= 1
-        banker_total = calculate_hand_total(banker_hand)
-        action_history.append(f"Banker draws: {banker_card} | New total: {banker_total}")
+    if result.action == "hit":
+        if len(result.player_hand) < 3:
+            print("No more cards left in the deck.")
+        else:
+            print(f"You drew a card with value: {result.player_hand[2]}")
+            print(f"Your cards: {result.player_hand} | Total: {result.player_total}")
 
     print("============================================")
-    print(f"Final Player's hand: {player_hand} | Total: {player_total}")
-    print(f"Final Banker's hand: {banker_hand} | Total: {banker_total}")
+    print(f"Final Player's hand: {result.player_hand} | Total: {result.player_total}")
+    print(f"Final Banker's hand: {result.banker_hand} | Total: {result.banker_total}")
     print("============================================")
 
-    # decide outcome: player win, banker win, or tie
-    if player_total > banker_total:
+    if result.outcome == "win":
         print("Player wins!")
-        action_history.append("Player wins!")
-        leaderboard.add_game_result(player_name, "win")
-        # update balance for a win using the bet
-        balance_manager.handle_win(player_name, bet=bet_amount)
-    elif player_total < banker_total:
+    elif result.outcome == "loss":
         print("Banker wins!")
-        action_history.append("Banker wins!")
-        leaderboard.add_game_result(player_name, "loss")
-        # update balance for a loss using the bet
-        balance_manager.handle_loss(player_name, bet=bet_amount)
     else:
         print("It's a tie!")
-        action_history.append("It's a tie!")
-        leaderboard.add_game_result(player_name, "tie")
-        # ties do not alter balance
+    record_round_result(leaderboard, balance_manager, player_name, result.outcome, bet_amount, analytics)
+    # achievements and the round log see the round with the new balance
+    balance = balance_manager.create_or_get_balance(player_name)["current_balance"]
+    event = round_event(player_name, result, bet_amount, balance)
+    for rule in achievements.record_round(player_name, event):
+        print(f"Achievement unlocked: {rule.title} - {rule.description}")
+    if round_log:
+        round_log.write_event(event)
+
+    return build_action_history(result)
 
-    return action_history, cards, card_count
+
+def run_autoplay(rounds, policy_name="threshold", seed=None, history_file=None, history_limit=None,
+                 decks=1, penetration=None, draw_mode="index", snapshot_file=None, snapshot_every=100_000):
+    """
+    play 'rounds' rounds with no human input and report the outcome
+    counts and the engine throughput in rounds per second.
+    if 'history_file' is given, every round's action history is streamed
+    to that compressed jsonl file; 'history_limit' keeps only the last N
+    round histories in memory. 'decks', 'penetration' and 'draw_mode'
+    select a multi-deck shoe (see make_deck). with 'snapshot_file', the
+    session is snapshotted every 'snapshot_every' rounds and at the end, and
+    a later run with the same file resumes from there: the deck, rng and
+    counts are restored, so the totals match one uninterrupted run.
+    returns (counts, recent histories).
+    """
+    policy = load_policy(policy_name)
+    counts = {"win": 0, "loss": 0, "tie": 0}
+    done = 0
+    snapshot = read_snapshot(snapshot_file) if snapshot_file else None
+    if snapshot is not None:
+        deck, rng, _ = restore_session(snapshot)
+        counts, done = snapshot.counts, snapshot.rounds
+        print(f"Resuming from {snapshot_file} after {done} rounds")
+    else:
+        rng = random.Random(seed)
+        deck = make_deck(decks, penetration, rng, draw_mode)
+    # recent round histories, bounded so memory stays fixed
+    recent = LinkedList(maxlen=history_limit)
+    writer = HistoryWriter(history_file) if history_file else None
+    played = max(rounds - done, 0)
+    # rounds per uninterrupted stretch of the loops below
+    stretch = snapshot_every if snapshot_file else played
+    start = time.perf_counter()
+    while done < rounds:
+        chunk = min(stretch, rounds - done)
+        if writer is None and history_limit is None:
+            # fast path: only the outcome of each round is needed
+            for _ in range(chunk):
+                counts[play_round(deck, policy, rng).outcome] += 1
+        else:
+            for _ in range(chunk):
+                result = play_round(deck, policy, rng)
+                counts[result.outcome] += 1
+                action_history = build_action_history(result)
+                if writer:
+                    writer.write_round("autoplay", action_history)
+                if history_limit is not None:
+                    recent.append(action_history)
+        done += chunk
+        if snapshot_file:
+            write_snapshot(snapshot_file, take_snapshot(deck, rng, "autoplay", done, counts))
+    if writer:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    rate = played / elapsed if elapsed > 0 else float("inf")
+
+    print("============================================")
+    print(f"AUTOPLAY: {done} rounds (policy: {policy_name}, seed: {seed})")
+    print("============================================")
+    for outcome in ("win", "loss", "tie"):
+        share = counts[outcome] / done * 100 if done else 0.0
+        print(f"{outcome:<5} {counts[outcome]:>12} ({share:.2f}%)")
+    print(f"Elapsed: {elapsed:.3f}s | {rate:,.0f} rounds/sec")
+    if writer:
+        print(f"Action histories written to {history_file}")
+    print("============================================")
+    return counts, recent
 
 
 # main entry point of the program (playing as "{player_name}")
-def main():
-    # initialize the deck and randomize it
-    cards = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10] * 4
-    random.shuffle(cards)
-    # keep track of card counts for each card value
-    card_count = initialize_card_count()
+def main(storage_kind="json", database_path="lucky9.db", history_file=None,
+         decks=1, penetration=None, draw_mode="index", flush_every=64, flush_delay=2.0,
+         round_log_file=None, seed=None, snapshot_file=None, shared_name=None,
+         shared_capacity=SHARED_CAPACITY):
+    # the table's own rng: '--seed' makes the session reproducible
+    rng = table_rng(seed)
+    # initialize the deck (or shoe) and randomize it (it tracks its own card counts)
+    deck = make_deck(decks, penetration, rng, draw_mode)
+    # a session snapshot, if there is one, continues the previous deck and player
+    snapshot = read_snapshot(snapshot_file) if snapshot_file else None
+    rounds = 0
+    # the last round's action history (restored from the snapshot, if any)
+    action_history = LinkedList()
+    if snapshot is not None:
+        deck, rng, action_history = restore_session(snapshot)
+        rounds = snapshot.rounds
+    # storage backends for the three stores; changes are coalesced and
+    # flushed every 'flush_every' dirty players or 'flush_delay' seconds
+    # (shared stores are saved from their own threads, so sqlite gives each its own connection)
+    storages = {
+        store: WriteBehind(backend, flush_every, flush_delay)
+        for store, backend in open_storages(storage_kind, database_path, threaded=True,
+                                            own_connections=bool(shared_name)).items()
+    }
+    if shared_name:
+        # leaderboard and balances live in shared memory; one process saves them
+        storages = share_storages(storages, shared_name, shared_capacity)
+    # pending changes are also flushed at exit and on SIGTERM, and once
+    # 'flush_delay' passes even while the menu waits for input
+    install_flush_handlers(storages.values())
+    start_flush_timer(storages.values())
     # create leaderboard instance
-    leaderboard = Leaderboard()
-    # create achievements instance
-    achievements = Achievements()
+    leaderboard = Leaderboard(storage=storages["leaderboard"])
+    # create achievements instance (its counters start from the leaderboard stats)
+    achievements = Achievements(storage=storages["achievements"],
+                                rules=RulesEngine(RULES, seed=leaderboard_counters(leaderboard)))
     # create balance manager instance
-    balance_manager = BalanceManager()
-
-    # prompt for the player's name
-    player_name = input("Enter your name: ").strip()
+    balance_manager = BalanceManager(storage=storages["balances"])
+    # optional compressed session log of every round's action history
+    history_writer = HistoryWriter(history_file) if history_file else None
+    # optional round-event log for rebuilding state later (see roundlog.py)
+    round_log = RoundLogWriter(round_log_file) if round_log_file else None
+    # running per-player stats of this session (win rate, streaks, rolling nets), not saved
+    analytics = PlayerAnalytics()
+
+    # mmap and shared stores keep names in fixed-width rows
+    fixed_width = storage_kind == "mmap" or bool(shared_name)
+    # shared stores hold a fixed number of players; new names are refused once they're full
+    player_stores = (leaderboard.storage, balance_manager.storage)
+    # prompt for the player's name (unless the snapshot has one)
+    if snapshot is not None and snapshot.player_name:
+        player_name = snapshot.player_name
+        print(f"Resumed session of {player_name} after {rounds} rounds ({snapshot_file})")
+        if action_history.head:
+            print("Last round's actions:")
+            for hist_action in action_history.display():
+                print(hist_action)
+    else:
+        player_name = get_valid_name("Enter your name: ", fixed_width, player_stores)
 
     while True:
         # get the current balance for the header display
@@ -523,9 +1605,18 @@ def main():
 
         if action == "1":
             # play a new round of lucky 9
-            action_history, cards, card_count = play_lucky9(
-                cards, card_count, leaderboard, player_name, achievements, balance_manager
+            action_history = play_lucky9(
+                deck, leaderboard, player_name, achievements, balance_manager, round_log, rng=rng,
+                analytics=analytics,
             )
+            if action_history.head:
+                rounds += 1
+            if history_writer and action_history.head:
+                history_writer.write_round(player_name, action_history)
+            if snapshot_file:
+                # a few microseconds to take; resumes the shoe exactly after a crash
+                write_snapshot(snapshot_file, take_snapshot(deck, rng, player_name, rounds,
+                                                            history=action_history))
             show_history = get_valid_input("Do you want to view the action history? (yes/no): ", ["yes", "no"])
             if show_history == 'yes':
                 print("============================================")
@@ -543,10 +1634,16 @@ def main():
 
         elif action == "3":
             # let the user change their player name
-            player_name = input("Enter a new player name: ").strip()
+            player_name = get_valid_name("Enter a new player name: ", fixed_width, player_stores)
 
         elif action == "4":
-            # exit the program
+            # exit the program (close the storage backends first)
+            for storage in storages.values():
+                storage.close()
+            if history_writer:
+                history_writer.close()
+            if round_log:
+                round_log.close()
             print("============================================")
             print("    THANKS FOR PLAYING! GOODBYE!")
             print("============================================")
@@ -561,9 +1658,68 @@ def main():
             print("============================================")
 
         elif action == "6":
-            # view balance info (includes profits)
+            # view balance info (includes profits) and the session stats
             balance_manager.view_balance(player_name)
+            display_player_stats(analytics, player_name)
+            print("============================================")
+
+
+def parse_args(argv=None):
+    # command line options; with no options the interactive menu is started
+    parser = argparse.ArgumentParser(description="Lucky 9 card game")
+    parser.add_argument("--autoplay", type=int, metavar="N",
+                        help="play N rounds headless and report rounds/sec")
+    parser.add_argument("--policy", default="threshold",
+                        help=f"player decision policy used by --autoplay: {', '.join(sorted(POLICIES))} "
+                             "or module:function")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for the table rng (autoplay and the interactive game)")
+    parser.add_argument("--snapshot", default=None, metavar="PATH",
+                        help="save the session (shoe, rng, player) here and resume from it on start")
+    parser.add_argument("--snapshot-every", type=int, default=100_000,
+                        help="rounds between snapshots during --autoplay")
+    parser.add_argument("--decks", type=int, default=1,
+                        help="number of 40-card decks in the shoe")
+    parser.add_argument("--penetration", type=float, default=None,
+                        help="share of the shoe dealt before the cut card (default 0.75 for shoes)")
+    parser.add_argument("--draw", choices=["index", "weighted"], default="index",
+                        help="deal from a pre-shuffled order or sample by remaining counts")
+    parser.add_argument("--history-file", default=None,
+                        help="append every round's action history to this gzip jsonl file")
+    parser.add_argument("--round-log", default=None,
+                        help="append one event per round to this jsonl (or .jsonl.gz) log, see roundlog.py")
+    parser.add_argument("--history-limit", type=int, default=None,
+                        help="keep only the last N round histories in memory during --autoplay")
+    parser.add_argument("--storage", choices=["json", "journal", "sharded", "mmap", "sqlite"], default="json",
+                        help="where players are saved: json files, json + append-only journal, "
+                             "json shards loaded per player, or sqlite")
+    parser.add_argument("--db", default="lucky9.db", help="sqlite database path for --storage sqlite")
+    parser.add_argument("--shared", default=None, metavar="NAME",
+                        help="share the leaderboard and balances with other processes started with the same NAME")
+    parser.add_argument("--shared-capacity", type=int, default=SHARED_CAPACITY, metavar="N",
+                        help="most players the shared records hold (set by the first process to start)")
+    parser.add_argument("--flush-every", type=int, default=64,
+                        help="flush once this many players have unsaved changes (1 = write-through)")
+    parser.add_argument("--flush-delay", type=float, default=2.0,
+                        help="flush changes older than this many seconds")
+    parser.add_argument("--metrics", default=None, metavar="PATH",
+                        help="time the hot paths and dump them at exit (.prom for prometheus text, else json)")
+    parser.add_argument("--profile", default=None, metavar="PATH",
+                        help="save a cProfile capture of the session to this file")
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.metrics:
+        # registered before the flush handlers, so the dump includes the final flush
+        metrics.enable(sys.modules[__name__])
+        atexit.register(metrics.dump, args.metrics)
+    with metrics.profile(args.profile) if args.profile else nullcontext():
+        if args.autoplay is not None:
+            run_autoplay(args.autoplay, args.policy, args.seed, args.history_file, args.history_limit,
+                         args.decks, args.penetration, args.draw, args.snapshot, args.snapshot_every)
+        else:
+            main(args.storage, args.db, args.history_file, args.decks, args.penetration, args.draw,
+                 args.flush_every, args.flush_delay, args.round_log, args.seed, args.snapshot, args.shared,
+                 args.shared_capacity)
@@ -0,0 +1,128 @@
+"""
+incremental per-player analytics, kept in memory for the session only:
+they start empty every time the game or server starts and are never
+saved. lifetime wins, losses and ties are the leaderboard's.
+
+every finished round is folded into the player's running stats in O(1):
+  games, wins, losses, ties, win rate, average bet
+  current streak (+n wins / -n losses in a row; ties keep it) and the
+  longest win and loss streaks
+  net profit over the last 'window' rounds: a ring buffer of per-round
+  nets plus a running sum
+  net profit over the last 'horizon' seconds: a ring of 'buckets' time
+  buckets, each stamped with its bucket number so stale ones are skipped
+reading a player's stats is O(buckets), whatever the number of rounds, and
+nothing is read from disk or recomputed from history.
+"""
+import time
+from array import array
+
+# the fields of one player's stats, in report order
+STAT_FIELDS = (
+    "games", "wins", "losses", "ties", "win_rate", "streak", "longest_win_streak",
+    "longest_loss_streak", "average_bet", "net_last_rounds", "net_last_window",
+)
+
+
+class PlayerStats:
+    # running stats of one player; see the module docstring
+    __slots__ = (
+        "games", "wins", "losses", "ties", "total_bet", "streak", "longest_win_streak",
+        "longest_loss_streak", "nets", "position", "net_rounds", "bucket_nets", "bucket_stamps",
+    )
+
+    def __init__(self, window, buckets):
+        self.games = self.wins = self.losses = self.ties = self.total_bet = 0
+        self.streak = self.longest_win_streak = self.longest_loss_streak = 0
+        # the last 'window' round nets, oldest overwritten first
+        self.nets = array("q", [0]) * window
+        self.position = 0
+        self.net_rounds = 0
+        # net per time bucket, and which bucket number each slot holds
+        self.bucket_nets = array("q", [0]) * buckets
+        self.bucket_stamps = array("q", [-1]) * buckets
+
+
+class PlayerAnalytics:
+    """
+    per-player stats of this session, updated from record_round_result.
+    'window' is the number of rounds in the rolling net, 'horizon' the
+    seconds covered by the time-based net, split into 'buckets' buckets.
+    """
+    def __init__(self, window=100, horizon=3600.0, buckets=60, clock=time.time):
+        self.window = window
+        self.horizon = horizon
+        self.buckets = buckets
+        self.bucket_width = horizon / buckets
+        self.clock = clock
+        # player name -> PlayerStats
+        self.players = {}
+
+    def record(self, player_name, outcome, bet, now=None):
+        # fold one finished round into the player's stats
+        stats = self.players.get(player_name)
+        if stats is None:
+            stats = self.players[player_name] = PlayerStats(self.window, self.buckets)
+        stats.games += 1
+        stats.total_bet += bet
+        if outcome == "win":
+            net = bet
+            stats.wins += 1
+            stats.streak = stats.streak + 1 if stats.streak > 0 else 1
+            if stats.streak > stats.longest_win_streak:
+                stats.longest_win_streak = stats.streak
+        elif outcome == "loss":
+            net = -bet
+            stats.losses += 1
+            stats.streak = stats.streak - 1 if stats.streak < 0 else -1
+            if -stats.streak > stats.longest_loss_streak:
+                stats.longest_loss_streak = -stats.streak
+        else:
+            net = 0
+            stats.ties += 1
+
+        # rolling window: replace the oldest round's net, keep the sum current
+        stats.net_rounds += net - stats.nets[stats.position]
+        stats.nets[stats.position] = net
+        stats.position = (stats.position + 1) % self.window
+
+        # time buckets: a slot still holding an older bucket starts over
+        bucket = int((self.clock() if now is None else now) // self.bucket_width)
+        slot = bucket % self.buckets
+        if stats.bucket_stamps[slot] != bucket:
+            stats.bucket_stamps[slot] = bucket
+            stats.bucket_nets[slot] = 0
+        stats.bucket_nets[slot] += net
+
+    def stats(self, player_name, now=None):
+        # the player's stats as a dict of STAT_FIELDS, or None if they haven't played
+        stats = self.players.get(player_name)
+        if stats is None:
+            return None
+        oldest = int((self.clock() if now is None else now) // self.bucket_width) - self.buckets + 1
+        net_last_window = sum(
+            net for net, stamp in zip(stats.bucket_nets, stats.bucket_stamps) if stamp >= oldest
+        )
+        games = stats.games
+        return {
+            "games": games,
+            "wins": stats.wins,
+            "losses": stats.losses,
+            "ties": stats.ties,
+            "win_rate": stats.wins / games if games else 0.0,
+            "streak": stats.streak,
+            "longest_win_streak": stats.longest_win_streak,
+            "longest_loss_streak": stats.longest_loss_streak,
+            "average_bet": stats.total_bet / games if games else 0.0,
+            "net_last_rounds": stats.net_rounds,
+            "net_last_window": net_last_window,
+        }
+
+    def report(self, players=None, now=None):
+        # {player: stats} for 'players' (default: everyone), all at the same 'now'
+        now = self.clock() if now is None else now
+        names = self.players if players is None else players
+        return {name: self.stats(name, now) for name in names if name in self.players}
+
+    def __len__(self):
+        return len(self.players)
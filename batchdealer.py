@@ -0,0 +1,180 @@
+"""
+vectorized numpy backend that deals and plays whole batches of rounds.
+
+each round is dealt from its own freshly shuffled 40-card deck, stored as
+one row of an (n, 40) int8 array. this is a fresh-deck model: unlike the
+scalar engine, which deals one deck (or shoe) down across rounds before
+reshuffling, no round sees cards missing from earlier ones, so rates and
+the house edge differ slightly from a scalar run with the same seed.
+bets are flat units with no bankroll, and only the policies in HIT_TABLES
+have a vectorized form. like Deck.draw, cards come off the end
+of the row: player, banker, player, banker, then the optional player hit
+and banker third card. hand totals, the hit/stand policy and the banker
+draw rule are applied as masked array operations, so a batch of a million
+rounds needs no python-level loop.
+
+numpy is optional: the rest of the game never imports this module.
+
+cross_check() replays the same decks through the scalar play_round engine
+and verifies that every outcome matches.
+"""
+import argparse
+import json
+import time
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for this backend
+    np = None
+
+from HashleyJohn import DECK_VALUES, POLICIES, Deck, make_banker_rule, play_round
+
+# how the numpy backend deals, reported in simulator summaries
+DECK_MODEL = "fresh shuffled deck every round, flat unit bets, no bankroll"
+# policies that depend only on the player's two-card total, as hit tables
+HIT_TABLES = {
+    "stand": [False] * 10,
+    "threshold": [total < 5 for total in range(10)],
+}
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("the numpy batch dealer needs numpy (pip install numpy)")
+
+
+def make_rng(seed, stream=0):
+    # numpy generator for one (seed, stream) pair; streams are independent
+    require_numpy()
+    return np.random.default_rng([stream, seed])
+
+
+def deal_decks(n, rng):
+    # n independently shuffled 40-card decks, one per row
+    require_numpy()
+    decks = np.tile(np.array(DECK_VALUES * 4, dtype=np.int8), (n, 1))
+    return rng.permuted(decks, axis=1)
+
+
+def play_batch(decks, policy_name="threshold", always_below=3, chase_below=6, bet=1):
+    """
+    play one round per deck row. returns a dict of arrays:
+      outcome: +1 player win, -1 banker win, 0 tie (int8)
+      payout: outcome * bet
+      player_total, banker_total, player_hit, banker_draw
+    """
+    require_numpy()
+    if policy_name not in HIT_TABLES:
+        raise ValueError(f"policy {policy_name!r} has no vectorized form; use one of {sorted(HIT_TABLES)}")
+    hit_table = np.array(HIT_TABLES[policy_name], dtype=bool)
+
+    # widen to int16 so sums cannot overflow before % 10
+    top = decks[:, -6:].astype(np.int16)
+    player_1, banker_1, player_2, banker_2 = top[:, 5], top[:, 4], top[:, 3], top[:, 2]
+    fifth, sixth = top[:, 1], top[:, 0]
+
+    player_total = (player_1 + player_2) % 10
+    banker_total = (banker_1 + banker_2) % 10
+
+    # player's hit/stand decision from the hit table
+    player_hit = hit_table[player_total]
+    player_total = np.where(player_hit, (player_total + fifth) % 10, player_total)
+    # the banker's third card is the next card off the deck
+    banker_card = np.where(player_hit, sixth, fifth)
+
+    # banker draw rule as a mask
+    banker_draw = (banker_total < always_below) | ((banker_total < chase_below) & (player_total > banker_total))
+    banker_total = np.where(banker_draw, (banker_total + banker_card) % 10, banker_total)
+
+    outcome = np.sign(player_total - banker_total).astype(np.int8)
+    return {
+        "outcome": outcome,
+        "payout": outcome.astype(np.int64) * bet,
+        "player_total": player_total,
+        "banker_total": banker_total,
+        "player_hit": player_hit,
+        "banker_draw": banker_draw,
+    }
+
+
+def run_batches(rounds, seed=0, stream=0, policy_name="threshold", always_below=3,
+                chase_below=6, batch_size=1_000_000):
+    """
+    play 'rounds' rounds in batches and return counters in the same shape
+    as simulator.run_shard (flat unit bets, no bankroll tracking).
+    """
+    require_numpy()
+    rng = make_rng(seed, stream)
+    wins = losses = ties = player_hits = banker_hits = 0
+    remaining = rounds
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        result = play_batch(deal_decks(size, rng), policy_name, always_below, chase_below)
+        outcome = result["outcome"]
+        round_wins = int(np.count_nonzero(outcome == 1))
+        round_losses = int(np.count_nonzero(outcome == -1))
+        wins += round_wins
+        losses += round_losses
+        ties += size - round_wins - round_losses
+        player_hits += int(np.count_nonzero(result["player_hit"]))
+        banker_hits += int(np.count_nonzero(result["banker_draw"]))
+        remaining -= size
+    return {
+        "rounds": rounds, "wins": wins, "losses": losses, "ties": ties,
+        "player_hits": player_hits, "banker_draws": banker_hits,
+        "wagered": rounds, "player_net": wins - losses,
+        "busts": 0, "replenished": 0,
+    }
+
+
+def cross_check(rounds=10_000, seed=0, policy_name="threshold", always_below=3, chase_below=6):
+    """
+    deal 'rounds' decks, play them with both engines and return the number
+    of rounds whose outcome or totals differ (0 means the engines agree).
+    """
+    require_numpy()
+    decks = deal_decks(rounds, make_rng(seed))
+    batch = play_batch(decks, policy_name, always_below, chase_below)
+    policy = POLICIES[policy_name]
+    banker_rule = make_banker_rule(always_below, chase_below)
+    scalar_outcome = {"win": 1, "loss": -1, "tie": 0}
+
+    mismatches = 0
+    for row in range(rounds):
+        result = play_round(Deck.from_cards(decks[row].tolist()), policy, banker_rule=banker_rule)
+        if (scalar_outcome[result.outcome] != batch["outcome"][row]
+                or result.player_total != batch["player_total"][row]
+                or result.banker_total != batch["banker_total"][row]):
+            mismatches += 1
+    return mismatches
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Lucky 9 numpy batch dealer")
+    parser.add_argument("--rounds", type=int, default=10_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--policy", choices=sorted(HIT_TABLES), default="threshold")
+    parser.add_argument("--batch-size", type=int, default=1_000_000)
+    parser.add_argument("--cross-check", type=int, metavar="N", default=0,
+                        help="also replay N decks through the scalar engine and compare")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.cross_check:
+        mismatches = cross_check(args.cross_check, args.seed, args.policy)
+        print(f"Cross-check: {args.cross_check} rounds, {mismatches} mismatches")
+        if mismatches:
+            raise SystemExit(1)
+    start = time.perf_counter()
+    counters = run_batches(args.rounds, args.seed, policy_name=args.policy, batch_size=args.batch_size)
+    elapsed = time.perf_counter() - start
+    counters["elapsed_seconds"] = elapsed
+    counters["rounds_per_second"] = args.rounds / elapsed if elapsed > 0 else None
+    counters["deck_model"] = DECK_MODEL
+    print(json.dumps(counters, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+benchmarks for the lucky 9 engine, data structures and persistence.
+
+each scenario is timed at several sizes (player counts, list lengths or
+calls) and reported in ns per operation. results can be saved as json
+together with environment metadata, and compared with a saved baseline
+to catch regressions.
+
+examples:
+    python benchmarks.py hashmap --sizes 1000 100000
+    python benchmarks.py all --sizes 10 1000 100000 --json baseline.json
+    python benchmarks.py all --sizes 10 1000 100000 --compare baseline.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+from analytics import PlayerAnalytics
+from HashleyJohn import (
+    POLICIES, BalanceManager, Deck, Leaderboard, LinkedList, MyHashMap,
+    calculate_probabilities, make_deck, play_round, record_round_result,
+)
+from storage import SQL_TABLES, JsonStorage, MappedStorage, ShardedStorage, WriteBehind
+
+
+def best_of(repeat, function):
+    # run 'function' several times and keep the fastest wall time
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_hashmap(n, repeat=3):
+    """
+    time n set / get / items operations on MyHashMap and on the built-in
+    dict with the same player-name keys. returns ns per operation.
+    """
+    keys = [f"player{i}" for i in range(n)]
+
+    def hashmap_set():
+        table = MyHashMap()
+        for key in keys:
+            table.set(key, key)
+        return table
+
+    def dict_set():
+        table = {}
+        for key in keys:
+            table[key] = key
+        return table
+
+    hashmap = hashmap_set()
+    table = dict_set()
+
+    def hashmap_get():
+        get = hashmap.get
+        for key in keys:
+            get(key)
+
+    def dict_get():
+        get = table.get
+        for key in keys:
+            get(key)
+
+    results = {}
+    for name, function in (
+        ("MyHashMap.set", hashmap_set),
+        ("dict.set", dict_set),
+        ("MyHashMap.get", hashmap_get),
+        ("dict.get", dict_get),
+        ("MyHashMap.iter_items", lambda: sum(1 for _ in hashmap.iter_items())),
+        ("dict.items", lambda: sum(1 for _ in table.items())),
+    ):
+        results[name] = best_of(repeat, function) / n * 1e9
+    return results
+
+
+def temp_store(directory, name):
+    # a json store in 'directory' that only writes when flushed
+    return WriteBehind(JsonStorage(os.path.join(directory, name)), max_dirty=None, max_delay=None)
+
+
+def bench_rounds(n, repeat=3):
+    """
+    n headless rounds, one per player, through the same engine and result
+    recording as play_lucky9 (deal, decision, banker rule, leaderboard and
+    balance updates). the stores are flushed once at the end.
+    """
+    players = [f"player{i}" for i in range(n)]
+    policy = POLICIES["threshold"]
+
+    with tempfile.TemporaryDirectory() as directory:
+        def rounds():
+            rng = random.Random(9)
+            deck = make_deck(1, None, rng)
+            leaderboard = Leaderboard(storage=temp_store(directory, "leaderboard.json"))
+            balance_manager = BalanceManager(storage=temp_store(directory, "balances.json"))
+            for name in players:
+                result = play_round(deck, policy, rng)
+                record_round_result(leaderboard, balance_manager, name, result.outcome, 10)
+            leaderboard.storage.flush()
+            balance_manager.storage.flush()
+
+        def engine_only():
+            rng = random.Random(9)
+            deck = make_deck(1, None, rng)
+            for _ in players:
+                play_round(deck, policy, rng)
+
+        return {
+            "round+record": best_of(repeat, rounds) / n * 1e9,
+            "round (engine only)": best_of(repeat, engine_only) / n * 1e9,
+        }
+
+
+def bench_analytics(n, repeat=3):
+    """
+    PlayerAnalytics.record for n rounds spread over 1000 players, and a
+    bulk report of everyone. ns per round / per player reported.
+    """
+    players = [f"player{i % 1000}" for i in range(n)]
+    outcomes = ("win", "loss", "tie")
+    analytics = PlayerAnalytics()
+
+    def record():
+        for i, name in enumerate(players):
+            analytics.record(name, outcomes[i % 3], 10, now=i)
+
+    record()
+
+    def report():
+        analytics.report(now=n)
+
+    return {
+        "PlayerAnalytics.record": best_of(repeat, record) / n * 1e9,
+        "PlayerAnalytics.report": best_of(repeat, report) / len(analytics) * 1e9,
+    }
+
+
+def bench_probabilities(n, repeat=3):
+    # n calls of calculate_probabilities against a full deck's remaining cards
+    remaining = Deck(random.Random(9)).cards
+    totals = [i % 10 for i in range(n)]
+
+    def probabilities():
+        for total in totals:
+            calculate_probabilities(total, remaining)
+
+    return {"calculate_probabilities": best_of(repeat, probabilities) / n * 1e9}
+
+
+def bench_linkedlist(n, repeat=3):
+    # append n entries to an empty list, unbounded and as a 100-entry ring
+    def unbounded():
+        history = LinkedList()
+        append = history.append
+        for i in range(n):
+            append(i)
+
+    def ring():
+        history = LinkedList(maxlen=100)
+        append = history.append
+        for i in range(n):
+            append(i)
+
+    return {
+        "LinkedList.append": best_of(repeat, unbounded) / n * 1e9,
+        "LinkedList.append (ring)": best_of(repeat, ring) / n * 1e9,
+    }
+
+
+def bench_leaderboard(n, repeat=3):
+    """
+    add_game_result for n players (the write is deferred to one flush, timed
+    separately) and display of the full table with output discarded.
+    """
+    players = [f"player{i}" for i in range(n)]
+    outcomes = ("win", "loss", "tie")
+
+    with tempfile.TemporaryDirectory() as directory:
+        def fill():
+            leaderboard = Leaderboard(storage=temp_store(directory, "leaderboard.json"))
+            for i, name in enumerate(players):
+                leaderboard.add_game_result(name, outcomes[i % 3])
+            return leaderboard
+
+        leaderboard = fill()
+        # build the rank index once; display then walks it
+        leaderboard.index_for("wins")
+
+        def display():
+            with contextlib.redirect_stdout(io.StringIO()):
+                leaderboard.display()
+
+        def flush():
+            # the deferred write of a fresh fill's n dirty players (the fill isn't timed)
+            storage = fill().storage
+            start = time.perf_counter()
+            storage.flush()
+            return time.perf_counter() - start
+
+        return {
+            "Leaderboard.add_game_result": best_of(repeat, fill) / n * 1e9,
+            "Leaderboard.display": best_of(repeat, display) / n * 1e9,
+            "Leaderboard flush": min(flush() for _ in range(repeat)) / n * 1e9,
+        }
+
+
+def bench_balances(n, repeat=3):
+    # full save_balances / load_balances of n players, per player
+    with tempfile.TemporaryDirectory() as directory:
+        storage = JsonStorage(os.path.join(directory, "balances.json"))
+        balance_manager = BalanceManager(storage=storage)
+        for i in range(n):
+            balance_manager.data_map.set(
+                f"player{i}", {"initial_balance": 100, "current_balance": 100 + i % 50})
+
+        def load():
+            BalanceManager(storage=JsonStorage(storage.file_path))
+
+        return {
+            "BalanceManager.save_balances": best_of(repeat, balance_manager.save_balances) / n * 1e9,
+            "BalanceManager.load_balances": best_of(repeat, load) / n * 1e9,
+        }
+
+
+def bench_startup(n, repeat=3):
+    """
+    BalanceManager startup plus one player's lookup with n saved players,
+    from balances.json, the sharded layout and a record file. ns per startup.
+    """
+    records = {f"player{i}": {"initial_balance": 100, "current_balance": 100} for i in range(n)}
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "balances.json")
+        JsonStorage(json_path).save(records)
+        shard_directory = os.path.join(directory, "balances.shards")
+        ShardedStorage(shard_directory).save(records)
+        record_path = os.path.join(directory, "balances.rec")
+        MappedStorage(record_path, SQL_TABLES["balances"], "q").save(records)
+
+        def json_startup():
+            BalanceManager(storage=JsonStorage(json_path)).create_or_get_balance("player0")
+
+        def sharded_startup():
+            BalanceManager(storage=ShardedStorage(shard_directory)).create_or_get_balance("player0")
+
+        def mmap_startup():
+            storage = MappedStorage(record_path, SQL_TABLES["balances"], "q")
+            BalanceManager(storage=storage).create_or_get_balance("player0")
+            storage.close()
+
+        return {
+            "startup (json)": best_of(repeat, json_startup) * 1e9,
+            "startup (sharded)": best_of(repeat, sharded_startup) * 1e9,
+            "startup (mmap)": best_of(repeat, mmap_startup) * 1e9,
+        }
+
+
+# scenario name -> benchmark function(n, repeat) returning {metric: ns per op}
+SCENARIOS = {
+    "rounds": bench_rounds,
+    "probabilities": bench_probabilities,
+    "hashmap": bench_hashmap,
+    "linkedlist": bench_linkedlist,
+    "leaderboard": bench_leaderboard,
+    "analytics": bench_analytics,
+    "balances": bench_balances,
+    "startup": bench_startup,
+}
+
+
+def environment():
+    # where the numbers came from, saved next to them
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def run(scenarios, sizes, repeat=3):
+    """
+    time every scenario at every size and print each result as it arrives.
+    returns a list of {"scenario", "n", "metric", "ns_per_op"} dicts.
+    """
+    results = []
+    for scenario in scenarios:
+        for n in sizes:
+            print(f"{scenario} n = {n}")
+            for metric, ns in SCENARIOS[scenario](n, repeat).items():
+                print(f"  {metric:<30} {ns:12.1f} ns/op")
+                results.append({"scenario": scenario, "n": n, "metric": metric, "ns_per_op": ns})
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    match results against a baseline report by (scenario, n, metric) and
+    print the change of each. returns the entries more than 'threshold'
+    (a fraction) slower than the baseline.
+    """
+    previous = {
+        (entry["scenario"], entry["n"], entry["metric"]): entry["ns_per_op"]
+        for entry in baseline["results"]
+    }
+    regressions = []
+    print("============================================")
+    print(f"COMPARED WITH BASELINE ({baseline['environment'].get('timestamp', '?')})")
+    print("============================================")
+    for entry in results:
+        key = (entry["scenario"], entry["n"], entry["metric"])
+        if key not in previous:
+            continue
+        change = entry["ns_per_op"] / previous[key] - 1 if previous[key] > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(dict(entry, baseline_ns_per_op=previous[key], change=change))
+        print(f"{entry['scenario']:<14} n={entry['n']:<9} {entry['metric']:<30} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lucky 9 benchmarks")
+    parser.add_argument("scenarios", nargs="+", choices=sorted(SCENARIOS) + ["all"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1_000, 100_000],
+                        help="player counts / lengths / calls to time (up to 1000000)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", metavar="PATH", help="write the results as json")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="json results of an earlier run; exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown (fraction) counted as a regression by --compare")
+    args = parser.parse_args(argv)
+
+    scenarios = list(SCENARIOS) if "all" in args.scenarios else args.scenarios
+    report = {
+        "environment": environment(),
+        "repeat": args.repeat,
+        "results": run(scenarios, args.sizes, args.repeat),
+    }
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=4)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(report["results"], baseline, args.threshold)
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
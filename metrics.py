@@ -0,0 +1,250 @@
+"""
+lightweight instrumentation for the lucky 9 hot paths.
+
+enable() wraps the round phases (deal, hint, banker, record), the
+save_*/load_*/persist methods of the stores, the MyHashMap operations and
+the storage writes with timing wrappers; disable() puts the original
+functions back, so when metrics are off there is no overhead at all.
+collected:
+  call latency histograms   one per instrumented call (count, sum, buckets)
+  bytes written counters    per file, for json rewrites and journal appends
+                            (sqlite writes are timed but not sized)
+
+the results are dumped as a prometheus text file (.prom / .txt) or a json
+snapshot (any other extension). profile() captures one cProfile session.
+
+example:
+    import metrics
+    metrics.enable()
+    ...
+    metrics.dump("lucky9.prom")
+"""
+import bisect
+import cProfile
+import functools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import storage
+
+# histogram bucket upper bounds in seconds (1 microsecond to 10 seconds)
+BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+# (class name or None for a module function, attribute, metric name) in the game module
+GAME_TARGETS = (
+    (None, "deal_round", "deal"),
+    (None, "advise", "hint"),
+    (None, "finish_round", "banker"),
+    (None, "record_round_result", "record"),
+    (None, "play_lucky9", "play_lucky9"),
+    ("Leaderboard", "load_leaderboard", "Leaderboard.load_leaderboard"),
+    ("Leaderboard", "save_leaderboard", "Leaderboard.save_leaderboard"),
+    ("Leaderboard", "persist", "Leaderboard.persist"),
+    ("Achievements", "load_achievements", "Achievements.load_achievements"),
+    ("Achievements", "save_achievements", "Achievements.save_achievements"),
+    ("Achievements", "persist", "Achievements.persist"),
+    ("BalanceManager", "load_balances", "BalanceManager.load_balances"),
+    ("BalanceManager", "save_balances", "BalanceManager.save_balances"),
+    ("BalanceManager", "persist", "BalanceManager.persist"),
+    ("MyHashMap", "get", "MyHashMap.get"),
+    ("MyHashMap", "set", "MyHashMap.set"),
+    ("MyHashMap", "remove", "MyHashMap.remove"),
+    ("MyHashMap", "items", "MyHashMap.items"),
+)
+
+# the same for the storage module
+STORAGE_TARGETS = (
+    ("WriteBehind", "write", "flush"),
+    ("SQLiteStorage", "write_prepared", "SQLiteStorage.write_prepared"),
+    ("SQLiteAchievementStorage", "write_prepared", "SQLiteAchievementStorage.write_prepared"),
+)
+
+
+class Histogram:
+    """
+    call latencies in fixed buckets, plus their count and sum.
+    """
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        # one slot per bound in BUCKETS plus the +Inf overflow slot
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def cumulative(self):
+        # (upper bound, calls at or below it) pairs, ending with +Inf
+        running = 0
+        pairs = []
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            running += count
+            pairs.append((bound, running))
+        return pairs
+
+
+class Metrics:
+    """
+    the collected histograms and counters.
+    """
+    def __init__(self):
+        # metric name -> Histogram
+        self.histograms = {}
+        # file name -> bytes written
+        self.bytes_written = {}
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    def add_bytes(self, file_path, count):
+        name = os.path.basename(file_path)
+        self.bytes_written[name] = self.bytes_written.get(name, 0) + count
+
+    def reset(self):
+        self.histograms = {}
+        self.bytes_written = {}
+
+    def snapshot(self):
+        # plain dict for the json dump
+        return {
+            "time": time.time(),
+            "calls": {
+                name: {
+                    "count": histogram.count,
+                    "sum_seconds": histogram.total,
+                    "mean_seconds": histogram.total / histogram.count if histogram.count else 0.0,
+                    "buckets": {
+                        "+Inf" if bound == float("inf") else repr(bound): count
+                        for bound, count in histogram.cumulative()
+                    },
+                }
+                for name, histogram in sorted(self.histograms.items())
+            },
+            "bytes_written": dict(sorted(self.bytes_written.items())),
+        }
+
+    def to_prometheus(self):
+        lines = [
+            "# HELP lucky9_call_seconds Time spent in instrumented calls.",
+            "# TYPE lucky9_call_seconds histogram",
+        ]
+        for name, histogram in sorted(self.histograms.items()):
+            for bound, count in histogram.cumulative():
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'lucky9_call_seconds_bucket{{name="{name}",le="{le}"}} {count}')
+            lines.append(f'lucky9_call_seconds_sum{{name="{name}"}} {histogram.total!r}')
+            lines.append(f'lucky9_call_seconds_count{{name="{name}"}} {histogram.count}')
+        lines.append("# HELP lucky9_bytes_written_total Bytes written to each data file.")
+        lines.append("# TYPE lucky9_bytes_written_total counter")
+        for name, count in sorted(self.bytes_written.items()):
+            lines.append(f'lucky9_bytes_written_total{{file="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+# (owner, attribute, original) of every wrapper currently installed
+_installed = []
+# kept unwrapped so dumping the metrics is not itself measured
+_write_text = storage.atomic_write_text
+
+
+def _timed(function, name):
+    histogram = METRICS.histogram(name)
+    clock = time.perf_counter
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            histogram.observe(clock() - start)
+    return wrapper
+
+
+def _sized_write_text(function):
+    # json files are ascii (json.dumps escapes the rest), so len() is the byte count
+    @functools.wraps(function)
+    def wrapper(file_path, text):
+        function(file_path, text)
+        METRICS.add_bytes(file_path, len(text))
+    return wrapper
+
+
+def _sized_append(function):
+    @functools.wraps(function)
+    def wrapper(self, lines):
+        function(self, lines)
+        METRICS.add_bytes(self.journal_path, len(lines))
+    return wrapper
+
+
+def _install(owner, attribute, wrapper):
+    original = getattr(owner, attribute)
+    _installed.append((owner, attribute, original))
+    setattr(owner, attribute, wrapper(original))
+
+
+def enabled():
+    return bool(_installed)
+
+
+def enable(game=None):
+    """
+    install the wrappers. 'game' is the game module to instrument; by
+    default HashleyJohn (pass sys.modules["__main__"] when the game is
+    run as a script). calling enable() again does nothing.
+    """
+    if _installed:
+        return
+    if game is None:
+        import HashleyJohn as game
+    for module, targets in ((game, GAME_TARGETS), (storage, STORAGE_TARGETS)):
+        for class_name, attribute, name in targets:
+            owner = module if class_name is None else getattr(module, class_name)
+            _install(owner, attribute, lambda function, name=name: _timed(function, name))
+    _install(storage, "atomic_write_text", _sized_write_text)
+    _install(storage.JournalStorage, "append", _sized_append)
+
+
+def disable():
+    # put the original functions back (the collected metrics are kept)
+    while _installed:
+        owner, attribute, original = _installed.pop()
+        setattr(owner, attribute, original)
+
+
+def dump(file_path):
+    # prometheus text for .prom/.txt files, a json snapshot otherwise
+    if file_path.endswith((".prom", ".txt")):
+        text = METRICS.to_prometheus()
+    else:
+        text = json.dumps(METRICS.snapshot(), indent=4)
+    _write_text(file_path, text)
+
+
+@contextmanager
+def profile(file_path):
+    """
+    run the body under cProfile and save the stats to 'file_path'
+    (read them with: python -m pstats <file>).
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(file_path)
+        print(f"Profile written to {file_path}", file=sys.stderr)
@@ -0,0 +1,272 @@
+"""
+streaming rebuild of player state from round-event logs.
+
+a round-event log has one json line per finished round, written by
+RoundLogWriter (HashleyJohn.py --round-log, server.py serve --round-log).
+a .gz log is gzip-compressed. the pipeline here is a chain of generators:
+
+  read_lines -> parse_events -> reducers
+
+each reducer folds one event into a Leaderboard, BalanceManager or
+Achievements store. only the current line is held in memory, so the log
+size doesn't matter. the stores themselves still hold one record per
+player, or a bounded cache with --storage sharded.
+
+every 'checkpoint_every' rounds the stores are flushed and the byte
+offset reached is saved to a checkpoint file. the next run starts from
+that offset, so an incremental run only reads the rounds added since.
+resuming a gzip log still decompresses the skipped part, but doesn't parse
+or apply it.
+
+the flush and the checkpoint save are two writes, so before flushing, the
+records about to be written and the checkpoint they lead to are saved to
+'<checkpoint>.pending'. a run that finds it newer than the checkpoint
+writes those records again (whole records, so twice is harmless) and
+saves the checkpoint before reading the log: a crash between the two
+never applies rounds twice. mmap stores change in place before any flush,
+so they can only be rebuilt without a checkpoint.
+
+examples:
+    python roundlog.py rounds.jsonl.gz --fresh --checkpoint rounds.checkpoint
+    python roundlog.py rounds.jsonl.gz --checkpoint rounds.checkpoint   # only the new rounds
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+
+from HashleyJohn import (
+    Achievements,
+    BalanceManager,
+    Leaderboard,
+    leaderboard_counters,
+)
+from rules import RULES, RulesEngine
+from storage import DATABASE_PATH, WriteBehind, atomic_write_json, open_storages
+
+
+def open_log(file_path):
+    # binary mode, so line lengths are byte offsets
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    return open(file_path, "rb")
+
+
+def read_lines(file_path, offset=0):
+    """
+    yield (offset after the line, line) for every complete line from byte
+    'offset' on. a last line without a newline is still being written (or
+    was torn by a crash), so it's left for the next run.
+    """
+    with open_log(file_path) as file:
+        if offset:
+            file.seek(offset)
+        for line in file:
+            if not line.endswith(b"\n"):
+                return
+            offset += len(line)
+            yield offset, line
+
+
+def parse_events(lines):
+    # (offset, event dict) for every line that parses; bad lines are reported and skipped
+    for offset, line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError:
+            print(f"Skipping unreadable round event ending at byte {offset}")
+            continue
+        yield offset, event
+
+
+def leaderboard_reducer(leaderboard):
+    def reduce(event):
+        leaderboard.add_game_result(event["player"], event["outcome"])
+    return reduce
+
+
+def balance_reducer(balance_manager):
+    # the same balance rules as record_round_result (ties leave it alone)
+    def reduce(event):
+        if event["outcome"] == "win":
+            balance_manager.handle_win(event["player"], bet=event["bet"])
+        elif event["outcome"] == "loss":
+            balance_manager.handle_loss(event["player"], bet=event["bet"])
+    return reduce
+
+
+def achievements_reducer(achievements, balance_manager=None):
+    # runs after the balance reducer, so logs without a balance get the rebuilt one
+    def reduce(event):
+        if event.get("balance") is None and balance_manager is not None:
+            event = dict(event, balance=balance_manager.create_or_get_balance(event["player"])["current_balance"])
+        achievements.record_round(event["player"], event)
+    return reduce
+
+
+def load_checkpoint(checkpoint_path, log_path):
+    """
+    the checkpoint saved for 'log_path', or a fresh one. a checkpoint made
+    for another log, or past the end of this one, is refused: replaying
+    from the wrong offset would count rounds twice or skip them.
+    """
+    fresh = {"log": os.path.abspath(log_path), "offset": 0, "rounds": 0}
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return fresh
+    with open(checkpoint_path, "r") as file:
+        checkpoint = json.load(file)
+    if checkpoint["log"] != fresh["log"]:
+        raise ValueError(f"{checkpoint_path} is a checkpoint of {checkpoint['log']}, not {fresh['log']}")
+    if not log_path.endswith(".gz") and checkpoint["offset"] > os.path.getsize(log_path):
+        raise ValueError(f"{log_path} is shorter than the checkpoint offset; was it replaced?")
+    return checkpoint
+
+
+def pending_path(checkpoint_path):
+    # the records and checkpoint of a flush that may not have finished
+    return checkpoint_path + ".pending"
+
+
+def recover_pending(backends, checkpoint_path, log_path):
+    """
+    finish a checkpoint a crash interrupted between the store flush and the
+    checkpoint save: write the pending records to 'backends' again and
+    save their checkpoint. a pending file the checkpoint already covers is
+    just removed.
+    """
+    path = pending_path(checkpoint_path)
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as file:
+        pending = json.load(file)
+    checkpoint = pending["checkpoint"]
+    if checkpoint["log"] != os.path.abspath(log_path):
+        raise ValueError(f"{path} belongs to {checkpoint['log']}, not {os.path.abspath(log_path)}")
+    if checkpoint["offset"] > load_checkpoint(checkpoint_path, log_path)["offset"]:
+        for store, changes in pending["changes"].items():
+            backend = backends[store]
+            # json-like backends rewrite from their loaded records, so load them first
+            backend.load()
+            backend.write_prepared(backend.prepare(changes))
+        atomic_write_json(checkpoint_path, checkpoint)
+        print(f"Finished the interrupted checkpoint at byte offset {checkpoint['offset']}")
+    os.remove(path)
+
+
+def replay(log_path, reducers, checkpoint_path=None, checkpoint_every=10_000, on_checkpoint=None):
+    """
+    stream the log from the checkpoint through every reducer. every
+    'checkpoint_every' rounds and at the end, on_checkpoint(checkpoint) is
+    called with the checkpoint about to be saved (it should make the
+    reduced state durable) and then the checkpoint is saved. returns the
+    checkpoint dict: log, offset and total rounds.
+    """
+    checkpoint = load_checkpoint(checkpoint_path, log_path)
+
+    def save():
+        if on_checkpoint:
+            on_checkpoint(checkpoint)
+        if checkpoint_path:
+            atomic_write_json(checkpoint_path, checkpoint)
+
+    since_checkpoint = 0
+    for offset, event in parse_events(read_lines(log_path, checkpoint["offset"])):
+        for reduce in reducers:
+            reduce(event)
+        checkpoint["offset"] = offset
+        checkpoint["rounds"] += 1
+        since_checkpoint += 1
+        if since_checkpoint >= checkpoint_every:
+            save()
+            since_checkpoint = 0
+    save()
+    return checkpoint
+
+
+def rebuild(log_path, storage_kind="json", database_path=DATABASE_PATH, checkpoint_path=None,
+            fresh=False, checkpoint_every=10_000):
+    """
+    apply a round-event log to the leaderboard, balances and achievements
+    of one storage backend. 'fresh' empties the stores and ignores any
+    checkpoint first. returns (checkpoint, rounds applied by this run).
+    """
+    if checkpoint_path and storage_kind == "mmap":
+        raise ValueError("mmap stores change in place before a checkpoint; rebuild them without --checkpoint")
+    backends = open_storages(storage_kind, database_path)
+    if fresh:
+        if storage_kind == "sqlite":
+            raise ValueError("a fresh sqlite rebuild needs a new --db file")
+        for backend in backends.values():
+            backend.save({})
+        if checkpoint_path:
+            for path in (checkpoint_path, pending_path(checkpoint_path)):
+                if os.path.exists(path):
+                    os.remove(path)
+    elif checkpoint_path:
+        recover_pending(backends, checkpoint_path, log_path)
+    # the stores only write when replay() checkpoints
+    storages = {
+        store: WriteBehind(backend, max_dirty=None, max_delay=None)
+        for store, backend in backends.items()
+    }
+    leaderboard = Leaderboard(storage=storages["leaderboard"])
+    balance_manager = BalanceManager(storage=storages["balances"])
+    achievements = Achievements(storage=storages["achievements"],
+                                rules=RulesEngine(RULES, seed=leaderboard_counters(leaderboard)))
+    # achievements last: the rules see the leaderboard and balance after the round
+    reducers = [
+        leaderboard_reducer(leaderboard),
+        balance_reducer(balance_manager),
+        achievements_reducer(achievements, balance_manager),
+    ]
+
+    def flush_all(checkpoint):
+        if checkpoint_path:
+            # what the flush will write, saved first so a crash during it can be finished
+            changes = {store: dict(storage.dirty) for store, storage in storages.items()}
+            atomic_write_json(pending_path(checkpoint_path), {"checkpoint": checkpoint, "changes": changes},
+                              indent=None)
+        for storage in storages.values():
+            storage.flush()
+
+    start_rounds = load_checkpoint(checkpoint_path, log_path)["rounds"]
+    checkpoint = replay(log_path, reducers, checkpoint_path, checkpoint_every, flush_all)
+    if checkpoint_path and os.path.exists(pending_path(checkpoint_path)):
+        # the last checkpoint is saved, so its redo record isn't needed
+        os.remove(pending_path(checkpoint_path))
+    for storage in storages.values():
+        storage.close()
+    return checkpoint, checkpoint["rounds"] - start_rounds
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild Lucky 9 player state from a round-event log")
+    parser.add_argument("log", help="round-event log (.jsonl or .jsonl.gz)")
+    parser.add_argument("--storage", choices=["json", "journal", "sharded", "mmap", "sqlite"], default="json")
+    parser.add_argument("--db", default=DATABASE_PATH, help="sqlite database path for --storage sqlite")
+    parser.add_argument("--checkpoint", default=None,
+                        help="file keeping the offset reached, so the next run only reads new rounds")
+    parser.add_argument("--checkpoint-every", type=int, default=10_000,
+                        help="rounds between store flushes and checkpoint saves")
+    parser.add_argument("--fresh", action="store_true",
+                        help="empty the stores and start from the beginning of the log")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+    checkpoint, rounds = rebuild(args.log, args.storage, args.db, args.checkpoint,
+                                 args.fresh, args.checkpoint_every)
+    elapsed = time.perf_counter() - start
+    rate = rounds / elapsed if elapsed > 0 else float("inf")
+    print(f"Applied {rounds} rounds ({checkpoint['rounds']} in total, byte offset {checkpoint['offset']}) "
+          f"in {elapsed:.2f}s | {rate:,.0f} rounds/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+declarative achievements rules engine.
+
+a rule unlocks an achievement either when a round matches some event
+fields ('when', e.g. {"action": "hit", "outcome": "win"}) or when a
+per-player counter reaches a threshold ('counter' / 'at_least'). a rule
+with both fires on any matching round where the counter is at the
+threshold, crossed just now or not. rules are indexed up front:
+  event rules    by their first (field, value) pair (with or without a counter)
+  counter rules  by counter, sorted by threshold
+so a round only looks at the rules its field values select and the
+thresholds its counters just crossed. the per-round cost doesn't grow with
+the number of rules.
+
+counters are kept per player and updated incrementally from each round
+event (the dict built by round_event in HashleyJohn.py, plus "balance").
+Achievements saves them in the player's record under COUNTERS_KEY and
+restores them on the next run, so streaks and totals survive restarts.
+"""
+import bisect
+from collections import namedtuple
+
+# 'when' is a dict of event field -> required value; 'counter' / 'at_least' a threshold
+Rule = namedtuple("Rule", "title description when counter at_least", defaults=(None, None, None))
+
+# per-player counters updated by every round
+COUNTERS = (
+    "games", "wins", "losses", "ties", "win_streak", "loss_streak", "comeback",
+    "hits", "lucky_nines", "naturals", "balance", "bet",
+)
+# the entry of an achievements record holding the player's counters (not a title)
+COUNTERS_KEY = "_counters"
+
+
+def _count_games(count):
+    return f"{count} game" if count == 1 else f"{count} games"
+
+
+def _wins(count, title):
+    return Rule(title, f"Won {_count_games(count)}.", counter="wins", at_least=count)
+
+
+def _games(count, title):
+    return Rule(title, f"Played {_count_games(count)}.", counter="games", at_least=count)
+
+
+def _streak(count, title):
+    return Rule(title, f"Won {_count_games(count)} in a row.", counter="win_streak", at_least=count)
+
+
+def _balance(amount, title):
+    return Rule(title, f"Reached a balance of {amount}.", counter="balance", at_least=amount)
+
+
+# the built-in achievements
+RULES = (
+    Rule("Lucky Nine Master", "You achieved a perfect 9!", when={"lucky_nine": True}),
+    Rule("Natural Nine", "Dealt a two-card 9.", when={"natural": True}),
+    Rule("Bold Move", "Won a round after drawing a third card.", when={"action": "hit", "outcome": "win"}),
+    Rule("Steady Hand", "Won a round standing on 4.",
+         when={"action": "stand", "outcome": "win", "player_total": 4}),
+    Rule("Photo Finish", "Tied the banker at 9.", when={"outcome": "tie", "player_total": 9}),
+    _wins(1, "First Win"),
+    _wins(10, "Winner"),
+    _wins(50, "Seasoned Winner"),
+    _wins(100, "Centurion"),
+    _wins(500, "Legend"),
+    _games(10, "Regular"),
+    _games(100, "Dedicated"),
+    _games(1000, "Lifer"),
+    _streak(3, "Hot Streak"),
+    _streak(5, "On Fire"),
+    _streak(10, "Unstoppable"),
+    Rule("Tough Luck", "Lost 5 games in a row.", counter="loss_streak", at_least=5),
+    Rule("Comeback Kid", "Won right after losing 3 or more in a row.", counter="comeback", at_least=3),
+    Rule("Great Escape", "Won right after losing 7 or more in a row.", counter="comeback", at_least=7),
+    Rule("Card Shark", "Drew a third card 50 times.", counter="hits", at_least=50),
+    Rule("Nine Lives", "Drew to a perfect 9 nine times.", counter="lucky_nines", at_least=9),
+    Rule("Born Lucky", "Dealt 10 two-card 9s.", counter="naturals", at_least=10),
+    Rule("Peacemaker", "Tied the banker 10 times.", counter="ties", at_least=10),
+    _balance(200, "Doubled Up"),
+    _balance(500, "High Stakes"),
+    _balance(1000, "Whale"),
+    Rule("High Roller", "Bet 100 or more on one round.", counter="bet", at_least=100),
+    Rule("All In Winner", "Won a bet of 100 or more.", when={"outcome": "win"}, counter="bet", at_least=100),
+)
+
+
+def round_facts(event):
+    # the event plus the derived fields rules can match on
+    player_hand = event["player_hand"]
+    player_total = sum(player_hand) % 10
+    facts = dict(event)
+    facts["player_total"] = player_total
+    facts["banker_total"] = sum(event["banker_hand"]) % 10
+    facts["natural"] = len(player_hand) == 2 and player_total == 9
+    # a drawn third card that makes 9
+    facts["lucky_nine"] = event["action"] == "hit" and len(player_hand) > 2 and player_total == 9
+    return facts
+
+
+def update_counters(counters, facts):
+    # fold one round into a player's counters
+    counters["games"] += 1
+    outcome = facts["outcome"]
+    counters["comeback"] = 0
+    if outcome == "win":
+        counters["wins"] += 1
+        counters["win_streak"] += 1
+        counters["comeback"] = counters["loss_streak"]
+        counters["loss_streak"] = 0
+    elif outcome == "loss":
+        counters["losses"] += 1
+        counters["loss_streak"] += 1
+        counters["win_streak"] = 0
+    else:
+        counters["ties"] += 1
+    if facts["action"] == "hit":
+        counters["hits"] += 1
+    if facts["lucky_nine"]:
+        counters["lucky_nines"] += 1
+    if facts["natural"]:
+        counters["naturals"] += 1
+    if facts.get("balance") is not None:
+        counters["balance"] = facts["balance"]
+    counters["bet"] = facts["bet"]
+
+
+class RulesEngine:
+    """
+    evaluates the rules against round events. 'seed(player, event)', if
+    given, returns the counters a player had before 'event' the first time
+    the engine sees them (e.g. from the leaderboard); a seeded player is
+    checked against every threshold they already reached.
+    """
+    def __init__(self, rules=RULES, seed=None):
+        self.rules = tuple(rules)
+        self.seed = seed
+        # player -> counters dict
+        self.counters = {}
+        # (field, value) -> event rules whose first 'when' pair it is
+        self.by_value = {}
+        # counter -> (sorted thresholds, rules in the same order)
+        self.by_counter = {}
+        for rule in self.rules:
+            if rule.when:
+                # a level counter (bet, balance) can stay above the threshold, so
+                # rules that also need 'when' are checked whenever 'when' matches
+                self.by_value.setdefault(next(iter(rule.when.items())), []).append(rule)
+            elif rule.counter is not None:
+                thresholds, rules = self.by_counter.setdefault(rule.counter, ([], []))
+                position = bisect.bisect_right(thresholds, rule.at_least)
+                thresholds.insert(position, rule.at_least)
+                rules.insert(position, rule)
+            else:
+                raise ValueError(f"rule {rule.title!r} needs 'when' or 'counter'")
+        # event fields that select event rules
+        self.fields = {field for field, _ in self.by_value}
+
+    def counters_for(self, player_name, event=None):
+        # the player's counters, seeded on first use
+        counters = self.counters.get(player_name)
+        if counters is None:
+            counters = dict.fromkeys(COUNTERS, 0)
+            if self.seed is not None:
+                counters.update(self.seed(player_name, event))
+            self.counters[player_name] = counters
+        return counters
+
+    def restore(self, player_name, counters):
+        # continue from counters saved by an earlier run (no thresholds are re-checked)
+        restored = dict.fromkeys(COUNTERS, 0)
+        restored.update((name, value) for name, value in counters.items() if name in restored)
+        self.counters[player_name] = restored
+
+    def process(self, player_name, event, unlocked=()):
+        """
+        update the player's counters with one round event and return the
+        rules it unlocks, skipping titles in 'unlocked'.
+        """
+        facts = round_facts(event)
+        known = player_name in self.counters
+        counters = self.counters_for(player_name, event)
+        # a player seen for the first time gets every threshold they've reached
+        before = dict(counters) if known else dict.fromkeys(COUNTERS, 0)
+        update_counters(counters, facts)
+
+        candidates = []
+        for field in self.fields:
+            rules = self.by_value.get((field, facts.get(field)))
+            if rules:
+                candidates.extend(rules)
+        for counter, (thresholds, rules) in self.by_counter.items():
+            old, new = before[counter], counters[counter]
+            if new > old:
+                candidates.extend(rules[bisect.bisect_right(thresholds, old):bisect.bisect_right(thresholds, new)])
+
+        fired = []
+        for rule in candidates:
+            if rule.title in unlocked:
+                continue
+            if rule.when and any(facts.get(field) != value for field, value in rule.when.items()):
+                continue
+            if rule.when and rule.counter is not None and counters[rule.counter] < rule.at_least:
+                continue
+            fired.append(rule)
+        return fired
@@ -0,0 +1,427 @@
+"""
+asyncio tcp server that hosts many lucky 9 tables at once.
+
+every connection is its own table with its own deck, while all tables
+share one Leaderboard / Achievements / BalanceManager. a per-player
+asyncio lock is held from the bet to the payout, so two sessions of the
+same player can never spend the same chips twice. stores are wrapped in
+WriteBehind, so a round only marks records dirty; a background flusher
+serializes the changes on the event loop and writes them to disk on a
+worker thread, and gameplay never waits for the disk.
+
+with --seed, table k deals from its own rng seeded by (seed, k), so a
+bug report can be replayed exactly. with --snapshot-dir, every round ends
+with a binary snapshot of the table (see snapshot.py) written per player;
+a player who reconnects after a crash continues the same shoe.
+
+line protocol (one command per line, replies are one line each):
+  NAME <player>   -> OK <player> <balance>
+  BET <amount>    -> DEAL <player cards> <player total> <banker cards> <banker total>
+     HIT | STAND  -> RESULT <win|loss|tie> <player cards> <player total>
+                           <banker cards> <banker total> <balance>
+  BALANCE         -> BALANCE <current> <initial>
+  TOP [k]         -> TOP <name>:<wins> ...
+  STATS [player ...] -> STATS <json {player: running stats since the server started}> (default: yourself)
+  QUIT            -> BYE
+errors are answered with "ERR <message>". cards are comma separated.
+
+examples:
+    python server.py serve --port 9009 --storage sqlite
+    python server.py loadgen --port 9009 --players 200 --rounds 50
+    python server.py loadgen --local --players 200 --rounds 50
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from analytics import PlayerAnalytics
+from HashleyJohn import (
+    Achievements,
+    BalanceManager,
+    Leaderboard,
+    RoundLogWriter,
+    deal_round,
+    finish_round,
+    leaderboard_counters,
+    make_deck,
+    record_round_result,
+    restore_session,
+    round_event,
+    table_rng,
+)
+from rules import RULES, RulesEngine
+from snapshot import read_snapshot, take_snapshot, write_snapshot
+from storage import WriteBehind, encode_player_name, open_storages
+
+# seconds a player gets to answer HIT or STAND before the table stands for them
+DECISION_TIMEOUT = 30.0
+# per-player locks; players whose names hash alike share one
+LOCK_STRIPES = 1024
+
+
+def format_cards(hand):
+    return ",".join(str(card) for card in hand)
+
+
+class SharedState:
+    """
+    the stores shared by every table, the per-player locks and the
+    background flusher that persists dirty records.
+    """
+    def __init__(self, storage_kind="json", database_path="lucky9.db", flush_interval=1.0, decks=1,
+                 round_log_file=None, seed=None, snapshot_dir=None):
+        backends = open_storages(storage_kind, database_path, threaded=True)
+        # no size/time policy: only the background flusher writes, off the loop
+        self.storages = {
+            name: WriteBehind(backend, max_dirty=None, max_delay=None)
+            for name, backend in backends.items()
+        }
+        self.leaderboard = Leaderboard(storage=self.storages["leaderboard"])
+        self.achievements = Achievements(
+            storage=self.storages["achievements"],
+            rules=RulesEngine(RULES, seed=leaderboard_counters(self.leaderboard)),
+        )
+        self.balance_manager = BalanceManager(storage=self.storages["balances"])
+        # mmap rows hold a limited name, so NAME checks it
+        self.fixed_width_names = storage_kind == "mmap"
+        # a fixed set of locks, picked by a hash of the player name, so the
+        # locks don't grow with the number of players ever seen
+        self.locks = [asyncio.Lock() for _ in range(LOCK_STRIPES)]
+        self.flush_interval = flush_interval
+        # decks in each table's shoe
+        self.decks = decks
+        # a single writer thread keeps disk writes in order
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # optional round-event log (see roundlog.py)
+        self.round_log = RoundLogWriter(round_log_file) if round_log_file else None
+        # running per-player stats since the server started (not saved),
+        # answered by STATS without touching the stores
+        self.analytics = PlayerAnalytics()
+        # table numbers, so a seeded server deals the same cards on every run
+        self.seed = seed
+        self.table_numbers = itertools.count()
+        # one snapshot file per player, written after each of their rounds
+        self.snapshot_dir = snapshot_dir
+        if snapshot_dir:
+            os.makedirs(snapshot_dir, exist_ok=True)
+
+    def player_lock(self, player_name):
+        # the lock serializing this player's balance updates
+        return self.locks[hash(player_name) % LOCK_STRIPES]
+
+    def snapshot_path(self, player_name):
+        return os.path.join(self.snapshot_dir, quote(player_name, safe="") + ".snap")
+
+    async def flush(self):
+        # serialize on the loop (consistent view), write on the worker thread
+        loop = asyncio.get_running_loop()
+        for store in self.storages.values():
+            payload = store.take()
+            if payload is not None:
+                await loop.run_in_executor(self.executor, store.write, payload)
+
+    async def run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing stores: {e}")
+
+    async def close(self):
+        await self.flush()
+        self.executor.shutdown()
+        for store in self.storages.values():
+            store.close()
+        if self.round_log:
+            self.round_log.close()
+
+
+class TableSession:
+    """
+    one connected client: its own deck and rng, and the player name it
+    is currently playing as.
+    """
+    def __init__(self, state, reader, writer):
+        self.state = state
+        self.reader = reader
+        self.writer = writer
+        self.rng = table_rng(state.seed, next(state.table_numbers))
+        self.deck = make_deck(state.decks, rng=self.rng)
+        self.player_name = None
+        self.rounds = 0
+
+    def send(self, message):
+        self.writer.write((message + "\n").encode())
+
+    async def read_command(self, timeout=None):
+        # next non-empty line split into (COMMAND, args); None on disconnect
+        while True:
+            if timeout is None:
+                line = await self.reader.readline()
+            else:
+                line = await asyncio.wait_for(self.reader.readline(), timeout)
+            if not line:
+                return None
+            parts = line.decode(errors="replace").split()
+            if parts:
+                return parts[0].upper(), parts[1:]
+
+    async def run(self):
+        self.send("WELCOME LUCKY9 send NAME <player>")
+        await self.writer.drain()
+        while True:
+            command = await self.read_command()
+            if command is None:
+                break
+            name, args = command
+            if name == "QUIT":
+                self.send("BYE")
+                break
+            handler = getattr(self, f"do_{name.lower()}", None)
+            if handler is None:
+                self.send(f"ERR unknown command {name}")
+            elif self.player_name is None and name != "NAME":
+                self.send("ERR send NAME <player> first")
+            else:
+                await handler(args)
+            await self.writer.drain()
+
+    async def do_name(self, args):
+        if len(args) != 1:
+            self.send("ERR usage: NAME <player>")
+            return
+        if self.state.fixed_width_names:
+            try:
+                encode_player_name(args[0])
+            except ValueError as e:
+                self.send(f"ERR {e}")
+                return
+        self.player_name = args[0]
+        if self.state.snapshot_dir:
+            # pick up the player's table where their last round left it
+            snapshot = read_snapshot(self.state.snapshot_path(self.player_name))
+            if snapshot is not None:
+                self.deck, self.rng, _ = restore_session(snapshot)
+                self.rounds = snapshot.rounds
+        async with self.state.player_lock(self.player_name):
+            balance = self.state.balance_manager.create_or_get_balance(self.player_name)
+        self.send(f"OK {self.player_name} {balance['current_balance']}")
+
+    async def do_balance(self, args):
+        balance = self.state.balance_manager.create_or_get_balance(self.player_name)
+        self.send(f"BALANCE {balance['current_balance']} {balance['initial_balance']}")
+
+    async def do_top(self, args):
+        k = int(args[0]) if args and args[0].isdigit() else 10
+        entries = self.state.leaderboard.top(k)
+        self.send("TOP " + " ".join(f"{name}:{stats['wins']}" for name, stats in entries))
+
+    async def do_stats(self, args):
+        report = self.state.analytics.report(args or [self.player_name])
+        self.send("STATS " + json.dumps(report, separators=(",", ":")))
+
+    async def do_bet(self, args):
+        if len(args) != 1 or not args[0].isdigit():
+            self.send("ERR usage: BET <amount>")
+            return
+        bet = int(args[0])
+        state = self.state
+        player_name = self.player_name
+        # hold the player's lock from the bet check to the payout
+        async with state.player_lock(player_name):
+            current_balance = state.balance_manager.create_or_get_balance(player_name)["current_balance"]
+            if bet < 1 or bet > current_balance:
+                self.send(f"ERR bet must be between 1 and {current_balance}")
+                return
+
+            player_hand, banker_hand, reshuffled = deal_round(self.deck, self.rng)
+            self.send(f"DEAL {format_cards(player_hand)} {sum(player_hand) % 10} "
+                      f"{format_cards(banker_hand)} {sum(banker_hand) % 10}")
+            await self.writer.drain()
+
+            action = await self.read_decision()
+            result = finish_round(self.deck, player_hand, banker_hand, action, reshuffled)
+            record_round_result(state.leaderboard, state.balance_manager, player_name, result.outcome, bet,
+                                state.analytics)
+            balance = state.balance_manager.create_or_get_balance(player_name)["current_balance"]
+            event = round_event(player_name, result, bet, balance)
+            state.achievements.record_round(player_name, event)
+            if state.round_log:
+                state.round_log.write_event(event)
+        self.rounds += 1
+        snapshot = None
+        if state.snapshot_dir:
+            snapshot = take_snapshot(self.deck, self.rng, player_name, self.rounds)
+        self.send(f"RESULT {result.outcome} {format_cards(result.player_hand)} {result.player_total} "
+                  f"{format_cards(result.banker_hand)} {result.banker_total} {balance}")
+        if snapshot is not None:
+            # on the writer thread, in order with the store flushes
+            await asyncio.get_running_loop().run_in_executor(
+                state.executor, write_snapshot, state.snapshot_path(player_name), snapshot)
+
+    async def read_decision(self):
+        # wait for HIT or STAND; a timeout or disconnect counts as STAND
+        while True:
+            try:
+                command = await self.read_command(DECISION_TIMEOUT)
+            except asyncio.TimeoutError:
+                return "stand"
+            if command is None:
+                return "stand"
+            if command[0] in ("HIT", "STAND"):
+                return command[0].lower()
+            self.send("ERR expected HIT or STAND")
+            await self.writer.drain()
+
+
+async def start_server(state, host="127.0.0.1", port=9009):
+    async def handle(reader, writer):
+        try:
+            await TableSession(state, reader, writer).run()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, host, port)
+
+
+async def serve(host, port, storage_kind, database_path, flush_interval, decks=1, round_log_file=None,
+                seed=None, snapshot_dir=None):
+    state = SharedState(storage_kind, database_path, flush_interval, decks, round_log_file, seed, snapshot_dir)
+    server = await start_server(state, host, port)
+    flusher = asyncio.create_task(state.run_flusher())
+    print(f"Lucky 9 server listening on {host}:{port} (storage: {storage_kind})")
+    # SIGTERM stops serving, so the stores are flushed below like on Ctrl-C
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        flusher.cancel()
+        await state.close()
+
+
+# load generator
+def percentile(sorted_values, fraction):
+    # nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def run_client(host, port, player_name, rounds, latencies, hit_below=5):
+    # one simulated player: bet 1 chip per round, hit below 'hit_below'
+    reader, writer = await asyncio.open_connection(host, port)
+    await reader.readline()
+    writer.write(f"NAME {player_name}\n".encode())
+    await reader.readline()
+    for _ in range(rounds):
+        start = time.perf_counter()
+        writer.write(b"BET 1\n")
+        deal = (await reader.readline()).decode().split()
+        if not deal or deal[0] != "DEAL":
+            break
+        decision = b"HIT\n" if int(deal[2]) < hit_below else b"STAND\n"
+        writer.write(decision)
+        await reader.readline()
+        latencies.append(time.perf_counter() - start)
+    writer.write(b"QUIT\n")
+    await reader.readline()
+    writer.close()
+    await writer.wait_closed()
+
+
+async def load_test(host, port, players, rounds, local=False, storage_kind="json",
+                    database_path="lucky9.db", flush_interval=1.0):
+    """
+    run 'players' concurrent clients for 'rounds' rounds each and return
+    the round latency percentiles (milliseconds) and overall throughput.
+    with local=True a server is started in this process on a free port.
+    """
+    server = state = flusher = None
+    if local:
+        state = SharedState(storage_kind, database_path, flush_interval)
+        server = await start_server(state, host, 0)
+        port = server.sockets[0].getsockname()[1]
+        flusher = asyncio.create_task(state.run_flusher())
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        run_client(host, port, f"load{i}", rounds, latencies) for i in range(players)
+    ))
+    elapsed = time.perf_counter() - start
+
+    if local:
+        flusher.cancel()
+        server.close()
+        await server.wait_closed()
+        await state.close()
+
+    latencies.sort()
+    return {
+        "players": players,
+        "rounds": len(latencies),
+        "elapsed_seconds": elapsed,
+        "rounds_per_second": len(latencies) / elapsed if elapsed > 0 else None,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] * 1000) if latencies else 0.0,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Lucky 9 multi-table server")
+    parser.add_argument("mode", choices=["serve", "loadgen"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9009)
+    parser.add_argument("--storage", choices=["json", "journal", "sharded", "mmap", "sqlite"], default="json")
+    parser.add_argument("--db", default="lucky9.db")
+    parser.add_argument("--flush-interval", type=float, default=1.0,
+                        help="seconds between background flushes of dirty records")
+    parser.add_argument("--decks", type=int, default=1, help="decks in each table's shoe")
+    parser.add_argument("--round-log", default=None,
+                        help="append one event per round to this jsonl (or .jsonl.gz) log")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed the tables' rngs so every run deals the same cards")
+    parser.add_argument("--snapshot-dir", default=None,
+                        help="snapshot each player's table here after every round and resume it on NAME")
+    parser.add_argument("--players", type=int, default=100, help="loadgen: concurrent players")
+    parser.add_argument("--rounds", type=int, default=20, help="loadgen: rounds per player")
+    parser.add_argument("--local", action="store_true",
+                        help="loadgen: start a server in this process instead of connecting to one")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.mode == "serve":
+        try:
+            asyncio.run(serve(args.host, args.port, args.storage, args.db, args.flush_interval, args.decks,
+                              args.round_log, args.seed, args.snapshot_dir))
+        except KeyboardInterrupt:
+            pass
+        except asyncio.CancelledError:
+            # stopped by SIGTERM, after the stores were flushed
+            raise SystemExit(128 + signal.SIGTERM)
+        return
+    report = asyncio.run(load_test(args.host, args.port, args.players, args.rounds, args.local,
+                                   args.storage, args.db, args.flush_interval))
+    print("============================================")
+    print(f"LOAD TEST: {report['players']} players, {report['rounds']} rounds")
+    print("============================================")
+    print(f"Throughput: {report['rounds_per_second']:,.0f} rounds/sec")
+    print(f"Latency p50: {report['p50_ms']:.2f} ms | p99: {report['p99_ms']:.2f} ms | max: {report['max_ms']:.2f} ms")
+    print("============================================")
+
+
+if __name__ == "__main__":
+    main()
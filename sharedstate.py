@@ -0,0 +1,607 @@
+"""
+leaderboard and balance records shared by several game processes.
+
+every process on the host attaches to the same multiprocessing.shared_memory
+segment per store, so a change made by one process is seen by the others
+right away, with no reload. the segment has the MappedStorage row layout:
+
+  header | hash index | sequence numbers | rows (name + int64 fields)
+
+so load() returns the same MappedRecords / MappedRow views, reading and
+writing fields in place.
+
+locking is per record, not per file: a player's updates take a POSIX
+byte-range lock (fcntl.lockf) on a lock file, picked by a hash of the
+name out of LOCK_STRIPES bytes. record_round_result holds it for the whole
+round, so read-modify-write updates from different processes never lose
+each other's changes. byte 0 guards the index and the header. every row
+also has a sequence number, odd while a write is in progress (a seqlock),
+so whole-row reads are consistent without taking a lock.
+
+only one process, the writer, persists to disk. the first process to
+attach loads the segment from the backing storage and becomes the writer.
+a background thread in the writer saves the rows whose sequence number
+changed every 'persist_interval' seconds, and on exit. when the writer
+exits (or dies), another attached process takes over on its next tick. the
+last process to detach saves everything and removes the segment.
+
+the pids of the attached processes are kept in a table after the header.
+dead ones are dropped whenever a process attaches or detaches, so processes
+killed without closing don't keep the segment alive. a segment with no
+live process left is stale: the next process removes it and loads the
+backing storage again (losing at most the dead writer's last
+'persist_interval' of changes), so files edited or migrated since are seen.
+
+example:
+    python HashleyJohn.py --shared lucky9          # in several terminals
+    python sharedstate.py --stress --processes 8 --rounds 5000
+"""
+import argparse
+import atexit
+import os
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager, nullcontext
+from multiprocessing import Process, Queue, resource_tracker, shared_memory
+
+from storage import (
+    NAME_BYTES, SQL_TABLES, JsonStorage, MappedRecords, MappedRow, WriteBehind, encode_player_name,
+)
+
+try:
+    import fcntl
+except ImportError:  # not on windows
+    fcntl = None
+
+# segment header: magic, version, fields per row, row size, index capacity,
+# row capacity, process slots, writer pid, row count
+SEGMENT_HEADER = struct.Struct("<8sIIIIIIqQ")
+SEGMENT_MAGIC = b"LUCKY9SM"
+SEGMENT_VERSION = 2
+WRITER = struct.Struct("<q")
+WRITER_OFFSET = 32
+COUNT = struct.Struct("<Q")
+COUNT_OFFSET = 40
+# the pid of each attached process (0 = free slot), right after the header
+PROCESS = struct.Struct("<q")
+PROCESS_SLOTS = 256
+INDEX_OFFSET = SEGMENT_HEADER.size + PROCESS.size * PROCESS_SLOTS
+INDEX_ENTRY = struct.Struct("<I")
+SEQUENCE = struct.Struct("<Q")
+# per-record lock bytes in the lock file (byte 0 is the index / header lock)
+LOCK_STRIPES = 4096
+# reads of a row seen mid-write before waiting on its lock instead
+READ_SPINS = 100
+# players a segment holds unless the first process to create it asks for more
+SHARED_CAPACITY = 100_000
+
+
+def _open_segment(name, create=False, size=0):
+    # the segment is shared on purpose: keep the resource tracker from unlinking it at exit
+    try:
+        return shared_memory.SharedMemory(name, create=create, size=size, track=False)
+    except TypeError:
+        # python < 3.13 has no 'track'
+        segment = shared_memory.SharedMemory(name, create=create, size=size)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+def _unlink_segment(segment):
+    if getattr(segment, "_track", True):
+        # python < 3.13 unregisters on unlink; register again so the tracker stays balanced
+        resource_tracker.register(segment._name, "shared_memory")
+    segment.unlink()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedRecords(MappedRecords):
+    # the records of a SharedMemoryStorage; other processes may change them at any time
+    shared = True
+
+    def set(self, key, value):
+        # find, add and write under the player's record lock, so they can't interleave
+        storage = self.storage
+        with storage.lock(key):
+            slot = storage.find(key)
+            if isinstance(value, MappedRow) and value.storage is storage and value.slot == slot:
+                return
+            values = [value.get(field, 0) for field in storage.fields]
+            if slot < 0:
+                storage.insert(key, values)
+            else:
+                storage.write_values(slot, values)
+
+
+class SharedMemoryStorage:
+    """
+    one store (leaderboard or balances) in a shared memory segment named
+    'segment', backed by 'backing' (any storage from open_storages,
+    usually wrapped in WriteBehind). 'capacity' is the most players the
+    segment holds; it's sized when the first process creates it.
+    """
+    def __init__(self, segment, backing, fields, capacity=SHARED_CAPACITY, persist_interval=1.0):
+        if fcntl is None:
+            raise RuntimeError("shared mode needs posix file locks (fcntl)")
+        self.segment_name = segment
+        self.backing = backing
+        self.fields = tuple(fields)
+        self.row = struct.Struct(f"<{NAME_BYTES}s{len(self.fields)}q")
+        self.value = struct.Struct("<q")
+        self.values = struct.Struct(f"<{len(self.fields)}q")
+        self.offsets = {
+            field: NAME_BYTES + position * self.value.size for position, field in enumerate(self.fields)
+        }
+        self.lock_file = open(os.path.join(tempfile.gettempdir(), f"{segment}.lock"), "ab")
+        # lock byte -> nesting depth in this process (posix locks don't nest)
+        self.held = {}
+        self.held_lock = threading.Lock()
+        # lock byte -> lock for the threads of this process (posix locks are per process)
+        self.thread_locks = {}
+        # row -> lock byte, so writes don't re-hash the name
+        self.stripes = {}
+        # row -> sequence number at the last save (writer only)
+        self.persisted = {}
+        self.persist_lock = threading.Lock()
+        self.closed = False
+        with self._locked(0):
+            self._attach(capacity)
+            self._replace_process(0, os.getpid())
+            self.claim()
+        self.stop = threading.Event()
+        self.persister = threading.Thread(target=self._run_persister, args=(persist_interval,), daemon=True)
+        self.persister.start()
+        atexit.register(self.close)
+
+    # segment layout
+    def _attach(self, capacity):
+        # attach to the live segment, or create it from the backing storage (holding lock byte 0)
+        if self._attach_live():
+            return
+        records = self.backing.load()
+        row_capacity = max(capacity, 2 * len(records))
+        index_capacity = 8
+        while index_capacity * 2 // 3 < row_capacity:
+            index_capacity *= 2
+        size = INDEX_OFFSET + INDEX_ENTRY.size * index_capacity + (SEQUENCE.size + self.row.size) * row_capacity
+        self.shm = _open_segment(self.segment_name, create=True, size=size)
+        SEGMENT_HEADER.pack_into(self.shm.buf, 0, SEGMENT_MAGIC, SEGMENT_VERSION, len(self.fields),
+                                 self.row.size, index_capacity, row_capacity, PROCESS_SLOTS, 0, 0)
+        self._map()
+        for key, value in records.items():
+            slot = self.insert(key, [value.get(field, 0) for field in self.fields])
+            self.persisted[slot] = 0
+
+    def _attach_live(self):
+        # attach to an existing segment; false if there is none or no live process uses it
+        try:
+            self.shm = _open_segment(self.segment_name)
+        except FileNotFoundError:
+            return False
+        self._map()
+        if self._processes():
+            return True
+        # left behind by processes that died without close()
+        del self.buf
+        self.shm.close()
+        _unlink_segment(self.shm)
+        return False
+
+    def _map(self):
+        # check the header and work out where everything is
+        self.buf = self.shm.buf
+        magic, version, field_count, row_size, index_capacity, row_capacity, process_slots, _, _ = (
+            SEGMENT_HEADER.unpack_from(self.buf, 0))
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION or process_slots != PROCESS_SLOTS:
+            raise ValueError(f"shared memory {self.segment_name} is not a version {SEGMENT_VERSION} segment")
+        if field_count != len(self.fields) or row_size != self.row.size:
+            raise ValueError(f"shared memory {self.segment_name} has a different row layout")
+        self.capacity = index_capacity
+        self.row_capacity = row_capacity
+        self.sequences_offset = INDEX_OFFSET + INDEX_ENTRY.size * index_capacity
+        self.rows_offset = self.sequences_offset + SEQUENCE.size * row_capacity
+
+    def _processes(self):
+        # pids of the live attached processes; dead ones are removed (holding lock byte 0)
+        live = []
+        for position in range(PROCESS_SLOTS):
+            offset = SEGMENT_HEADER.size + position * PROCESS.size
+            pid = self._get(PROCESS, offset)
+            if pid == 0:
+                continue
+            if pid == os.getpid() or _alive(pid):
+                live.append(pid)
+            else:
+                self._set(PROCESS, offset, 0)
+        return live
+
+    def _replace_process(self, old, new):
+        # swap the first process slot holding 'old' to 'new' (0 = free; holding lock byte 0)
+        for position in range(PROCESS_SLOTS):
+            offset = SEGMENT_HEADER.size + position * PROCESS.size
+            if self._get(PROCESS, offset) == old:
+                self._set(PROCESS, offset, new)
+                return
+        if old == 0:
+            raise ValueError(f"shared memory {self.segment_name} has no room for another process")
+
+    def _get(self, packer, offset):
+        return packer.unpack_from(self.buf, offset)[0]
+
+    def _set(self, packer, offset, value):
+        packer.pack_into(self.buf, offset, value)
+
+    @property
+    def count(self):
+        return self._get(COUNT, COUNT_OFFSET)
+
+    # locks
+    @contextmanager
+    def _locked(self, byte):
+        # exclusive lock on one byte of the lock file for one thread, nestable within it
+        with self.held_lock:
+            thread_lock = self.thread_locks.get(byte)
+            if thread_lock is None:
+                thread_lock = self.thread_locks[byte] = threading.RLock()
+        # only the thread holding 'thread_lock' touches held[byte]
+        with thread_lock:
+            depth = self.held.get(byte, 0)
+            if depth == 0:
+                fcntl.lockf(self.lock_file, fcntl.LOCK_EX, 1, byte)
+            self.held[byte] = depth + 1
+            try:
+                yield
+            finally:
+                self.held[byte] -= 1
+                if self.held[byte] == 0:
+                    del self.held[byte]
+                    fcntl.lockf(self.lock_file, fcntl.LOCK_UN, 1, byte)
+
+    def _stripe(self, name):
+        return 1 + zlib.crc32(name) % LOCK_STRIPES
+
+    def lock(self, key):
+        # hold this player's record lock, e.g. for a whole round (see storage.locked)
+        return self._locked(self._stripe(self._encode(key)))
+
+    def _row_lock(self, slot):
+        stripe = self.stripes.get(slot)
+        if stripe is None:
+            stripe = self.stripes[slot] = self._stripe(self._name_bytes(slot))
+        return self._locked(stripe)
+
+    # index and rows (the interface MappedRecords / MappedRow use)
+    @staticmethod
+    def _encode(key):
+        return encode_player_name(key)
+
+    def _name_bytes(self, slot):
+        start = self.rows_offset + slot * self.row.size
+        return bytes(self.buf[start:start + NAME_BYTES]).rstrip(b"\0")
+
+    def name_at(self, slot):
+        return self._name_bytes(slot).decode("utf-8")
+
+    def find(self, key):
+        # row number of 'key', or -1
+        name = self._encode(key)
+        mask = self.capacity - 1
+        position = zlib.crc32(name) & mask
+        while True:
+            entry = INDEX_ENTRY.unpack_from(self.buf, INDEX_OFFSET + position * INDEX_ENTRY.size)[0]
+            if entry == 0:
+                return -1
+            if self._name_bytes(entry - 1) == name:
+                return entry - 1
+            position = (position + 1) & mask
+
+    def has_room(self, key):
+        # true if 'key' has a row or there is still a free one (see storage.has_room)
+        return self.count < self.row_capacity or self.find(key) >= 0
+
+    def insert(self, key, values=None):
+        """
+        row number of 'key', adding a row holding 'values' (zeros if None)
+        if another process hasn't already.
+        """
+        name = self._encode(key)
+        with self._locked(0):
+            slot = self.find(key)
+            if slot >= 0:
+                return slot
+            slot = self.count
+            if slot >= self.row_capacity:
+                raise ValueError(f"shared memory {self.segment_name} is full ({self.row_capacity} players)")
+            start = self.rows_offset + slot * self.row.size
+            self.buf[start:start + NAME_BYTES] = name.ljust(NAME_BYTES, b"\0")
+            if values is not None:
+                self.values.pack_into(self.buf, start + NAME_BYTES, *values)
+            mask = self.capacity - 1
+            position = zlib.crc32(name) & mask
+            while INDEX_ENTRY.unpack_from(self.buf, INDEX_OFFSET + position * INDEX_ENTRY.size)[0]:
+                position = (position + 1) & mask
+            # the row is complete before the index entry makes it visible
+            INDEX_ENTRY.pack_into(self.buf, INDEX_OFFSET + position * INDEX_ENTRY.size, slot + 1)
+            self._set(COUNT, COUNT_OFFSET, slot + 1)
+            return slot
+
+    def _bump(self, slot):
+        offset = self.sequences_offset + slot * SEQUENCE.size
+        SEQUENCE.pack_into(self.buf, offset, SEQUENCE.unpack_from(self.buf, offset)[0] + 1)
+
+    def read_field(self, slot, field):
+        return self.value.unpack_from(self.buf, self.rows_offset + slot * self.row.size + self.offsets[field])[0]
+
+    def write_field(self, slot, field, value):
+        with self._row_lock(slot):
+            self._bump(slot)
+            self.value.pack_into(self.buf, self.rows_offset + slot * self.row.size + self.offsets[field], value)
+            self._bump(slot)
+
+    def _read_row(self, slot):
+        # (sequence number, field values), retried until no write overlapped the read
+        offset = self.sequences_offset + slot * SEQUENCE.size
+        spins = 0
+        while True:
+            before = SEQUENCE.unpack_from(self.buf, offset)[0]
+            if before & 1:
+                spins += 1
+                if spins >= READ_SPINS:
+                    return self._read_row_locked(slot)
+                time.sleep(0)
+                continue
+            values = self.values.unpack_from(self.buf, self.rows_offset + slot * self.row.size + NAME_BYTES)
+            if SEQUENCE.unpack_from(self.buf, offset)[0] == before:
+                return before, values
+
+    def _read_row_locked(self, slot):
+        """
+        read a row that stays mid-write under its record lock. a live writer
+        finishes first; if the sequence is still odd, its writer died during
+        the write, so the sequence is made even again and the row (with
+        whatever that writer got to write) is read as it is.
+        """
+        offset = self.sequences_offset + slot * SEQUENCE.size
+        with self._row_lock(slot):
+            sequence = SEQUENCE.unpack_from(self.buf, offset)[0]
+            if sequence & 1:
+                sequence += 1
+                SEQUENCE.pack_into(self.buf, offset, sequence)
+            return sequence, self.values.unpack_from(self.buf, self.rows_offset + slot * self.row.size + NAME_BYTES)
+
+    def read_values(self, slot):
+        return self._read_row(slot)[1]
+
+    def write_values(self, slot, values):
+        with self._row_lock(slot):
+            self._bump(slot)
+            self.values.pack_into(self.buf, self.rows_offset + slot * self.row.size + NAME_BYTES, *values)
+            self._bump(slot)
+
+    # storage interface
+    def load(self):
+        return SharedRecords(self)
+
+    def record(self, key, value):
+        # rows are changed in place; only plain dicts need copying in
+        SharedRecords(self).set(key, value)
+
+    def save(self, records):
+        # rows can't be removed from a live segment, so a full save updates or adds
+        for key, value in records.items():
+            self.record(key, value)
+
+    def batch(self):
+        return nullcontext()
+
+    # persistence
+    def claim(self):
+        # become the writer if there is none, or it has died
+        with self._locked(0):
+            writer = self._get(WRITER, WRITER_OFFSET)
+            if writer == 0 or (writer != os.getpid() and not _alive(writer)):
+                # rows this process hasn't saved itself are saved on its first tick
+                self._set(WRITER, WRITER_OFFSET, os.getpid())
+
+    def is_writer(self):
+        return self._get(WRITER, WRITER_OFFSET) == os.getpid()
+
+    def persist(self):
+        # writer only: save the rows changed since the last save to the backing storage
+        with self.persist_lock:
+            if not self.is_writer():
+                return 0
+            saved = 0
+            for slot in range(self.count):
+                sequence = SEQUENCE.unpack_from(self.buf, self.sequences_offset + slot * SEQUENCE.size)[0]
+                if self.persisted.get(slot) == sequence:
+                    continue
+                sequence, values = self._read_row(slot)
+                self.backing.record(self.name_at(slot), dict(zip(self.fields, values)))
+                self.persisted[slot] = sequence
+                saved += 1
+            if saved and hasattr(self.backing, "flush"):
+                self.backing.flush()
+            return saved
+
+    def flush(self):
+        if self.closed:
+            return
+        self.claim()
+        self.persist()
+
+    def _run_persister(self, interval):
+        while not self.stop.wait(interval):
+            try:
+                self.claim()
+                self.persist()
+            except Exception as e:
+                print(f"Error saving shared records: {e}")
+
+    def close(self):
+        if self.closed:
+            return
+        self.stop.set()
+        self.persister.join()
+        with self._locked(0):
+            self._replace_process(os.getpid(), 0)
+            last = not self._processes()
+            if last:
+                # the last one out saves everything
+                self._set(WRITER, WRITER_OFFSET, os.getpid())
+            if self.is_writer():
+                self.persist()
+                self._set(WRITER, WRITER_OFFSET, 0)
+            self.closed = True
+            del self.buf
+            self.shm.close()
+            if last:
+                _unlink_segment(self.shm)
+        self.backing.close()
+        self.lock_file.close()
+
+
+def share_storages(storages, name, capacity=SHARED_CAPACITY, persist_interval=1.0):
+    """
+    replace the leaderboard and balances storages in 'storages' (as built
+    by open_storages) with SharedMemoryStorage segments "<name>-leaderboard"
+    and "<name>-balances" backed by them. achievements are left alone.
+    """
+    shared = dict(storages)
+    for store in ("leaderboard", "balances"):
+        shared[store] = SharedMemoryStorage(f"{name}-{store}", storages[store], SQL_TABLES[store],
+                                            capacity, persist_interval)
+    return shared
+
+
+# stress test
+STRESS_BALANCE = 10 ** 9
+
+
+def _stress_stores(segment, directory):
+    from HashleyJohn import BalanceManager, Leaderboard
+    storages = share_storages({
+        store: WriteBehind(JsonStorage(os.path.join(directory, f"{store}.json")), None, None)
+        for store in ("leaderboard", "balances")
+    }, segment, capacity=1000, persist_interval=0.2)
+    return Leaderboard(storage=storages["leaderboard"]), BalanceManager(storage=storages["balances"])
+
+
+def _stress_worker(segment, directory, seed, rounds, players, results):
+    # play 'rounds' random results on a few shared players and report what was played
+    from HashleyJohn import record_round_result
+    leaderboard, balance_manager = _stress_stores(segment, directory)
+    rng = random.Random(seed)
+    played = {}
+    for _ in range(rounds):
+        name = f"player{rng.randrange(players)}"
+        outcome = rng.choice(("win", "loss", "tie"))
+        bet = rng.randint(1, 5)
+        record_round_result(leaderboard, balance_manager, name, outcome, bet)
+        tally = played.setdefault(name, {"win": 0, "loss": 0, "tie": 0, "net": 0})
+        tally[outcome] += 1
+        tally["net"] += bet if outcome == "win" else -bet if outcome == "loss" else 0
+    leaderboard.storage.close()
+    balance_manager.storage.close()
+    results.put(played)
+
+
+def stress(processes=4, rounds=2000, players=8):
+    """
+    'processes' processes play 'rounds' rounds each on the same 'players'
+    players at once. returns (lost updates, rounds/sec): the lost updates
+    are the mismatches between what was played and what the shared
+    records and the saved json files say, and should be an empty list.
+    """
+    directory = tempfile.mkdtemp(prefix="lucky9-stress-")
+    segment = f"lucky9-stress-{os.getpid()}"
+    leaderboard, balance_manager = _stress_stores(segment, directory)
+    # balances high enough that no one goes bust, so the expected balance is exact
+    for i in range(players):
+        balance_manager.data_map.set(f"player{i}", {"initial_balance": STRESS_BALANCE,
+                                                    "current_balance": STRESS_BALANCE})
+    results = Queue()
+    workers = [
+        Process(target=_stress_worker, args=(segment, directory, seed, rounds, players, results))
+        for seed in range(processes)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    tallies = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    expected = {}
+    for played in tallies:
+        for name, tally in played.items():
+            total = expected.setdefault(name, {"win": 0, "loss": 0, "tie": 0, "net": 0})
+            for key in total:
+                total[key] += tally[key]
+
+    def check(source, stats_of, balance_of):
+        lost = []
+        for name, total in expected.items():
+            stats = stats_of(name)
+            want = (total["win"], total["loss"], total["tie"], total["win"] + total["loss"] + total["tie"])
+            have = (stats["wins"], stats["losses"], stats["ties"], stats["total_games"])
+            if have != want:
+                lost.append(f"{source}: {name} played {want}, recorded {have}")
+            if balance_of(name) != STRESS_BALANCE + total["net"]:
+                lost.append(f"{source}: {name} balance {balance_of(name)}, expected {STRESS_BALANCE + total['net']}")
+        return lost
+
+    lost = check("shared", lambda name: leaderboard.data[name],
+                 lambda name: balance_manager.data_map.get(name)["current_balance"])
+    leaderboard.storage.close()
+    balance_manager.storage.close()
+    saved_stats = JsonStorage(os.path.join(directory, "leaderboard.json")).load()
+    saved_balances = JsonStorage(os.path.join(directory, "balances.json")).load()
+    lost += check("saved", saved_stats.__getitem__, lambda name: saved_balances[name]["current_balance"])
+    return lost, processes * rounds / elapsed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Lucky 9 shared-memory player records")
+    parser.add_argument("--stress", action="store_true",
+                        help="run concurrent processes on the same players and check that no update is lost")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=2000, help="rounds per process")
+    parser.add_argument("--players", type=int, default=8, help="players shared by all processes")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.stress:
+        print("nothing to do; see --help")
+        return
+    lost, rate = stress(args.processes, args.rounds, args.players)
+    print("============================================")
+    print(f"STRESS: {args.processes} processes x {args.rounds} rounds on {args.players} players")
+    print("============================================")
+    for problem in lost:
+        print(problem)
+    print(f"Lost updates: {len(lost)} | {rate:,.0f} rounds/sec")
+    print("============================================")
+    if lost:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+multi-core monte carlo simulator for lucky 9 house rules.
+
+rounds are split into fixed-size shards. every shard gets its own
+random.Random stream derived from (seed, shard index), so a run is
+reproducible no matter how many worker processes play the shards.
+each worker only sends back a handful of counters, which are merged
+into win/loss/tie rates, the house edge and 95% confidence intervals.
+
+example:
+    python simulator.py --rounds 10000000 --workers 8 --seed 1 --output summary.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+from multiprocessing import Pool
+
+from HashleyJohn import (
+    POLICIES,
+    balance_after_loss,
+    load_policy,
+    make_banker_rule,
+    make_deck,
+    play_round,
+)
+
+# z value for a two-sided 95% confidence interval
+Z_95 = 1.959963984540054
+# counters returned by every shard and summed by merge_shards
+COUNTER_FIELDS = (
+    "rounds", "wins", "losses", "ties", "player_hits", "banker_draws",
+    "wagered", "player_net", "busts", "replenished",
+)
+
+
+def shard_rng(seed, shard):
+    # independent, reproducible stream per shard (str seeds are hashed with sha512)
+    return random.Random(f"lucky9:{seed}:{shard}")
+
+
+def run_shard(task):
+    """
+    play one shard of rounds and return its counters as a dict.
+    'task' is a plain tuple so it pickles cheaply:
+      (seed, shard, rounds, policy_name, always_below, chase_below,
+       replenish_fraction, bet, initial_balance, backend, shoe)
+    where 'shoe' is (decks, penetration, draw_mode) as taken by make_deck.
+    the "numpy" backend deals a fresh deck every round and plays flat unit
+    bets with no bankroll (see batchdealer.py); simulate() refuses settings
+    it can't model.
+    """
+    (seed, shard, rounds, policy_name, always_below, chase_below,
+     replenish_fraction, bet, initial_balance, backend, shoe) = task
+    if backend == "numpy":
+        # imported lazily so the scalar backend never needs numpy
+        from batchdealer import run_batches
+        return run_batches(rounds, seed, shard, policy_name, always_below, chase_below)
+
+    rng = shard_rng(seed, shard)
+    policy = load_policy(policy_name)
+    banker_rule = make_banker_rule(always_below, chase_below)
+    deck = make_deck(shoe[0], shoe[1], rng, shoe[2])
+
+    wins = losses = ties = player_hits = banker_hits = 0
+    wagered = player_net = busts = replenished = 0
+    balance = initial_balance
+    for _ in range(rounds):
+        result = play_round(deck, policy, rng, banker_rule)
+        # flat betting, capped by what the player still has
+        stake = bet if bet < balance else balance
+        wagered += stake
+        if len(result.player_hand) > 2:
+            player_hits += 1
+        if len(result.banker_hand) > 2:
+            banker_hits += 1
+        outcome = result.outcome
+        if outcome == "win":
+            wins += 1
+            balance += stake
+            player_net += stake
+        elif outcome == "loss":
+            losses += 1
+            player_net -= stake
+            # the bust-replenish policy may hand chips back to the player
+            after = balance_after_loss(balance, initial_balance, stake, replenish_fraction)
+            if balance - stake <= 0:
+                busts += 1
+                replenished += after - (balance - stake)
+            balance = after
+        else:
+            ties += 1
+
+    return {
+        "rounds": rounds, "wins": wins, "losses": losses, "ties": ties,
+        "player_hits": player_hits, "banker_draws": banker_hits,
+        "wagered": wagered, "player_net": player_net,
+        "busts": busts, "replenished": replenished,
+    }
+
+
+def merge_shards(shard_results):
+    # sum the counters of every shard
+    totals = {field: 0 for field in COUNTER_FIELDS}
+    for counters in shard_results:
+        for field in COUNTER_FIELDS:
+            totals[field] += counters[field]
+    return totals
+
+
+def wilson_interval(successes, trials, z=Z_95):
+    # 95% wilson score interval for a proportion
+    if trials == 0:
+        return [0.0, 0.0]
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    centre = (p + z * z / (2 * trials)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return [centre - margin, centre + margin]
+
+
+def summarize(totals):
+    """
+    turn merged counters into rates, house edge and confidence intervals.
+    the house edge is per unit bet: each round pays +1 (win), -1 (loss) or 0.
+    """
+    n = totals["rounds"]
+    summary = {"counts": totals}
+    if n == 0:
+        return summary
+    wins, losses, ties = totals["wins"], totals["losses"], totals["ties"]
+    for name, count in (("win", wins), ("loss", losses), ("tie", ties)):
+        summary[f"{name}_rate"] = count / n
+        summary[f"{name}_rate_ci95"] = wilson_interval(count, n)
+
+    # per-round player payout has mean (wins - losses) / n and
+    # second moment (wins + losses) / n
+    mean = (wins - losses) / n
+    variance = (wins + losses) / n - mean * mean
+    margin = Z_95 * math.sqrt(max(variance, 0.0) / n)
+    summary["house_edge"] = -mean
+    summary["house_edge_ci95"] = [-mean - margin, -mean + margin]
+    summary["payout_variance"] = variance
+
+    # bankroll view: replenished chips are money the house gives back
+    wagered = totals["wagered"]
+    if wagered:
+        summary["bankroll_house_edge"] = -totals["player_net"] / wagered
+        summary["bankroll_house_edge_after_replenish"] = (
+            (-totals["player_net"] - totals["replenished"]) / wagered
+        )
+    summary["bust_rate"] = totals["busts"] / n
+    summary["player_hit_rate"] = totals["player_hits"] / n
+    summary["banker_draw_rate"] = totals["banker_draws"] / n
+    return summary
+
+
+def build_tasks(rounds, shard_size, seed, policy_name, always_below, chase_below,
+                replenish_fraction, bet, initial_balance, backend="scalar", shoe=(1, None, "index")):
+    # split the run into shards; the split does not depend on the worker count
+    tasks = []
+    shard = 0
+    remaining = rounds
+    while remaining > 0:
+        size = min(shard_size, remaining)
+        tasks.append((seed, shard, size, policy_name, always_below, chase_below,
+                      replenish_fraction, bet, initial_balance, backend, shoe))
+        remaining -= size
+        shard += 1
+    return tasks
+
+
+def simulate(rounds, workers=None, seed=0, policy_name="threshold", always_below=3,
+             chase_below=6, replenish_fraction=0.5, bet=10, initial_balance=100,
+             shard_size=250_000, backend="scalar", decks=1, penetration=None, draw_mode="index"):
+    """
+    run the simulation across a process pool and return the summary dict.
+    workers=1 runs in-process, which is handy for profiling.
+    """
+    workers = workers or os.cpu_count() or 1
+    if backend == "numpy":
+        # imported lazily so the scalar backend never needs numpy
+        from batchdealer import HIT_TABLES
+        if policy_name not in HIT_TABLES:
+            raise ValueError(f"--backend numpy only plays the {', '.join(sorted(HIT_TABLES))} policies")
+        if (decks, penetration, draw_mode) != (1, None, "index"):
+            raise ValueError("--backend numpy deals a fresh single deck every round (no --decks, "
+                             "--penetration or --draw)")
+    tasks = build_tasks(rounds, shard_size, seed, policy_name, always_below, chase_below,
+                        replenish_fraction, bet, initial_balance, backend,
+                        (decks, penetration, draw_mode))
+    start = time.perf_counter()
+    if workers == 1 or len(tasks) <= 1:
+        shard_results = [run_shard(task) for task in tasks]
+    else:
+        with Pool(processes=min(workers, len(tasks))) as pool:
+            shard_results = list(pool.imap_unordered(run_shard, tasks))
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(merge_shards(shard_results))
+    summary["config"] = {
+        "rounds": rounds, "seed": seed, "policy": policy_name,
+        "banker_always_below": always_below, "banker_chase_below": chase_below,
+        "replenish_fraction": replenish_fraction, "bet": bet,
+        "initial_balance": initial_balance, "shard_size": shard_size,
+        "shards": len(tasks), "workers": workers, "backend": backend,
+        "decks": decks, "penetration": penetration, "draw_mode": draw_mode,
+    }
+    if backend == "numpy":
+        from batchdealer import DECK_MODEL
+        # settings the numpy backend doesn't model aren't reported as if they were applied
+        for field in ("replenish_fraction", "bet", "initial_balance", "penetration", "draw_mode"):
+            summary["config"][field] = None
+        summary["config"]["deck_model"] = DECK_MODEL
+    summary["elapsed_seconds"] = elapsed
+    summary["rounds_per_second"] = rounds / elapsed if elapsed > 0 else None
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Lucky 9 monte carlo simulator")
+    parser.add_argument("--rounds", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--policy", default="threshold",
+                        help=f"{', '.join(sorted(POLICIES))} or module:function")
+    parser.add_argument("--banker-always", type=int, default=3,
+                        help="banker always draws below this total")
+    parser.add_argument("--banker-chase", type=int, default=6,
+                        help="banker draws below this total when the player is ahead")
+    parser.add_argument("--replenish", type=float, default=None,
+                        help="fraction of the initial balance given back on a bust (default 0.5)")
+    parser.add_argument("--bet", type=int, default=None, help="flat bet per round (default 10)")
+    parser.add_argument("--initial-balance", type=int, default=None, help="default 100")
+    parser.add_argument("--shard-size", type=int, default=250_000)
+    parser.add_argument("--backend", choices=["scalar", "numpy"], default="scalar",
+                        help="numpy deals a fresh deck per round in whole batches of arrays, "
+                             "with flat unit bets and the stand/threshold policies (needs numpy)")
+    parser.add_argument("--decks", type=int, default=None, help="decks in the shoe (default 1)")
+    parser.add_argument("--penetration", type=float, default=None,
+                        help="share of the shoe dealt before reshuffling (default 0.75 for shoes)")
+    parser.add_argument("--draw", choices=["index", "weighted"], default=None)
+    parser.add_argument("--output", default=None, help="write the json summary here")
+    args = parser.parse_args(argv)
+    # scalar-only settings: refused with --backend numpy rather than silently ignored
+    scalar_only = {"--replenish": "replenish", "--bet": "bet", "--initial-balance": "initial_balance",
+                   "--decks": "decks", "--penetration": "penetration", "--draw": "draw"}
+    if args.backend == "numpy":
+        given = [option for option, name in scalar_only.items() if getattr(args, name) is not None]
+        if given:
+            parser.error(f"--backend numpy doesn't support {', '.join(given)} "
+                         "(it deals a fresh deck every round with flat unit bets)")
+        from batchdealer import HIT_TABLES
+        if args.policy not in HIT_TABLES:
+            parser.error(f"--backend numpy only plays the {', '.join(sorted(HIT_TABLES))} policies")
+    for name, default in (("replenish", 0.5), ("bet", 10), ("initial_balance", 100), ("decks", 1),
+                          ("draw", "index")):
+        if getattr(args, name) is None:
+            setattr(args, name, default)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    summary = simulate(
+        args.rounds, args.workers, args.seed, args.policy, args.banker_always,
+        args.banker_chase, args.replenish, args.bet, args.initial_balance, args.shard_size,
+        args.backend, args.decks, args.penetration, args.draw,
+    )
+    text = json.dumps(summary, indent=4)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
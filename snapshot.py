@@ -0,0 +1,128 @@
+"""
+compact, versioned binary snapshots of a game session.
+
+a snapshot holds everything needed to continue a session exactly where it
+stopped: the deck or shoe (card order, position, cut card and counts), the
+table's random.Random state, the current player, rounds played with their
+outcome counts, and the pending action history. restore_session() in
+HashleyJohn.py turns it back into a deck and rng that deal the same cards,
+in the same order, as a session that never stopped, plus the action
+history as a LinkedList.
+
+layout (little endian):
+  header   magic, version, deck kind, draw mode, decks, penetration, size,
+           cut, position, card count, rounds, wins, losses, ties, gauss
+           flag + value, name length, history entries
+  counts   remaining cards per value (index 0 unused)
+  rng      the 625 words of the mersenne twister state
+  cards    one byte per card
+  name     utf-8
+  history  per entry: length + utf-8
+
+packing is a handful of struct calls, so a snapshot costs microseconds to
+take or restore and a few kB on disk (2.5 kB of it is the rng state).
+"""
+import os
+import struct
+from collections import namedtuple
+
+from storage import atomic_write_bytes
+
+SNAPSHOT_MAGIC = b"L9SS"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sHBBHdIIIIQQQQBdHH")
+# remaining cards per value 1-10, index 0 unused (like Shoe.card_count)
+SNAPSHOT_COUNTS = struct.Struct("<11i")
+# random.Random state: 624 twister words plus the position
+SNAPSHOT_RNG = struct.Struct("<625I")
+SNAPSHOT_LENGTH = struct.Struct("<H")
+
+DECK_KINDS = ("deck", "shoe")
+DRAW_MODES = ("index", "weighted")
+
+# a decoded snapshot. 'cards' is bytes, 'card_count' a tuple indexed by value,
+# 'rng_state' is for random.Random.setstate, 'counts' is {"win", "loss", "tie"}.
+Snapshot = namedtuple(
+    "Snapshot",
+    "deck_kind draw_mode decks penetration size cut position cards card_count rng_state "
+    "player_name rounds counts history",
+)
+
+
+def take_snapshot(deck, rng, player_name="", rounds=0, counts=None, history=()):
+    """
+    pack a session into bytes. 'deck' is a Deck or Shoe, 'rng' the table's
+    random.Random (or the random module), 'history' any iterable of action
+    strings (e.g. the current round's LinkedList).
+    """
+    counts = counts or {}
+    _, words, gauss = rng.getstate()
+    name = player_name.encode("utf-8")
+    entries = [entry.encode("utf-8") for entry in history]
+    if isinstance(deck.card_count, dict):
+        # single deck: the remaining cards are the whole state
+        kind, draw_mode, decks, penetration, size, cut, position = 0, 0, 1, 0.0, 0, 0, 0
+        cards = bytes(deck.cards)
+        card_count = [0] + [deck.card_count[value] for value in range(1, 11)]
+    else:
+        kind, draw_mode = 1, DRAW_MODES.index(deck.draw_mode)
+        decks, penetration, size, cut, position = deck.decks, deck.penetration, deck.size, deck.cut, deck.position
+        cards = deck.cards.tobytes()
+        card_count = deck.card_count
+    parts = [
+        SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION, kind, draw_mode, decks, penetration, size, cut,
+            position, len(cards), rounds, counts.get("win", 0), counts.get("loss", 0),
+            counts.get("tie", 0), gauss is not None, gauss or 0.0, len(name), len(entries),
+        ),
+        SNAPSHOT_COUNTS.pack(*card_count),
+        SNAPSHOT_RNG.pack(*words),
+        cards,
+        name,
+    ]
+    for entry in entries:
+        parts.append(SNAPSHOT_LENGTH.pack(len(entry)))
+        parts.append(entry)
+    return b"".join(parts)
+
+
+def restore_snapshot(data):
+    # decode take_snapshot() bytes into a Snapshot
+    (magic, version, kind, draw_mode, decks, penetration, size, cut, position, card_total, rounds,
+     wins, losses, ties, has_gauss, gauss, name_length, entries) = SNAPSHOT_HEADER.unpack_from(data, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("not a Lucky 9 snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"unsupported snapshot version {version}")
+    offset = SNAPSHOT_HEADER.size
+    card_count = SNAPSHOT_COUNTS.unpack_from(data, offset)
+    offset += SNAPSHOT_COUNTS.size
+    rng_state = (3, SNAPSHOT_RNG.unpack_from(data, offset), gauss if has_gauss else None)
+    offset += SNAPSHOT_RNG.size
+    cards = bytes(data[offset:offset + card_total])
+    offset += card_total
+    player_name = bytes(data[offset:offset + name_length]).decode("utf-8")
+    offset += name_length
+    history = []
+    for _ in range(entries):
+        (length,) = SNAPSHOT_LENGTH.unpack_from(data, offset)
+        offset += SNAPSHOT_LENGTH.size
+        history.append(bytes(data[offset:offset + length]).decode("utf-8"))
+        offset += length
+    return Snapshot(
+        DECK_KINDS[kind], DRAW_MODES[draw_mode], decks, penetration, size, cut, position, cards,
+        card_count, rng_state, player_name, rounds, {"win": wins, "loss": losses, "tie": ties}, history,
+    )
+
+
+def write_snapshot(file_path, data):
+    # replace the snapshot file atomically, so a crash mid-write keeps the last one
+    atomic_write_bytes(file_path, data)
+
+
+def read_snapshot(file_path):
+    # the Snapshot saved in 'file_path', or None if there is none yet
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, "rb") as file:
+        return restore_snapshot(file.read())
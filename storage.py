@@ -0,0 +1,1251 @@
+"""
+pluggable persistence for the leaderboard, achievements and balances.
+
+every storage backend offers the same small interface:
+  load()             -> dict of key -> record, read once at startup
+  record(key, value) -> persist one player's changed record
+  save(records)      -> persist the full table
+  batch()            -> context manager grouping several writes
+  close()
+
+and, for writing from a background thread:
+  prepare(changes)   -> serialize changed records into a payload (caller's thread)
+  write_prepared(p)  -> persist that payload (safe to run in a worker thread)
+
+WriteBehind wraps any backend so that record() only marks the player
+dirty; dirty records are flushed together on a size/time policy, at exit
+and on SIGTERM (see install_flush_handlers).
+
+backends:
+  JsonStorage     the original behavior: one json file rewritten in full
+  JournalStorage  json snapshot + append-only journal, O(1) per change
+  SQLiteStorage   indexed per-player rows in a WAL-mode sqlite database
+  ShardedStorage  json shards keyed by a hash of the player name; players
+                  are read on demand, so startup doesn't scan every record
+  MappedStorage   fixed-width binary rows in a memory-mapped file with an
+                  on-disk hash index; counters are updated in place
+"""
+import argparse
+import atexit
+import json
+import mmap
+import os
+import signal
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager, nullcontext
+
+# default json file of each store
+FILE_NAMES = {
+    "leaderboard": "leaderboard.json",
+    "achievements": "achievements.json",
+    "balances": "balances.json",
+}
+# default sqlite database file
+DATABASE_PATH = "lucky9.db"
+# default record file of each fixed-width store (achievements stay json)
+RECORD_FILES = {
+    "leaderboard": "leaderboard.rec",
+    "balances": "balances.rec",
+}
+# integer type of the fields in each record file: int32 counters, int64 balances
+RECORD_FORMATS = {
+    "leaderboard": "i",
+    "balances": "q",
+}
+# default shard directory of each store
+SHARD_DIRECTORIES = {
+    "leaderboard": "leaderboard.shards",
+    "achievements": "achievements.shards",
+    "balances": "balances.shards",
+}
+
+
+def atomic_write_text(file_path, text):
+    """
+    write 'text' to a temp file, fsync it and rename it over 'file_path',
+    so readers see either the old or the new file, never a truncated one.
+    """
+    temp_path = file_path + ".tmp"
+    with open(temp_path, "w") as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, file_path)
+
+
+def atomic_write_bytes(file_path, data):
+    # the binary twin of atomic_write_text
+    temp_path = file_path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, file_path)
+
+
+def atomic_write_json(file_path, data, indent=4):
+    # serialize first so a failing json.dumps never touches the file
+    atomic_write_text(file_path, json.dumps(data, indent=indent))
+
+
+class JsonStorage:
+    """
+    one json file holding every record, rewritten in full on each change.
+    every rewrite goes through a temp file + fsync + rename.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.records = {}
+
+    def load(self):
+        # load the whole file; a missing file means no records yet
+        self.records = {}
+        if os.path.exists(self.file_path):
+            with open(self.file_path, "r") as file:
+                self.records = json.load(file)
+        return self.records
+
+    def record(self, key, value):
+        # any change rewrites the whole file
+        self.records[key] = value
+        self.save(self.records)
+
+    def save(self, records):
+        self.records = records
+        atomic_write_json(self.file_path, records)
+
+    def prepare(self, changes):
+        # the whole file is rewritten, so serialize every record now
+        self.records.update(changes)
+        return json.dumps(self.records, indent=4)
+
+    def write_prepared(self, payload):
+        atomic_write_text(self.file_path, payload)
+
+    def batch(self):
+        # every write is already standalone
+        return nullcontext()
+
+    def close(self):
+        pass
+
+
+class JournalStorage(JsonStorage):
+    """
+    snapshot + append-only journal. the json file is the snapshot and every
+    change is appended to '<file>.journal' as one json line, so saving one
+    player's record costs O(1) no matter how many players exist. on startup
+    the journal is replayed on top of the snapshot, and every 'compact_every'
+    lines a fresh snapshot is written atomically and the journal is emptied.
+    """
+    def __init__(self, file_path, compact_every=1000, sync=False):
+        super().__init__(file_path)
+        # one json line per change: {"key": ..., "value": ...}
+        self.journal_path = file_path + ".journal"
+        # rewrite the snapshot after this many journal lines
+        self.compact_every = compact_every
+        # fsync every append (slower, but survives power loss)
+        self.sync = sync
+        self.pending = 0
+        self.journal_file = None
+
+    def load(self):
+        """
+        rebuild state from the snapshot and replay the journal on top.
+        a torn last line (crash mid-append) is cut off the journal, so the
+        next append starts on a line of its own.
+        """
+        super().load()
+        self.pending = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb+") as file:
+                # bytes up to the end of the last complete line
+                complete = 0
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break
+                    complete += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.records[entry["key"]] = entry["value"]
+                    self.pending += 1
+                if complete < file.tell():
+                    file.truncate(complete)
+        return self.records
+
+    def append(self, lines):
+        # write journal lines and push them to the os (and disk when syncing)
+        if self.journal_file is None:
+            self.journal_file = open(self.journal_path, "a")
+        self.journal_file.write(lines)
+        self.journal_file.flush()
+        if self.sync:
+            os.fsync(self.journal_file.fileno())
+
+    def record(self, key, value):
+        # append one change to the journal; compact when it grows too long
+        self.records[key] = value
+        self.append(json.dumps({"key": key, "value": value}, separators=(",", ":")) + "\n")
+        self.pending += 1
+        if self.pending >= self.compact_every:
+            self.compact()
+
+    def save(self, records):
+        # a full save is a compaction
+        self.records = records
+        self.compact()
+
+    def prepare(self, changes):
+        # journal lines for the changes, plus a snapshot when it's time to compact
+        self.records.update(changes)
+        lines = "".join(
+            json.dumps({"key": key, "value": value}, separators=(",", ":")) + "\n"
+            for key, value in changes.items()
+        )
+        self.pending += len(changes)
+        snapshot = None
+        if self.pending >= self.compact_every:
+            snapshot = json.dumps(self.records, indent=4)
+            self.pending = 0
+        return lines, snapshot
+
+    def write_prepared(self, payload):
+        lines, snapshot = payload
+        if snapshot is None:
+            self.append(lines)
+            return
+        # the snapshot already includes these lines, so the journal restarts empty
+        atomic_write_text(self.file_path, snapshot)
+        if self.journal_file is not None:
+            self.journal_file.close()
+        self.journal_file = open(self.journal_path, "w")
+
+    def compact(self):
+        # write a fresh snapshot atomically, then start an empty journal
+        atomic_write_json(self.file_path, self.records)
+        if self.journal_file is not None:
+            self.journal_file.close()
+        self.journal_file = open(self.journal_path, "w")
+        self.pending = 0
+
+    def close(self):
+        # close the journal file handle (the data is already on disk)
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+
+
+class SQLiteDatabase:
+    """
+    one sqlite connection shared by the three stores. writes made inside
+    batch() are committed together in a single transaction.
+    """
+    def __init__(self, path=DATABASE_PATH, check_same_thread=True):
+        self.path = path
+        # check_same_thread=False lets a background flusher thread write
+        self.connection = sqlite3.connect(path, check_same_thread=check_same_thread)
+        # write-ahead logging: readers don't block the writer
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.batch_depth = 0
+
+    @contextmanager
+    def batch(self):
+        # group every write in the block into one transaction
+        self.batch_depth += 1
+        try:
+            yield
+        except BaseException:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self.connection.rollback()
+            raise
+        self.batch_depth -= 1
+        if self.batch_depth == 0:
+            self.connection.commit()
+
+    def commit(self):
+        # commit now unless an enclosing batch will do it
+        if self.batch_depth == 0:
+            self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+# per-player row layout of the column-based tables
+SQL_TABLES = {
+    "leaderboard": ("wins", "losses", "ties", "total_games"),
+    "balances": ("initial_balance", "current_balance"),
+}
+
+
+class SQLiteStorage:
+    """
+    one row per player in 'table' (leaderboard or balances), keyed by name.
+    """
+    def __init__(self, database, table):
+        self.database = database
+        self.table = table
+        self.columns = SQL_TABLES[table]
+        column_list = ", ".join(self.columns)
+        placeholders = ", ".join("?" for _ in self.columns)
+        self.upsert_sql = (
+            f"INSERT OR REPLACE INTO {table} (name, {column_list}) VALUES (?, {placeholders})"
+        )
+        self.select_sql = f"SELECT name, {column_list} FROM {table}"
+        columns_ddl = ", ".join(f"{column} INTEGER NOT NULL DEFAULT 0" for column in self.columns)
+        connection = database.connection
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (name TEXT PRIMARY KEY, {columns_ddl})")
+        connection.commit()
+
+    def _row(self, key, value):
+        return (key,) + tuple(value.get(column, 0) for column in self.columns)
+
+    def load(self):
+        records = {}
+        for row in self.database.connection.execute(self.select_sql):
+            records[row[0]] = dict(zip(self.columns, row[1:]))
+        return records
+
+    def record(self, key, value):
+        self.database.connection.execute(self.upsert_sql, self._row(key, value))
+        self.database.commit()
+
+    def save(self, records):
+        with self.database.batch():
+            self.database.connection.executemany(
+                self.upsert_sql, (self._row(key, value) for key, value in records.items())
+            )
+
+    def prepare(self, changes):
+        # plain tuples, detached from the live record dicts
+        return [self._row(key, value) for key, value in changes.items()]
+
+    def write_prepared(self, payload):
+        with self.database.batch():
+            self.database.connection.executemany(self.upsert_sql, payload)
+
+    def batch(self):
+        return self.database.batch()
+
+    def close(self):
+        self.database.commit()
+
+
+class SQLiteLeaderboardStorage(SQLiteStorage):
+    # the leaderboard table, plus an index on (wins desc, name) that backs ranked()
+    def __init__(self, database):
+        super().__init__(database, "leaderboard")
+        database.connection.execute(
+            "CREATE INDEX IF NOT EXISTS leaderboard_rank ON leaderboard (wins DESC, name)"
+        )
+        database.connection.commit()
+
+    def ranked(self, offset=0, limit=-1):
+        # leaderboard order straight from the (wins desc, name) index
+        rows = self.database.connection.execute(
+            f"{self.select_sql} ORDER BY wins DESC, name LIMIT ? OFFSET ?", (limit, offset)
+        )
+        return [(row[0], dict(zip(self.columns, row[1:]))) for row in rows]
+
+
+class SQLiteAchievementStorage:
+    """
+    achievements as one row per (player, title). a record is the player's
+    {title: description} dict; bookkeeping entries (titles starting with
+    "_", like the rules counters) are kept as json.
+    """
+    def __init__(self, database):
+        self.database = database
+        self.table = "achievements"
+        connection = database.connection
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS achievements ("
+            "name TEXT NOT NULL, title TEXT NOT NULL, description TEXT NOT NULL, "
+            "PRIMARY KEY (name, title))"
+        )
+        connection.commit()
+
+    def load(self):
+        records = {}
+        for name, title, description in self.database.connection.execute(
+                "SELECT name, title, description FROM achievements"):
+            if title.startswith("_"):
+                # bookkeeping entries (e.g. the rules counters) are stored as json
+                description = json.loads(description)
+            records.setdefault(name, {})[title] = description
+        return records
+
+    def _rows(self, key, value):
+        return [
+            (key, title, description if isinstance(description, str) else json.dumps(description))
+            for title, description in value.items()
+        ]
+
+    def record(self, key, value):
+        # achievements are only ever added, so upserting the titles is enough
+        self.database.connection.executemany(
+            "INSERT OR REPLACE INTO achievements (name, title, description) VALUES (?, ?, ?)",
+            self._rows(key, value),
+        )
+        self.database.commit()
+
+    def save(self, records):
+        with self.database.batch():
+            for key, value in records.items():
+                self.record(key, value)
+
+    def prepare(self, changes):
+        return [row for key, value in changes.items() for row in self._rows(key, value)]
+
+    def write_prepared(self, payload):
+        with self.database.batch():
+            self.database.connection.executemany(
+                "INSERT OR REPLACE INTO achievements (name, title, description) VALUES (?, ?, ?)",
+                payload,
+            )
+
+    def batch(self):
+        return self.database.batch()
+
+    def close(self):
+        self.database.commit()
+
+
+class LazyRecords:
+    """
+    the records of a ShardedStorage, read one player at a time. a player's
+    shard is parsed the first time they are looked up and only their
+    record is kept; at most 'cache_size' players stay cached (least
+    recently used go first). a cached record that differs from what was
+    last written is never evicted, so unsaved changes can't be lost.
+    supports the dict operations Leaderboard uses and the MyHashMap ones
+    (get / set / iter_items) Achievements and BalanceManager use.
+    """
+    def __init__(self, storage, cache_size=1024):
+        self.storage = storage
+        self.cache_size = cache_size
+        # key -> record of the players in use, least recently used first
+        self.players = OrderedDict()
+        # key -> json text of the record as last read or written (None if never written)
+        self.saved = {}
+        # keys created since the last write (not on disk yet)
+        self.new_keys = set()
+
+    def get(self, key, default=None):
+        record = self.players.get(key)
+        if record is not None:
+            self.players.move_to_end(key)
+            return record
+        record = self.storage.read_shard(self.storage.shard_of(key)).get(key)
+        if record is None:
+            return default
+        self.players[key] = record
+        self.saved[key] = json.dumps(record)
+        self.evict()
+        return record
+
+    def set(self, key, value):
+        if key not in self.players and self.get(key) is None:
+            self.new_keys.add(key)
+            self.saved[key] = None
+        self.players[key] = value
+        self.players.move_to_end(key)
+        self.evict()
+
+    def __getitem__(self, key):
+        record = self.get(key)
+        if record is None:
+            raise KeyError(key)
+        return record
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return self.storage.players + len(self.new_keys)
+
+    def evict(self):
+        # drop least recently used players that have nothing left to write
+        if len(self.players) <= self.cache_size:
+            return
+        for key in list(self.players):
+            if len(self.players) <= self.cache_size:
+                break
+            if json.dumps(self.players[key]) == self.saved[key]:
+                del self.players[key]
+                del self.saved[key]
+
+    def mark_saved(self, texts):
+        # 'texts' (key -> json text) reached disk
+        for key, text in texts.items():
+            self.new_keys.discard(key)
+            if key in self.players:
+                self.saved[key] = text
+
+    def items(self):
+        # stream every record shard by shard; cached records win over disk
+        for shard in range(self.storage.shards):
+            for key, record in self.storage.read_shard(shard).items():
+                yield key, self.players.get(key, record)
+        for key in list(self.new_keys):
+            if key in self.players:
+                yield key, self.players[key]
+
+    iter_items = items
+
+    def keys(self):
+        return (key for key, _ in self.items())
+
+    def __iter__(self):
+        return self.keys()
+
+
+class ShardedStorage:
+    """
+    records spread over 'shards' json files in 'directory' by a stable hash
+    of the key, plus index.json holding the shard count and the number of
+    players in each shard. load() only reads the index and returns a
+    LazyRecords view, so startup costs the same for ten or a million
+    players; a write rewrites just the shards of the changed players.
+    """
+    def __init__(self, directory, shards=256, cache_size=1024):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        self.cache_size = cache_size
+        self.view = None
+        os.makedirs(directory, exist_ok=True)
+        index = self.read_index()
+        # an existing layout keeps its shard count
+        self.shards = index["shards"] if index else shards
+        self.counts = index["counts"] if index else [0] * self.shards
+
+    @property
+    def players(self):
+        return sum(self.counts)
+
+    def read_index(self):
+        try:
+            with open(self.index_path, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def write_index(self):
+        atomic_write_json(self.index_path, {"shards": self.shards, "counts": self.counts}, indent=None)
+
+    def shard_of(self, key):
+        # crc32 rather than hash(), which changes between runs
+        return zlib.crc32(key.encode("utf-8")) % self.shards
+
+    def shard_path(self, shard):
+        return os.path.join(self.directory, f"shard-{shard:04d}.json")
+
+    def read_shard(self, shard):
+        try:
+            with open(self.shard_path(shard), "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def load(self):
+        self.view = LazyRecords(self, self.cache_size)
+        return self.view
+
+    def record(self, key, value):
+        self.write_prepared(self.prepare({key: value}))
+
+    def save(self, records):
+        # a full save replaces every shard
+        groups = [{} for _ in range(self.shards)]
+        for key, value in records.items():
+            groups[self.shard_of(key)][key] = value
+        for shard, group in enumerate(groups):
+            atomic_write_json(self.shard_path(shard), group, indent=None)
+            self.counts[shard] = len(group)
+        self.write_index()
+        if self.view is not None:
+            self.view.mark_saved({
+                key: json.dumps(records[key]) for key in list(self.view.players) if key in records
+            })
+
+    def prepare(self, changes):
+        # shard -> {key: json text}, serialized now so later changes don't leak in
+        payload = {}
+        for key, value in changes.items():
+            payload.setdefault(self.shard_of(key), {})[key] = json.dumps(value)
+        return payload
+
+    def write_prepared(self, payload):
+        for shard, texts in payload.items():
+            records = self.read_shard(shard)
+            for key, text in texts.items():
+                records[key] = json.loads(text)
+            atomic_write_json(self.shard_path(shard), records, indent=None)
+            self.counts[shard] = len(records)
+            if self.view is not None:
+                self.view.mark_saved(texts)
+        self.write_index()
+
+    def batch(self):
+        return nullcontext()
+
+    def close(self):
+        pass
+
+
+# record file header: magic, version, fields per row, row size, index capacity, row count
+RECORD_HEADER = struct.Struct("<8sIIIIQ")
+RECORD_MAGIC = b"LUCKY9RM"
+RECORD_VERSION = 1
+# utf-8 bytes reserved for the player name in every row
+NAME_BYTES = 32
+# one index entry: row number + 1, or 0 for an empty entry
+INDEX_ENTRY = struct.Struct("<I")
+
+
+def encode_player_name(name):
+    # the name as it's stored in a fixed-width row; ValueError if it doesn't fit
+    encoded = name.encode("utf-8")
+    if len(encoded) > NAME_BYTES or b"\0" in encoded:
+        raise ValueError(f"player names are limited to {NAME_BYTES} utf-8 bytes and can't contain NUL")
+    return encoded
+
+
+def fits_record(name):
+    # true if 'name' can be stored in a fixed-width row (mmap and shared stores)
+    try:
+        encode_player_name(name)
+    except ValueError:
+        return False
+    return True
+
+
+class MappedRow:
+    """
+    one row of a MappedStorage, read and written field by field straight
+    in the mapped file. behaves like the record dict it replaces.
+    """
+    __slots__ = ("storage", "slot")
+
+    def __init__(self, storage, slot):
+        self.storage = storage
+        self.slot = slot
+
+    def __getitem__(self, field):
+        return self.storage.read_field(self.slot, field)
+
+    def __setitem__(self, field, value):
+        self.storage.write_field(self.slot, field, value)
+
+    def get(self, field, default=None):
+        if field not in self.storage.fields:
+            return default
+        return self[field]
+
+    def keys(self):
+        return self.storage.fields
+
+    def items(self):
+        return zip(self.storage.fields, self.storage.read_values(self.slot))
+
+    def __iter__(self):
+        return iter(self.storage.fields)
+
+    def __len__(self):
+        return len(self.storage.fields)
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items()) if hasattr(other, "items") else NotImplemented
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class MappedRecords:
+    """
+    the records of a MappedStorage: lookups go through the on-disk hash
+    index and return MappedRow views, so nothing is parsed or copied.
+    supports the dict operations Leaderboard uses and the MyHashMap ones
+    BalanceManager uses.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get(self, key, default=None):
+        slot = self.storage.find(key)
+        return default if slot < 0 else MappedRow(self.storage, slot)
+
+    def set(self, key, value):
+        if isinstance(value, MappedRow) and value.storage is self.storage and self.storage.find(key) == value.slot:
+            return
+        slot = self.storage.find(key)
+        if slot < 0:
+            slot = self.storage.insert(key)
+        self.storage.write_values(slot, [value.get(field, 0) for field in self.storage.fields])
+
+    def __getitem__(self, key):
+        slot = self.storage.find(key)
+        if slot < 0:
+            raise KeyError(key)
+        return MappedRow(self.storage, slot)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        return self.storage.find(key) >= 0
+
+    def __len__(self):
+        return self.storage.count
+
+    def items(self):
+        # every row in insertion order
+        for slot in range(self.storage.count):
+            yield self.storage.name_at(slot), MappedRow(self.storage, slot)
+
+    iter_items = items
+
+    def keys(self):
+        return (self.storage.name_at(slot) for slot in range(self.storage.count))
+
+    def __iter__(self):
+        return self.keys()
+
+
+class MappedStorage:
+    """
+    fixed-width binary records in a memory-mapped file:
+      header | hash index (capacity entries) | rows (2/3 of capacity)
+    each row is the utf-8 name (NAME_BYTES, zero padded) followed by one
+    'field_format' integer per field ("i" = int32, "q" = int64). the index
+    is open addressing on crc32 of the name and lives in the file, so
+    opening costs the same for any number of players. updates are packed
+    into the map in place; a flush is one msync. when the rows run out the
+    file is rebuilt with twice the capacity.
+    """
+    def __init__(self, file_path, fields, field_format="i", capacity=1024):
+        self.file_path = file_path
+        self.fields = tuple(fields)
+        self.row = struct.Struct(f"<{NAME_BYTES}s{len(self.fields)}{field_format}")
+        self.value = struct.Struct(f"<{field_format}")
+        self.values = struct.Struct(f"<{len(self.fields)}{field_format}")
+        # byte offset of each field inside a row
+        self.offsets = {
+            field: NAME_BYTES + position * self.value.size for position, field in enumerate(self.fields)
+        }
+        self.view = None
+        # a flush can run on a writer thread (server.py) while the loop grows the file
+        self.remap_lock = threading.Lock()
+        if not os.path.exists(file_path):
+            self._create(file_path, capacity, [])
+        self._open()
+
+    def _create(self, file_path, capacity, rows):
+        # write a fresh file holding 'rows' (packed row bytes) atomically
+        capacity = max(capacity, _capacity_for_rows(len(rows)))
+        index = bytearray(INDEX_ENTRY.size * capacity)
+        mask = capacity - 1
+        for slot, row in enumerate(rows):
+            position = zlib.crc32(row[:NAME_BYTES].rstrip(b"\0")) & mask
+            while INDEX_ENTRY.unpack_from(index, position * INDEX_ENTRY.size)[0]:
+                position = (position + 1) & mask
+            INDEX_ENTRY.pack_into(index, position * INDEX_ENTRY.size, slot + 1)
+        header = RECORD_HEADER.pack(RECORD_MAGIC, RECORD_VERSION, len(self.fields), self.row.size,
+                                    capacity, len(rows))
+        body = bytearray(self.row.size * (capacity * 2 // 3))
+        body[:len(rows) * self.row.size] = b"".join(rows)
+        temp_path = file_path + ".tmp"
+        with open(temp_path, "wb") as file:
+            file.write(header)
+            file.write(index)
+            file.write(body)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, file_path)
+
+    def _open(self):
+        self.file = open(self.file_path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, version, field_count, row_size, capacity, count = RECORD_HEADER.unpack_from(self.map, 0)
+        if magic != RECORD_MAGIC or version != RECORD_VERSION:
+            raise ValueError(f"{self.file_path} is not a version {RECORD_VERSION} record file")
+        if field_count != len(self.fields) or row_size != self.row.size:
+            raise ValueError(f"{self.file_path} has a different row layout")
+        self.capacity = capacity
+        self.count = count
+        self.rows_offset = RECORD_HEADER.size + INDEX_ENTRY.size * capacity
+        self.row_capacity = capacity * 2 // 3
+
+    def _close_map(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+    def _row_bytes(self):
+        return [
+            bytes(self.map[self.rows_offset + slot * self.row.size:self.rows_offset + (slot + 1) * self.row.size])
+            for slot in range(self.count)
+        ]
+
+    def _grow(self, capacity):
+        with self.remap_lock:
+            rows = self._row_bytes()
+            self._close_map()
+            self._create(self.file_path, capacity, rows)
+            self._open()
+
+    @staticmethod
+    def _encode(key):
+        return encode_player_name(key)
+
+    def _name_bytes(self, slot):
+        start = self.rows_offset + slot * self.row.size
+        return self.map[start:start + NAME_BYTES].rstrip(b"\0")
+
+    def name_at(self, slot):
+        return self._name_bytes(slot).decode("utf-8")
+
+    def find(self, key):
+        # row number of 'key', or -1
+        name = self._encode(key)
+        mask = self.capacity - 1
+        position = zlib.crc32(name) & mask
+        while True:
+            entry = INDEX_ENTRY.unpack_from(self.map, RECORD_HEADER.size + position * INDEX_ENTRY.size)[0]
+            if entry == 0:
+                return -1
+            if self._name_bytes(entry - 1) == name:
+                return entry - 1
+            position = (position + 1) & mask
+
+    def insert(self, key):
+        # add a zeroed row for a new key and return its row number
+        name = self._encode(key)
+        if self.count >= self.row_capacity:
+            self._grow(self.capacity * 2)
+        slot = self.count
+        self.map[self.rows_offset + slot * self.row.size:self.rows_offset + slot * self.row.size + NAME_BYTES] = (
+            name.ljust(NAME_BYTES, b"\0")
+        )
+        mask = self.capacity - 1
+        position = zlib.crc32(name) & mask
+        while INDEX_ENTRY.unpack_from(self.map, RECORD_HEADER.size + position * INDEX_ENTRY.size)[0]:
+            position = (position + 1) & mask
+        INDEX_ENTRY.pack_into(self.map, RECORD_HEADER.size + position * INDEX_ENTRY.size, slot + 1)
+        self.count += 1
+        # the row count is the last header field
+        struct.pack_into("<Q", self.map, RECORD_HEADER.size - 8, self.count)
+        return slot
+
+    def read_field(self, slot, field):
+        return self.value.unpack_from(self.map, self.rows_offset + slot * self.row.size + self.offsets[field])[0]
+
+    def write_field(self, slot, field, value):
+        self.value.pack_into(self.map, self.rows_offset + slot * self.row.size + self.offsets[field], value)
+
+    def read_values(self, slot):
+        return self.values.unpack_from(self.map, self.rows_offset + slot * self.row.size + NAME_BYTES)
+
+    def write_values(self, slot, values):
+        self.values.pack_into(self.map, self.rows_offset + slot * self.row.size + NAME_BYTES, *values)
+
+    def load(self):
+        self.view = MappedRecords(self)
+        return self.view
+
+    def record(self, key, value):
+        MappedRecords(self).set(key, value)
+
+    def save(self, records):
+        # a full save rebuilds the file from plain values
+        rows = [
+            self.row.pack(self._encode(key), *(value.get(field, 0) for field in self.fields))
+            for key, value in records.items()
+        ]
+        with self.remap_lock:
+            self._close_map()
+            self._create(self.file_path, _capacity_for_rows(len(rows)), rows)
+            self._open()
+
+    def prepare(self, changes):
+        # rows are updated in place already; only plain dicts still need packing
+        for key, value in changes.items():
+            if not isinstance(value, MappedRow):
+                self.record(key, value)
+        return len(changes)
+
+    def write_prepared(self, payload):
+        with self.remap_lock:
+            self.map.flush()
+
+    def batch(self):
+        return nullcontext()
+
+    def close(self):
+        self._close_map()
+
+
+def _capacity_for_rows(count):
+    # smallest power-of-two index that keeps 'count' rows at or below 2/3 load
+    capacity = 8
+    while capacity * 2 // 3 < count:
+        capacity *= 2
+    return capacity
+
+
+def record_storage(store, file_path=None):
+    # the MappedStorage of a fixed-width store ("leaderboard" or "balances")
+    return MappedStorage(file_path or RECORD_FILES[store], SQL_TABLES[store], RECORD_FORMATS[store])
+
+
+# the lazily-read record views some backends return from load()
+RECORD_VIEWS = (LazyRecords, MappedRecords)
+
+
+class WriteBehind:
+    """
+    wraps a storage backend so that record() only marks the player dirty.
+    dirty records are flushed together once 'max_dirty' of them are waiting
+    or 'max_delay' seconds have passed since the oldest unflushed change
+    (checked on each change, and in the background by start_flush_timer);
+    max_dirty=1 is write-through and None turns a limit off, leaving
+    flushes to the caller. writes inside batch() are checked against
+    the policy only when the batch ends, so one round causes at most one
+    flush. take() + write() split a flush so the disk write can run on
+    another thread. 'flush_lock' is held by every change, flush and batch.
+    """
+    def __init__(self, storage, max_dirty=64, max_delay=2.0):
+        self.storage = storage
+        self.max_dirty = max_dirty
+        self.max_delay = max_delay
+        # key -> latest value of every record changed since the last flush
+        self.dirty = {}
+        # monotonic time of the oldest unflushed change
+        self.dirty_since = None
+        self.batch_depth = 0
+        self.flushes = 0
+        # serializes changes and flushes with the flush timer thread
+        self.flush_lock = threading.RLock()
+        # backends that rank in the database (sqlite) can be ranked through the wrapper
+        if hasattr(storage, "ranked"):
+            self.ranked = self._ranked
+
+    def load(self):
+        return self.storage.load()
+
+    def _ranked(self, offset=0, limit=-1):
+        # flush first, so the query sees the changes still waiting here
+        with self.flush_lock:
+            self.flush()
+            return self.storage.ranked(offset, limit)
+
+    def record(self, key, value):
+        with self.flush_lock:
+            if not self.dirty:
+                self.dirty_since = time.monotonic()
+            self.dirty[key] = value
+            if self.batch_depth == 0:
+                self.maybe_flush()
+
+    def due(self):
+        # true when the size or time policy says it's time to flush
+        if not self.dirty:
+            return False
+        if self.max_dirty is not None and len(self.dirty) >= self.max_dirty:
+            return True
+        return self.max_delay is not None and time.monotonic() - self.dirty_since >= self.max_delay
+
+    def maybe_flush(self):
+        with self.flush_lock:
+            if self.due():
+                self.flush()
+
+    def save(self, records):
+        # an explicit full save still goes straight to disk
+        with self.flush_lock:
+            self.dirty = {}
+            self.storage.save(records)
+
+    def take(self):
+        # serialize the pending changes; returns None if there are none
+        with self.flush_lock:
+            if not self.dirty:
+                return None
+            changes = self.dirty
+            self.dirty = {}
+            return self.storage.prepare(changes)
+
+    def write(self, payload):
+        # persist a payload from take(); safe to call from a worker thread
+        if payload is not None:
+            self.storage.write_prepared(payload)
+            self.flushes += 1
+
+    def flush(self):
+        with self.flush_lock:
+            self.write(self.take())
+
+    @contextmanager
+    def batch(self):
+        # defer the flush policy check until the outermost batch ends
+        with self.flush_lock:
+            self.batch_depth += 1
+            try:
+                yield
+            finally:
+                self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self.maybe_flush()
+
+    def close(self):
+        self.flush()
+        self.storage.close()
+
+
+def install_flush_handlers(storages):
+    """
+    flush every storage when the program exits, including on SIGTERM
+    (which is turned into a normal exit so the atexit hook runs).
+    """
+    storages = list(storages)
+
+    def flush_all():
+        for storage in storages:
+            try:
+                storage.flush()
+            except Exception as e:
+                print(f"Error flushing storage: {e}")
+
+    def on_sigterm(signum, frame):
+        raise SystemExit(128 + signum)
+
+    atexit.register(flush_all)
+    signal.signal(signal.SIGTERM, on_sigterm)
+    return flush_all
+
+
+def start_flush_timer(storages, interval=0.25):
+    """
+    check the WriteBehind storages among 'storages' every 'interval'
+    seconds on a daemon thread and flush those whose 'max_delay' has
+    passed, so a change is saved on time even while the game waits for
+    input. the storages are locked together (sqlite ones share a
+    connection). returns an event that stops the thread when set.
+    """
+    storages = [
+        storage for storage in storages
+        if isinstance(storage, WriteBehind) and storage.max_delay is not None
+    ]
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            with ExitStack() as stack:
+                for storage in storages:
+                    stack.enter_context(storage.flush_lock)
+                for storage in storages:
+                    try:
+                        storage.maybe_flush()
+                    except Exception as e:
+                        print(f"Error flushing storage: {e}")
+
+    if storages:
+        threading.Thread(target=run, daemon=True).start()
+    return stop
+
+
+def open_storages(kind="json", database_path=DATABASE_PATH, threaded=False, own_connections=False):
+    """
+    build the leaderboard, achievements and balances storages for one
+    backend kind: "json", "journal", "sharded", "mmap" or "sqlite". 'threaded' allows the
+    sqlite connection to be used from a background flusher thread.
+    'own_connections' gives each sqlite store its own connection, for stores
+    saved from different threads (e.g. the shared-memory persisters).
+    wrap the results in WriteBehind to coalesce writes.
+    """
+    if kind == "json":
+        return {store: JsonStorage(file_name) for store, file_name in FILE_NAMES.items()}
+    if kind == "journal":
+        return {store: JournalStorage(file_name) for store, file_name in FILE_NAMES.items()}
+    if kind == "mmap":
+        # achievements have no fixed width, so they keep the json file + journal
+        return {
+            "leaderboard": record_storage("leaderboard"),
+            "achievements": JournalStorage(FILE_NAMES["achievements"]),
+            "balances": record_storage("balances"),
+        }
+    if kind == "sharded":
+        return {store: ShardedStorage(directory) for store, directory in SHARD_DIRECTORIES.items()}
+    if kind == "sqlite":
+        def connect():
+            return SQLiteDatabase(database_path, check_same_thread=not threaded)
+        database = connect()
+        return {
+            "leaderboard": SQLiteLeaderboardStorage(database),
+            "achievements": SQLiteAchievementStorage(connect() if own_connections else database),
+            "balances": SQLiteStorage(connect() if own_connections else database, "balances"),
+        }
+    raise ValueError(f"unknown storage kind: {kind}")
+
+
+def batched(*storages):
+    # one context manager that batches writes across several storages
+    stack = ExitStack()
+    for storage in storages:
+        stack.enter_context(storage.batch())
+    return stack
+
+
+def locked(key, *storages):
+    """
+    hold the record lock of 'key' in every storage that has one (the
+    shared-memory stores, see sharedstate.py), so a read-modify-write of
+    that player can't interleave with another process doing the same.
+    """
+    stack = ExitStack()
+    for storage in storages:
+        lock = getattr(storage, "lock", None)
+        if lock is not None:
+            stack.enter_context(lock(key))
+    return stack
+
+
+def has_room(key, *storages):
+    """
+    false if a storage with a fixed number of rows (the shared-memory
+    stores) is full and has no record for 'key', so a round can be refused
+    before any of its writes instead of failing halfway through.
+    """
+    return all(storage.has_room(key) for storage in storages if hasattr(storage, "has_room"))
+
+
+def read_json_records(store, file_name):
+    # records of one json store; balances get the BalanceManager.load_balances check
+    records = JsonStorage(file_name).load()
+    if store == "balances":
+        records = {
+            name: balances for name, balances in records.items()
+            if isinstance(balances, dict)
+            and "initial_balance" in balances and "current_balance" in balances
+        }
+    return records
+
+
+def migrate_json_to_sqlite(database_path=DATABASE_PATH, file_names=FILE_NAMES):
+    """
+    one-shot copy of leaderboard.json, achievements.json and balances.json
+    into the sqlite database. returns the number of records copied per store.
+    """
+    storages = open_storages("sqlite", database_path)
+    copied = {}
+    with batched(*storages.values()):
+        for store, file_name in file_names.items():
+            records = read_json_records(store, file_name)
+            storages[store].save(records)
+            copied[store] = len(records)
+    storages["leaderboard"].database.close()
+    return copied
+
+
+def migrate_json_to_sharded(file_names=FILE_NAMES, shards=256):
+    """
+    one-shot copy of the three json files into the sharded layout
+    (SHARD_DIRECTORIES). returns the number of records copied per store.
+    """
+    copied = {}
+    for store, file_name in file_names.items():
+        records = read_json_records(store, file_name)
+        ShardedStorage(SHARD_DIRECTORIES[store], shards).save(records)
+        copied[store] = len(records)
+    return copied
+
+
+def migrate_json_to_mmap(file_names=FILE_NAMES):
+    """
+    one-shot copy of the leaderboard and balances json files into record
+    files (RECORD_FILES). achievements keep their json file. returns the
+    number of records copied per store. names that don't fit a row raise
+    ValueError, listing all of them, before any record file is written.
+    """
+    stores = {store: read_json_records(store, file_names[store]) for store in RECORD_FILES}
+    too_long = sorted({key for records in stores.values() for key in records if not fits_record(key)})
+    if too_long:
+        raise ValueError(
+            f"{len(too_long)} player names don't fit a record ({NAME_BYTES} utf-8 bytes, no NUL): "
+            + ", ".join(repr(name) for name in too_long)
+        )
+    copied = {}
+    for store, records in stores.items():
+        storage = record_storage(store)
+        storage.save(records)
+        storage.close()
+        copied[store] = len(records)
+    return copied
+
+
+def export_mmap_to_json(file_names=FILE_NAMES):
+    """
+    write the record files back out as the leaderboard and balances json
+    files, e.g. to go back to --storage json. returns the records per store.
+    """
+    copied = {}
+    for store in RECORD_FILES:
+        storage = record_storage(store)
+        records = {key: dict(value.items()) for key, value in storage.load().items()}
+        storage.close()
+        atomic_write_json(file_names[store], records)
+        copied[store] = len(records)
+    return copied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lucky 9 storage tools")
+    parser.add_argument("--migrate-sqlite", action="store_true",
+                        help="copy the json files into the sqlite database")
+    parser.add_argument("--migrate-sharded", action="store_true",
+                        help="copy the json files into per-store shard directories")
+    parser.add_argument("--migrate-mmap", action="store_true",
+                        help="copy the leaderboard and balances json files into record files")
+    parser.add_argument("--export-mmap", action="store_true",
+                        help="write the record files back to the leaderboard and balances json files")
+    parser.add_argument("--db", default=DATABASE_PATH, help="sqlite database path")
+    parser.add_argument("--shards", type=int, default=256, help="shard files per store for --migrate-sharded")
+    args = parser.parse_args(argv)
+    if args.migrate_sqlite:
+        copied = migrate_json_to_sqlite(args.db)
+        for store, count in copied.items():
+            print(f"Migrated {count} {store} records into {args.db}")
+    elif args.migrate_sharded:
+        copied = migrate_json_to_sharded(shards=args.shards)
+        for store, count in copied.items():
+            print(f"Migrated {count} {store} records into {SHARD_DIRECTORIES[store]}")
+    elif args.migrate_mmap:
+        try:
+            copied = migrate_json_to_mmap()
+        except ValueError as e:
+            parser.exit(1, f"Nothing migrated: {e}\n")
+        for store, count in copied.items():
+            print(f"Migrated {count} {store} records into {RECORD_FILES[store]}")
+    elif args.export_mmap:
+        copied = export_mmap_to_json()
+        for store, count in copied.items():
+            print(f"Exported {count} {store} records into {FILE_NAMES[store]}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
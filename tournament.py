@@ -0,0 +1,230 @@
+"""
+parallel tournament runner for lucky 9 strategies.
+
+every strategy plays the same pre-generated shoes (common random numbers):
+shoe k is shuffled from its own random.Random stream derived from
+(seed, k), and each strategy plays rounds from that exact card order until
+the cut card. the strategies face the same deals, so the difference between
+two of them has far less noise than two independent simulations. the paired
+standard error next to the unpaired one shows how much less.
+
+shoes are split into shards played by a process pool. each worker sends
+back running sums only, so memory doesn't grow with the number of shoes.
+
+example:
+    python tournament.py --strategies stand threshold count optimal --shoes 20000 --seed 1
+    python tournament.py --strategies threshold mystrategies:cautious --baseline threshold
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+from multiprocessing import Pool
+
+from HashleyJohn import DECK_VALUES, MIN_CARDS, POLICIES, Deck, load_policy, play_round
+
+# z value for a two-sided 95% confidence interval
+Z_95 = 1.959963984540054
+# running sums kept per strategy
+SUM_FIELDS = ("rounds", "wins", "losses", "ties", "shoe_net", "shoe_net_sq", "diff", "diff_sq")
+
+
+def shoe_cards(seed, shoe, decks=1):
+    # the shuffled card order of one shoe; the same for every strategy
+    cards = DECK_VALUES * (4 * decks)
+    random.Random(f"lucky9:tournament:{seed}:{shoe}").shuffle(cards)
+    return cards
+
+
+def play_shoe(cards, policy, cut_remaining):
+    # (rounds, wins, losses, ties) of one strategy playing one shoe
+    deck = Deck.from_cards(cards)
+    rounds = wins = losses = ties = 0
+    while deck.remaining() >= cut_remaining:
+        outcome = play_round(deck, policy).outcome
+        rounds += 1
+        if outcome == "win":
+            wins += 1
+        elif outcome == "loss":
+            losses += 1
+        else:
+            ties += 1
+    return rounds, wins, losses, ties
+
+
+def run_shard(task):
+    """
+    play shoes first_shoe .. first_shoe + count - 1 with every strategy.
+    'task' is (seed, first_shoe, count, strategy specs, baseline index,
+    decks, penetration). returns one dict of SUM_FIELDS per strategy; the
+    diff sums are of each shoe's net minus the baseline's net on that shoe.
+    """
+    seed, first_shoe, count, specs, baseline, decks, penetration = task
+    policies = [load_policy(spec) for spec in specs]
+    total_cards = 40 * decks
+    # stop once the cut card is reached (never with fewer cards than a round needs)
+    cut_remaining = max(MIN_CARDS, round(total_cards * (1 - penetration)))
+    sums = [dict.fromkeys(SUM_FIELDS, 0) for _ in specs]
+    for shoe in range(first_shoe, first_shoe + count):
+        cards = shoe_cards(seed, shoe, decks)
+        nets = []
+        for policy, totals in zip(policies, sums):
+            rounds, wins, losses, ties = play_shoe(cards, policy, cut_remaining)
+            net = wins - losses
+            nets.append(net)
+            totals["rounds"] += rounds
+            totals["wins"] += wins
+            totals["losses"] += losses
+            totals["ties"] += ties
+            totals["shoe_net"] += net
+            totals["shoe_net_sq"] += net * net
+        for net, totals in zip(nets, sums):
+            diff = net - nets[baseline]
+            totals["diff"] += diff
+            totals["diff_sq"] += diff * diff
+    return sums
+
+
+def merge_shards(shard_results, strategies):
+    # sum every shard's running sums, per strategy
+    merged = [dict.fromkeys(SUM_FIELDS, 0) for _ in range(strategies)]
+    for sums in shard_results:
+        for totals, shard_totals in zip(merged, sums):
+            for field in SUM_FIELDS:
+                totals[field] += shard_totals[field]
+    return merged
+
+
+def sample_variance(total, total_sq, n):
+    if n < 2:
+        return 0.0
+    mean = total / n
+    return max(total_sq / n - mean * mean, 0.0) * n / (n - 1)
+
+
+def summarize(merged, specs, baseline, shoes):
+    """
+    per strategy: outcome rates, ev and variance per round (unit bets pay
+    +1 / -1 / 0), ev per shoe, and the per-shoe difference from the baseline
+    with its paired and unpaired standard errors.
+    """
+    base = merged[baseline]
+    base_variance = sample_variance(base["shoe_net"], base["shoe_net_sq"], shoes)
+    results = {}
+    for spec, totals in zip(specs, merged):
+        n = totals["rounds"]
+        summary = {key: totals[key] for key in ("rounds", "wins", "losses", "ties")}
+        if n:
+            mean = (totals["wins"] - totals["losses"]) / n
+            variance = (totals["wins"] + totals["losses"]) / n - mean * mean
+            margin = Z_95 * math.sqrt(max(variance, 0.0) / n)
+            summary["ev_per_round"] = mean
+            summary["ev_per_round_ci95"] = [mean - margin, mean + margin]
+            summary["variance_per_round"] = variance
+        if shoes:
+            shoe_variance = sample_variance(totals["shoe_net"], totals["shoe_net_sq"], shoes)
+            summary["ev_per_shoe"] = totals["shoe_net"] / shoes
+            summary["variance_per_shoe"] = shoe_variance
+            summary["diff_vs_baseline_per_shoe"] = totals["diff"] / shoes
+            summary["diff_se_paired"] = math.sqrt(
+                sample_variance(totals["diff"], totals["diff_sq"], shoes) / shoes)
+            summary["diff_se_unpaired"] = math.sqrt((shoe_variance + base_variance) / shoes)
+        results[spec] = summary
+    return results
+
+
+def build_tasks(shoes, shard_size, seed, specs, baseline, decks, penetration):
+    # split the shoes into shards; the split does not depend on the worker count
+    tasks = []
+    for first_shoe in range(0, shoes, shard_size):
+        count = min(shard_size, shoes - first_shoe)
+        tasks.append((seed, first_shoe, count, tuple(specs), baseline, decks, penetration))
+    return tasks
+
+
+def run_tournament(specs, shoes=10_000, workers=None, seed=0, baseline=None, decks=1,
+                   penetration=0.75, shard_size=500):
+    """
+    play every strategy over the same 'shoes' shoes across a process pool
+    and return the summary dict. strategies are POLICIES names or
+    "module:function" specs, so workers can import them. workers=1 runs
+    in-process.
+    """
+    specs = list(specs)
+    for spec in specs:
+        # fail early, before any worker starts
+        load_policy(spec)
+    baseline_index = specs.index(baseline) if baseline is not None else 0
+    workers = workers or os.cpu_count() or 1
+    tasks = build_tasks(shoes, shard_size, seed, specs, baseline_index, decks, penetration)
+    start = time.perf_counter()
+    if workers == 1 or len(tasks) <= 1:
+        shard_results = [run_shard(task) for task in tasks]
+    else:
+        with Pool(processes=min(workers, len(tasks))) as pool:
+            shard_results = list(pool.imap_unordered(run_shard, tasks))
+    elapsed = time.perf_counter() - start
+
+    merged = merge_shards(shard_results, len(specs))
+    rounds = sum(totals["rounds"] for totals in merged)
+    return {
+        "strategies": summarize(merged, specs, baseline_index, shoes),
+        "config": {
+            "strategies": specs, "baseline": specs[baseline_index], "shoes": shoes,
+            "seed": seed, "decks": decks, "penetration": penetration,
+            "shard_size": shard_size, "shards": len(tasks), "workers": workers,
+        },
+        "elapsed_seconds": elapsed,
+        "rounds_per_second": rounds / elapsed if elapsed > 0 else None,
+    }
+
+
+def print_report(report):
+    config = report["config"]
+    print("============================================")
+    print(f"TOURNAMENT: {config['shoes']} shoes x {len(config['strategies'])} strategies "
+          f"(seed: {config['seed']}, baseline: {config['baseline']})")
+    print("============================================")
+    print(f"{'Strategy':<16} {'Rounds':>10} {'EV/round':>9} {'Var/round':>9} "
+          f"{'Diff/shoe':>10} {'SE paired':>10} {'SE unpaired':>11}")
+    for spec, summary in report["strategies"].items():
+        print(f"{spec:<16} {summary['rounds']:>10} {summary.get('ev_per_round', 0.0):>+9.4f} "
+              f"{summary.get('variance_per_round', 0.0):>9.4f} "
+              f"{summary.get('diff_vs_baseline_per_shoe', 0.0):>+10.4f} "
+              f"{summary.get('diff_se_paired', 0.0):>10.4f} {summary.get('diff_se_unpaired', 0.0):>11.4f}")
+    print(f"Elapsed: {report['elapsed_seconds']:.2f}s")
+    print("============================================")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Lucky 9 strategy tournament")
+    parser.add_argument("--strategies", nargs="+", default=list(POLICIES),
+                        help=f"{', '.join(sorted(POLICIES))} or module:function")
+    parser.add_argument("--baseline", default=None,
+                        help="strategy the others are compared with (default: the first)")
+    parser.add_argument("--shoes", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--decks", type=int, default=1, help="40-card decks per shoe")
+    parser.add_argument("--penetration", type=float, default=0.75,
+                        help="share of each shoe dealt before the cut card")
+    parser.add_argument("--shard-size", type=int, default=500, help="shoes per worker task")
+    parser.add_argument("--output", default=None, help="write the json report here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_tournament(args.strategies, args.shoes, args.workers, args.seed, args.baseline,
+                            args.decks, args.penetration, args.shard_size)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()